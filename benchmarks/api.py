@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp.app import create_app
+from flaskapp.backends import local
+
+# Cities the home page offers; requests are drawn from these so the result
+# cache sees a realistic mix of repeats and new keys
+CITIES = [(29.7604, -95.3698), (28.6139, 77.2090), (17.3850, 78.4867), (40.7128, -74.0060),
+          (51.5074, -0.1278), (35.6762, 139.6503), (-23.5505, -46.6333), (19.0760, 72.8777)]
+POLLUTANTS = ['CO', 'NO2', 'SO2', 'O3', 'CH4', 'AER_AI']
+
+
+def make_requests(n, seed=0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n):
+        lat, lon = rng.choice(CITIES)
+        month = rng.randint(1, 12)
+        requests.append(f'/api/get-co-density?lat={lat}&lon={lon}&pollutant={rng.choice(POLLUTANTS)}'
+                        f'&start_date=2023-{month:02d}-01&end_date=2023-{month:02d}-28')
+    return requests
+
+
+def run(n_requests, concurrency, latency, seed=0, ee_workers=8):
+    app = create_app({'EE_BACKEND': 'local', 'LOCAL_EE_LATENCY': latency, 'EE_WORKERS': ee_workers,
+                      'RATE_LIMIT': None})
+    client = app.test_client()
+    local.reset_stats()
+
+    def call(url):
+        t0 = time.perf_counter()
+        status = client.get(url).status_code
+        return time.perf_counter() - t0, status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, make_requests(n_requests, seed)))
+    elapsed = time.perf_counter() - t0
+
+    latencies = sorted(r[0] for r in results)
+    cache = client.get('/api/cache-stats').json
+    offload = client.get('/api/ee-stats').json
+    return {
+        'requests': n_requests,
+        'errors': sum(1 for r in results if r[1] >= 500),
+        'throughput_rps': n_requests / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'rpcs_per_request': local.rpc_count() / n_requests,
+        'cache_hits': cache['hits'],
+        'coalesced': offload['coalesced'],
+        'rejected': offload['rejected'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test /api/get-co-density against the offline EE backend')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.2, help='Simulated seconds per EE round trip')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ee-workers', type=int, default=8)
+    args = parser.parse_args()
+
+    result = run(args.requests, args.concurrency, args.latency, args.seed, args.ee_workers)
+    for key, value in result.items():
+        print(f"{key:18s} {value:10.2f}" if isinstance(value, float) else f"{key:18s} {value:10d}")
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp.backends import use_local
+from lstm import dataset
+
+# Houston, as in lstm/dataset.py
+LAT, LON = 29.7604, -95.3698
+
+
+def run(start_year, end_year, chunk, workers, latency):
+    local = use_local(latency=latency)
+    local.reset_stats()
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        dataset.download_co_data(LAT, LON, start_year, end_year, chunk=chunk, max_workers=workers,
+                                 store_dir=os.path.join(tmp, 'store'),
+                                 checkpoint_dir=os.path.join(tmp, 'checkpoints'))
+        elapsed = time.perf_counter() - t0
+
+        # A second run finds everything in the checkpoint and fetches nothing
+        rpcs = local.rpc_count()
+        t0 = time.perf_counter()
+        dataset.download_co_data(LAT, LON, start_year, end_year, chunk=chunk, max_workers=workers,
+                                 store_dir=os.path.join(tmp, 'store'),
+                                 checkpoint_dir=os.path.join(tmp, 'checkpoints'))
+        resumed = time.perf_counter() - t0
+
+    days = (end_year - start_year + 1) * 365
+    return {
+        'elapsed_s': elapsed,
+        'days_per_s': days / elapsed,
+        'rpcs': rpcs,
+        'resume_s': resumed,
+        'resume_rpcs': local.rpc_count() - rpcs,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the CO history download against the offline EE backend')
+    parser.add_argument('--start-year', type=int, default=2019)
+    parser.add_argument('--end-year', type=int, default=2020)
+    parser.add_argument('--chunk', choices=['month', 'year'], default='month')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.5, help='Simulated seconds per EE round trip')
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        result = run(args.start_year, args.end_year, args.chunk, workers, args.latency)
+        print(f"workers={workers:<3d} " + '  '.join(
+            f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}" for k, v in result.items()))
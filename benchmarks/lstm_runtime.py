@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lstm.artifact import load_artifact, save_artifact
+from lstm.runtime import load_numpy_model
+from lstm.train import seq_length
+
+# Import time and memory of each runtime, measured in a fresh interpreter
+CHILD = r'''
+import json, resource, sys, time
+import numpy as np
+runtime, path = sys.argv[1], sys.argv[2]
+t0 = time.perf_counter()
+from lstm.artifact import load_artifact
+if runtime == 'numpy':
+    from lstm.runtime import load_numpy_model as load
+else:
+    from lstm.artifact import build_keras_model as load
+    from lstm.forecast import make_predictor
+t1 = time.perf_counter()
+artifact = load_artifact(path)
+model = load(artifact)
+predict = model.predict_batch if runtime == 'numpy' else make_predictor(model)
+predict(np.zeros((1, artifact.seq_length, 1), np.float32))
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'load_and_first_call_s': t2 - t1,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+}))
+'''
+
+
+class RandomModel:
+    # Stands in for the Keras model of lstm/train.py (same config and weight
+    # shapes, random weights) when TensorFlow is not installed
+
+    def __init__(self, seed=0, units=(50, 50), dense=(25, 1)):
+        rng = np.random.default_rng(seed)
+        layers = [{'class_name': 'InputLayer', 'config': {'batch_shape': [None, seq_length, 1]}}]
+        self.weights = []
+        inputs = 1
+        for i, n in enumerate(units):
+            layers.append({'class_name': 'LSTM', 'config': {
+                'units': n, 'activation': 'tanh', 'recurrent_activation': 'sigmoid', 'use_bias': True,
+                'return_sequences': i < len(units) - 1}})
+            self.weights += [rng.normal(0, 0.2, (inputs, 4 * n)), rng.normal(0, 0.2, (n, 4 * n)), np.zeros(4 * n)]
+            inputs = n
+        for n in dense:
+            layers.append({'class_name': 'Dense', 'config': {'units': n, 'activation': 'linear', 'use_bias': True}})
+            self.weights += [rng.normal(0, 0.2, (inputs, n)), np.zeros(n)]
+            inputs = n
+        self.config = {'class_name': 'Sequential', 'config': {'name': 'sequential', 'layers': layers}}
+
+    def to_json(self):
+        return json.dumps(self.config)
+
+    def get_weights(self):
+        return self.weights
+
+
+def make_artifact(path):
+    # An untrained model of the lstm/train.py architecture saved as an artifact
+    try:
+        from lstm.train import build_model
+
+        model = build_model(seq_length)
+    except ImportError:
+        model = RandomModel()
+    data = pd.DataFrame({'value': np.linspace(50, 150, 400)},
+                        index=pd.date_range('2023-01-01', periods=400, freq='D'))
+    scaler = MinMaxScaler().fit(data[['value']])
+    return save_artifact(path, model, scaler, seq_length, data, pollutant='CO', city='Benchmark')
+
+
+def cold_start(runtime, path):
+    out = subprocess.run([sys.executable, '-c', CHILD, runtime, path], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def latency(predict, batch_size, repeats):
+    x = np.random.default_rng(0).random((batch_size, seq_length, 1), dtype=np.float32)
+    predict(x)
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        predict(x)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the NumPy LSTM runtime with Keras')
+    parser.add_argument('--model', help='Artifact directory (default: an untrained model of the same shape)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        import tensorflow  # noqa: F401
+        runtimes = ['numpy', 'keras']
+    except ImportError:
+        runtimes = ['numpy']
+        print('TensorFlow is not installed; measuring the NumPy runtime only')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.model or make_artifact(os.path.join(tmp, 'co_benchmark'))
+        artifact = load_artifact(path)
+        predictors = {'numpy': load_numpy_model(artifact).predict_batch}
+        if 'keras' in runtimes:
+            from lstm.artifact import build_keras_model
+            from lstm.forecast import make_predictor
+
+            predictors['keras'] = make_predictor(build_keras_model(artifact))
+
+        for runtime in runtimes:
+            start = cold_start(runtime, path)
+            print(f"{runtime:6s} import {start['import_s'] * 1000:8.1f} ms   "
+                  f"load + first call {start['load_and_first_call_s'] * 1000:8.1f} ms   "
+                  f"max RSS {start['max_rss_mb']:7.1f} MB   tensorflow imported: {start['tensorflow_imported']}")
+        for batch_size in args.batch_sizes:
+            line = f"batch {batch_size:4d}:"
+            for runtime in runtimes:
+                seconds = latency(predictors[runtime], batch_size, args.repeats)
+                line += f"   {runtime} {seconds * 1000:7.2f} ms ({batch_size / seconds:9.0f} windows/s)"
+            print(line)
+
+        if 'keras' in runtimes:
+            x = np.random.default_rng(1).random((64, artifact.seq_length, 1), dtype=np.float32)
+            error = np.abs(predictors['numpy'](x) - predictors['keras'](x)).max()
+            print(f"max abs difference numpy vs keras: {error:.2e}")
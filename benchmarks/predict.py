@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FEATURES = ['PM2.5', 'PM10', 'NO2', 'CO', 'SO2', 'O3']
+
+
+def make_model(path, seed=0):
+    # A small gradient-boosted model standing in for xgb.pkl
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((2000, len(FEATURES))) * 100, columns=FEATURES)
+    y = X.sum(axis=1) + rng.normal(0, 5, len(X))
+    with open(path, 'wb') as f:
+        pickle.dump(GradientBoostingRegressor(n_estimators=200, max_depth=4).fit(X, y), f)
+    return X
+
+
+def rate(n, seconds):
+    return f"{n / seconds:9.0f} rows/s ({seconds / n * 1e6:8.1f} us/row)"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of /predict (one row) vs /predict/batch')
+    parser.add_argument('--requests', type=int, default=500, help='single-row requests')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per batch request')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_file = os.path.join(tmp, 'model.pkl')
+        X = make_model(model_file)
+        os.environ['MODEL_FILE'] = model_file
+        from scripts import flask_app
+
+        client = flask_app.app.test_client()
+        rows = X.sample(args.rows, replace=True, random_state=0).to_dict(orient='records')
+
+        # What every request used to do: unpickle the model, predict one row
+        n = min(args.requests, 100)
+        t0 = time.perf_counter()
+        for row in rows[:n]:
+            with open(model_file, 'rb') as f:
+                pickle.load(f).predict(pd.DataFrame([row]))
+        print(f"unpickle per request     {rate(n, time.perf_counter() - t0)}")
+
+        t0 = time.perf_counter()
+        for row in rows[:args.requests]:
+            assert client.post('/predict', json=row).status_code == 200
+        print(f"/predict, cached model   {rate(args.requests, time.perf_counter() - t0)}")
+
+        payloads = {
+            'application/json': json.dumps(rows),
+            'text/csv': pd.DataFrame(rows).to_csv(index=False),
+            'application/x-ndjson': '\n'.join(json.dumps(row) for row in rows),
+        }
+        for content_type, body in payloads.items():
+            t0 = time.perf_counter()
+            response = client.post('/predict/batch', data=body, content_type=content_type)
+            elapsed = time.perf_counter() - t0
+            assert response.status_code == 200 and len(response.get_json()['predictions']) == len(rows)
+            print(f"/predict/batch {content_type:22s} {rate(len(rows), elapsed)}")
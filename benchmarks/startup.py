@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so every measurement is a real cold start
+CHILD = r'''
+import json, resource, sys, time
+t0 = time.perf_counter()
+from flaskapp.app import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+client = app.test_client()
+status = client.get('/about/').status_code
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_s': t1 - t0,
+    'create_app_s': t2 - t1,
+    'first_request_s': t3 - t2,
+    'status': status,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'ee_imported': 'ee' in sys.modules,
+    'tensorflow_imported': 'tensorflow' in sys.modules,
+}))
+'''
+
+
+def run_once():
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold start time and memory of the Flask app')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    for key in ['import_s', 'create_app_s', 'first_request_s', 'max_rss_mb']:
+        values = [r[key] for r in runs]
+        unit = 'MB' if key.endswith('_mb') else 'ms'
+        scale = 1 if unit == 'MB' else 1000
+        print(f"{key:16s} median {statistics.median(values) * scale:8.1f} {unit}   "
+              f"min {min(values) * scale:8.1f}   max {max(values) * scale:8.1f}")
+    print(f"ee imported at start-up: {runs[-1]['ee_imported']}, "
+          f"tensorflow imported at start-up: {runs[-1]['tensorflow_imported']}")
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class StubWeather(BaseHTTPRequestHandler):
+    # Answers like OpenWeatherMap after `latency` seconds; 'nowhere' is unknown
+    latency = 0.2
+    calls = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubWeather.lock:
+            StubWeather.calls += 1
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        city = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+        if city == 'nowhere':
+            status, body = 404, {'cod': '404', 'message': 'city not found'}
+        else:
+            status, body = 200, {'cod': 200, 'name': city, 'main': {'temp': 20.0 + len(city)}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='/city against a local stub of the weather API')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=20, help='distinct cities requested')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.2, help='stub response time in seconds')
+    args = parser.parse_args()
+
+    StubWeather.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubWeather)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['WEATHER_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/data/2.5/weather'
+    from scripts import flask_app
+
+    client = flask_app.app.test_client()
+    rng = random.Random(0)
+    cities = [f'city{i}' for i in range(args.cities)] + ['nowhere']
+    urls = [f'/city?city={rng.choice(cities)}' for _ in range(args.requests)]
+
+    def call(url):
+        t0 = time.perf_counter()
+        status = client.get(url).status_code
+        return time.perf_counter() - t0, status
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(call, urls))
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+
+    times = [r[0] for r in results]
+    print(f"{args.requests} requests for {len(cities)} cities in {elapsed:.2f}s ({args.requests / elapsed:.0f} req/s)")
+    print(f"p50 {statistics.median(times) * 1000:.1f} ms   p99 {percentile(times, 99) * 1000:.1f} ms   "
+          f"max {max(times) * 1000:.1f} ms   errors {sum(1 for r in results if r[1] not in (200, 404))}")
+    print(f"upstream calls {StubWeather.calls} (distinct cities {len(cities)})   client {flask_app.weather.stats()}")
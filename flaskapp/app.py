@@ -1,205 +1,783 @@
-from flask import Flask, jsonify, render_template, request
-import ee
-import google.auth
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-
-app = Flask(__name__)
-
-# Path to your GCP service account key JSON file
-SERVICE_ACCOUNT_FILE = '/home/ubuntu/SSTA/config/creds2.json'
-
-
-# Constants
-g = 9.82  # m/s^2
-m_H2O = 0.01801528  # kg/mol
-m_dry_air = 0.0289644  # kg/mol
-
-# Authenticate to GEE using the service account
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE,
-    scopes=['https://www.googleapis.com/auth/cloud-platform']
-)
-ee.Initialize(credentials)
-
-
-@app.route('/about/')
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError
+from functools import partial
+
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, render_template, request
+
+from flaskapp import metrics
+from flaskapp.backends import get_backend, is_local, use_local
+from flaskapp.cache import ResultCache, make_key
+from flaskapp.earthengine import SERVICE_ACCOUNT_FILE, EarthEngineUnavailable, get_ee
+from flaskapp.offload import Offloader, QueueFull
+from flaskapp.raster_store import RasterStore
+from flaskapp.regions import (CATALOGUE, RegionIndex, load_catalogue, place_from_params, place_params,
+                              geometry as region_geometry)
+from flaskapp.shaping import (ClientLimiter, RateLimited, estimate_cost, parse_buffer, parse_dates, parse_point,
+                              shape)
+from flaskapp.stats_index import StatsIndex, parse_stretch, stretch_range
+from flaskapp.tiles import TileCache, layer_key
+from flaskapp.timeseries import FREQUENCIES, TimeseriesStore, ensure, gaps as series_gaps
+
+bp = Blueprint('main', __name__)
+
+DEFAULT_CONFIG = {
+    # Path to your GCP service account key JSON file
+    'SERVICE_ACCOUNT_FILE': os.environ.get('EE_SERVICE_ACCOUNT_FILE', SERVICE_ACCOUNT_FILE),
+
+    # 'local' swaps Earth Engine for the synthetic NumPy backend (no network or
+    # credentials), with LOCAL_EE_LATENCY seconds added to every round trip
+    'EE_BACKEND': os.environ.get('EE_BACKEND', 'earthengine'),
+    'LOCAL_EE_LATENCY': float(os.environ.get('LOCAL_EE_LATENCY', 0)),
+
+    # Earth Engine work runs on a pool of EE_WORKERS threads with at most
+    # EE_QUEUE_SIZE requests waiting (beyond that: 503), and requests give up
+    # after EE_TIMEOUT seconds (504). Run gunicorn with threads (-k gthread)
+    # so waiting requests do not hold a whole worker process.
+    'EE_WORKERS': 8,
+    'EE_QUEUE_SIZE': 32,
+    'EE_TIMEOUT': 60,
+
+    # Result cache for /api/get-co-density. Coordinates are snapped to CACHE_GRID
+    # degrees so repeated clicks on the same city share an entry. Set
+    # CO_DENSITY_CACHE_DB to a file path to keep the cache across restarts.
+    'CACHE_GRID': 0.01,  # degrees
+    'CACHE_TTL': 2 * 60 * 60,  # EE map ids expire after a few hours
+    'CACHE_MAX_ENTRIES': 1024,
+    'CACHE_MAX_BYTES': 4 * 1024 * 1024,
+    'CO_DENSITY_CACHE_DB': os.environ.get('CO_DENSITY_CACHE_DB'),
+
+    # Map tiles are served from /tiles/ and cached in an MBTiles file
+    # (instance/tiles.mbtiles unless TILE_CACHE_DB is set); upstream EE map ids
+    # are renewed after CACHE_TTL.
+    'TILE_CACHE_DB': os.environ.get('TILE_CACHE_DB'),
+    'TILE_CACHE_MAX_BYTES': 512 * 1024 * 1024,
+    'TILE_MAX_AGE': 24 * 60 * 60,  # Cache-Control max-age for tiles
+
+    # Visualisation ranges come from the per-cell monthly statistics index
+    # (built by `python -m flaskapp.stats_index`) when it covers the request;
+    # otherwise Earth Engine reduces the region.
+    'STATS_INDEX_DB': os.environ.get('STATS_INDEX_DB'),
+
+    # Daily composites exported by `python -m flaskapp.raster_store`; map
+    # ranges and series of the regions and months it holds are computed from
+    # them locally, ahead of the statistics index and Earth Engine
+    'RASTER_STORE_DIR': os.environ.get('RASTER_STORE_DIR'),
+
+    # Named regions (flaskapp.regions.CATALOGUE unless REGIONS_FILE points to a
+    # JSON catalogue); clicks within REGION_SNAP_DISTANCE meters of one use it.
+    # /api/regions looks for the nearest region up to MAX_REGION_DISTANCE meters.
+    'REGIONS_FILE': os.environ.get('REGIONS_FILE'),
+    'REGION_SNAP_DISTANCE': 2000,
+    'MAX_REGION_DISTANCE': 500000,
+
+    # Daily series behind /api/timeseries (instance/timeseries.db unless
+    # TIMESERIES_DB is set); `python -m flaskapp.timeseries` extends them.
+    # A request may fetch at most MAX_SERIES_FETCH_DAYS days that are not
+    # stored yet, and at most MAX_ADHOC_SERIES series are tracked for places
+    # other than the catalogue regions.
+    'TIMESERIES_DB': os.environ.get('TIMESERIES_DB'),
+    'MAX_SERIES_FETCH_DAYS': 3 * 366,
+    'MAX_ADHOC_SERIES': 1000,
+
+    # Request shaping: regions up to MAX_BUFFER meters and MAX_QUERY_DAYS days.
+    # Layers whose estimated cost (megapixels x images read) exceeds
+    # MAX_QUERY_COST are reduced at a coarser scale (up to MAX_SCALE meters),
+    # then from a sample of days of each month. Each client (remote address,
+    # or CLIENT_ID_HEADER behind a trusted proxy) may make RATE_LIMIT requests
+    # per second in bursts of RATE_BURST and spend COST_BUDGET megapixel-images
+    # per minute in bursts of COST_BURST; RATE_LIMIT None turns limits off.
+    'MAX_BUFFER': 250000,
+    'MAX_QUERY_DAYS': 3 * 366,
+    'MAX_QUERY_COST': 20.0,
+    'MAX_SCALE': 10000,
+    'RATE_LIMIT': 5.0,
+    'RATE_BURST': 20,
+    'COST_BUDGET': 60.0,
+    'COST_BURST': 120.0,
+    'CLIENT_ID_HEADER': os.environ.get('CLIENT_ID_HEADER'),
+
+    # Counters and latency histograms served at /metrics. ?profile=1 adds the
+    # request's stage breakdown to /api/get-co-density; a PROFILE_SAMPLE_RATE
+    # fraction of all requests is profiled and logged.
+    'METRICS_ENABLED': True,
+    'PROFILE_SAMPLE_RATE': 0.0,
+
+    # Forecast models are loaded once per worker (those listed in FORECAST_PRELOAD,
+    # e.g. "CO:Houston,NO2:Delhi", at start-up; the rest on first use) and evicted
+    # least-recently-used beyond the memory budget. FORECAST_RUNTIME 'numpy' runs
+    # them without TensorFlow (lstm/runtime.py); 'keras' with it.
+    'FORECAST_PRELOAD': os.environ.get('FORECAST_PRELOAD'),
+    'FORECAST_RUNTIME': os.environ.get('FORECAST_RUNTIME', 'numpy'),
+    'FORECAST_MEMORY_BUDGET': 256 * 1024 * 1024,
+    'MAX_FORECAST_DAYS': 90,
+}
+
+_extensions_lock = threading.Lock()
+# Held while a tile layer's map id is renewed; striped by layer key so the
+# set stays fixed however many layers a worker renews
+_layer_locks = [threading.Lock() for _ in range(64)]
+
+
+def create_app(config=None):
+    # Nothing here talks to Earth Engine or loads TensorFlow: EE is initialised
+    # on the first request that needs it and forecast models on first use.
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+
+    if app.config['EE_BACKEND'] == 'local':
+        use_local(latency=app.config['LOCAL_EE_LATENCY'])
+    metrics.configure(enabled=app.config['METRICS_ENABLED'])
+
+    app.extensions['result_cache'] = ResultCache(
+        ttl=app.config['CACHE_TTL'],
+        max_entries=app.config['CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['CACHE_MAX_BYTES'],
+        db_path=app.config['CO_DENSITY_CACHE_DB']
+    )
+    app.register_blueprint(bp)
+
+    if app.config['FORECAST_PRELOAD']:
+        from flaskapp.forecasting import parse_preload
+
+        with app.app_context():
+            _model_pool().preload(parse_preload(app.config['FORECAST_PRELOAD']))
+    return app
+
+
+def _result_cache():
+    return current_app.extensions['result_cache']
+
+
+def _forecast_batcher():
+    extensions = current_app.extensions
+    if 'forecast_batcher' not in extensions:
+        with _extensions_lock:
+            if 'forecast_batcher' not in extensions:
+                from flaskapp.forecasting import ForecastBatcher, ModelPool, load_entry
+
+                runtime = current_app.config['FORECAST_RUNTIME']
+                pool = ModelPool(memory_budget=current_app.config['FORECAST_MEMORY_BUDGET'],
+                                 loader=lambda pollutant, city: load_entry(pollutant, city, runtime))
+                extensions['model_pool'] = pool
+                extensions['forecast_batcher'] = ForecastBatcher(pool)
+    return extensions['forecast_batcher']
+
+
+def _model_pool():
+    return _forecast_batcher().pool
+
+
+def _tile_cache():
+    extensions = current_app.extensions
+    if 'tile_cache' not in extensions:
+        with _extensions_lock:
+            if 'tile_cache' not in extensions:
+                path = current_app.config['TILE_CACHE_DB']
+                if not path:
+                    os.makedirs(current_app.instance_path, exist_ok=True)
+                    path = os.path.join(current_app.instance_path, 'tiles.mbtiles')
+                extensions['tile_cache'] = TileCache(path, max_bytes=current_app.config['TILE_CACHE_MAX_BYTES'])
+    return extensions['tile_cache']
+
+
+def _region_index():
+    extensions = current_app.extensions
+    if 'region_index' not in extensions:
+        with _extensions_lock:
+            if 'region_index' not in extensions:
+                path = current_app.config['REGIONS_FILE']
+                extensions['region_index'] = RegionIndex(load_catalogue(path) if path else CATALOGUE)
+    return extensions['region_index']
+
+
+def _timeseries_store():
+    extensions = current_app.extensions
+    if 'timeseries_store' not in extensions:
+        with _extensions_lock:
+            if 'timeseries_store' not in extensions:
+                path = current_app.config['TIMESERIES_DB']
+                if not path:
+                    os.makedirs(current_app.instance_path, exist_ok=True)
+                    path = os.path.join(current_app.instance_path, 'timeseries.db')
+                extensions['timeseries_store'] = TimeseriesStore(path)
+    return extensions['timeseries_store']
+
+
+def _offloader():
+    extensions = current_app.extensions
+    if 'offloader' not in extensions:
+        with _extensions_lock:
+            if 'offloader' not in extensions:
+                extensions['offloader'] = Offloader(max_workers=current_app.config['EE_WORKERS'],
+                                                    max_queue=current_app.config['EE_QUEUE_SIZE'])
+    return extensions['offloader']
+
+
+def _client_limiter():
+    # None when RATE_LIMIT is None
+    extensions = current_app.extensions
+    if 'client_limiter' not in extensions:
+        with _extensions_lock:
+            if 'client_limiter' not in extensions:
+                config = current_app.config
+                extensions['client_limiter'] = config['RATE_LIMIT'] and ClientLimiter(
+                    config['RATE_LIMIT'], config['RATE_BURST'], config['COST_BUDGET'], config['COST_BURST'])
+    return extensions['client_limiter']
+
+
+def _client_id():
+    header = current_app.config['CLIENT_ID_HEADER']
+    client = header and request.headers.get(header)
+    if client:
+        return client.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+
+def _rate_limited(e):
+    return jsonify({'error': str(e)}), 429, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+
+
+def _stats_index():
+    # None unless STATS_INDEX_DB is configured
+    extensions = current_app.extensions
+    if 'stats_index' not in extensions:
+        with _extensions_lock:
+            if 'stats_index' not in extensions:
+                path = current_app.config['STATS_INDEX_DB']
+                extensions['stats_index'] = StatsIndex(path) if path else None
+    return extensions['stats_index']
+
+
+def _raster_store():
+    # None unless RASTER_STORE_DIR is configured
+    extensions = current_app.extensions
+    if 'raster_store' not in extensions:
+        with _extensions_lock:
+            if 'raster_store' not in extensions:
+                path = current_app.config['RASTER_STORE_DIR']
+                extensions['raster_store'] = RasterStore(path) if path else None
+    return extensions['raster_store']
+
+
+def _earth_engine():
+    if is_local():
+        return get_backend()
+    return get_ee(current_app.config['SERVICE_ACCOUNT_FILE'])
+
+
+@bp.before_app_request
+def _start_profile():
+    g.profile_requested = request.args.get('profile') == '1' or request.args.get('debug') == '1' or current_app.debug
+    sampled = random.random() < current_app.config['PROFILE_SAMPLE_RATE']
+    if metrics.enabled():
+        metrics.start(detailed=g.profile_requested or sampled)
+
+
+@bp.after_app_request
+def _record_request(response):
+    profile = metrics.finish()
+    if profile is not None:
+        from flaskapp.pollutants import POLLUTANTS
+
+        endpoint = request.endpoint or 'unmatched'
+        default = 'CO' if endpoint in ('main.get_co_density', 'main.get_timeseries', 'main.get_forecast') else ''
+        pollutant = request.args.get('pollutant', default).upper()
+        metrics.observe_request(endpoint, pollutant if pollutant in POLLUTANTS else '', response.status_code, profile)
+        if profile.detailed and not g.profile_requested:
+            current_app.logger.info('profile %s %s: %s', request.full_path, response.status_code, profile.report())
+    return response
+
+
+def _respond(result):
+    # The result, with this request's stage breakdown if it was asked for
+    profile = metrics.current()
+    if g.get('profile_requested') and profile is not None:
+        result = dict(result, profile=profile.report())
+    return jsonify(result)
+
+
+@bp.route('/about/')
 def about():
     return render_template('about_us.html')
 
-@app.route('/contact/')
+@bp.route('/contact/')
 def contact():
     return render_template('contact_us.html')
 
 
-@app.route('/api/get-co-density', methods=['GET'])
+@bp.route('/api/get-co-density', methods=['GET'])
 def get_co_density():
-
-    city_lat = float(request.args.get('lat'))
-    city_lon = float(request.args.get('lon'))
-    buffer = request.args.get('buffer', default=25000, type=int) 
-
-    start_date = request.args.get('start_date', '2024-01-01')
-    end_date = request.args.get('end_date', '2024-05-31')
-
-    pollutant = request.args.get('pollutant', 'CO')
-
-    # print(city_lat, city_lon, type(city_lat), type(city_lon))
-    
-    if not city_lat or not city_lon or not buffer:
-        return jsonify({'error': 'Latitude, longitude and buffer are required parameters.'}), 400
-
-    # Define a buffer around the point to cover an area around Hyderabad (25 kilometers)
-    buffer_radius = buffer  # 25 kilometers in meters
-    buffered_city_geometry = ee.Geometry.Point(city_lon, city_lat).buffer(buffer_radius)
-
-    if pollutant == 'CO':
-        filtered_collection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CO') \
-        .filterBounds(buffered_city_geometry) \
-        .filterDate(start_date, end_date) \
-        .select(['CO_column_number_density', 'H2O_column_number_density'])
-
-        surface_pressure_collection = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-            .filterBounds(buffered_city_geometry) \
-            .filterDate(start_date, end_date) \
-            .select('surface_pressure')
-    
-        # Check if the collections are empty
-        if filtered_collection.size().getInfo() == 0 or surface_pressure_collection.size().getInfo() == 0:
-            return None
-
-        # Calculate the mean over the collection for CO, H2O, and surface pressure
-        CO_mean_month = filtered_collection.select('CO_column_number_density').mean().clip(buffered_city_geometry)
-        H2O_mean_month = filtered_collection.select('H2O_column_number_density').mean().clip(buffered_city_geometry)
-        surface_pressure_mean_month = surface_pressure_collection.mean().clip(buffered_city_geometry)
-
-        # Calculate TC_dry_air for the month
-        TC_dry_air_month = surface_pressure_mean_month.divide(g * m_dry_air).subtract(H2O_mean_month.multiply(m_H2O / m_dry_air))
-
-        # Calculate XCO for the month
-        XCO_month = CO_mean_month.divide(TC_dry_air_month).rename('XCO')
-
-        # Convert XCO to ppb
-        XCO_ppb_month = XCO_month.multiply(1e9).rename('XCO_ppb')
-
-        # dataset = ee.ImageCollection('COPERNICUS/S5P/NRTI/L3_CO') \
-        #             .select('CO_column_number_density') \
-        #             .filterDate(start_date, end_date) \
-        #             .filterBounds(buffered_city_geometry)
-
-        # # Calculate the mean CO density over the specified time period
-        # meanCO = dataset.mean().clip(buffered_city_geometry)
-
-        meanCO = XCO_ppb_month
-
-        min_max = meanCO.reduceRegion(
-        reducer=ee.Reducer.minMax(),
-        geometry=buffered_city_geometry,
-        scale=1000,
-        bestEffort=True
-        ).getInfo()
-
-
-        min_value = round(min_max.get('XCO_ppb_min', 0), 2)
-        max_value = round(min_max.get('XCO_ppb_max', 0), 2)
-
-
-        vis_params = {
-            'min': min_value,
-            'max': max_value,
-            'palette': ['blue', 'cyan', 'green', 'yellow', 'red']
-        }
-        map_id = meanCO.getMapId(vis_params)
-        tile_url = map_id['tile_fetcher'].url_format
-
-        return jsonify({'tile_url': tile_url,'min': min_value,'max': max_value})
-
-
-    elif pollutant == 'NO2':
-        filtered_collection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_NO2') \
-        .filterBounds(buffered_city_geometry) \
-        .filterDate(start_date, end_date) \
-        .select('NO2_column_number_density')
-        ###########################################
-
-        filtered_collection_h2o = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CO') \
-        .filterBounds(buffered_city_geometry) \
-        .filterDate(start_date, end_date) \
-        .select(['CO_column_number_density', 'H2O_column_number_density'])
-
-        # Check if the collections are empty
-        if filtered_collection_h2o.size().getInfo() == 0:
-            return None
-
-        H2O_mean_month = filtered_collection_h2o.select('H2O_column_number_density').mean().clip(buffered_city_geometry)
-
-        ############################################
-
-        surface_pressure_collection = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-            .filterBounds(buffered_city_geometry) \
-            .filterDate(start_date, end_date) \
-            .select('surface_pressure')
-    
-        # Check if the collections are empty
-        if filtered_collection.size().getInfo() == 0 or surface_pressure_collection.size().getInfo() == 0:
-            return None
-
-        # Calculate the mean over the collection for NO2, H2O, and surface pressure
-        NO2_mean_month = filtered_collection.select('NO2_column_number_density').mean().clip(buffered_city_geometry)
-        H2O_mean_month = filtered_collection_h2o.select('H2O_column_number_density').mean().clip(buffered_city_geometry)
-        surface_pressure_mean_month = surface_pressure_collection.mean().clip(buffered_city_geometry)
-
-        # Calculate TC_dry_air for the month
-        TC_dry_air_month = surface_pressure_mean_month.divide(g * m_dry_air).subtract(H2O_mean_month.multiply(m_H2O / m_dry_air))
-
-        # Calculate XNO2 for the month
-        XNO2_month = NO2_mean_month.divide(TC_dry_air_month).rename('XNO2')
-
-        # Convert XNO2 to ppb
-        XNO2_ppb_month = XNO2_month.multiply(1e9).rename('XNO2_ppb')
-
-        # dataset = ee.ImageCollection('COPERNICUS/S5P/NRTI/L3_NO2') \
-        #             .select('NO2_column_number_density') \
-        #             .filterDate(start_date, end_date) \
-        #             .filterBounds(buffered_city_geometry)
-
-        # # Calculate the mean NO2 density over the specified time period
-        # meanNO2 = dataset.mean().clip(buffered_city_geometry)
-
-        meanNO2 = XNO2_ppb_month
-
-        min_max = meanNO2.reduceRegion(
-        reducer=ee.Reducer.minMax(),
-        geometry=buffered_city_geometry,
-        scale=1000,
-        bestEffort=True
-        ).getInfo()
-
-
-        min_value = round(min_max.get('XNO2_ppb_min', 0), 2)
-        max_value = round(min_max.get('XNO2_ppb_max', 0), 2)
-
-
-        vis_params = {
-            'min': min_value,
-            'max': max_value,
-            'palette': ['blue', 'cyan', 'green', 'yellow', 'red']
-        }
-        map_id = meanNO2.getMapId(vis_params)
-        tile_url = map_id['tile_fetcher'].url_format
-
-        return jsonify({'tile_url': tile_url,'min': min_value,'max': max_value})
-
-
-
-        # Filter the collections for the given month
-    
-
-
-@app.route('/')
+    config = current_app.config
+    limiter = _client_limiter()
+    client = _client_id()
+    try:
+        if limiter:
+            limiter.check_rate(client)
+    except RateLimited as e:
+        return _rate_limited(e)
+
+    region = request.args.get('region')
+    stretch = request.args.get('stretch', 'minmax')
+
+    # Imported here so that importing the app does not import the ee client
+    from flaskapp.pollutants import get_pollutant
+
+    # Everything is checked before any Earth Engine work; dates before the
+    # collection's first day are dropped
+    try:
+        pollutant = get_pollutant(request.args.get('pollutant', 'CO'))
+        parse_stretch(stretch)
+        buffer = parse_buffer(request.args, max_buffer=config['MAX_BUFFER'])
+        start, end = parse_dates(request.args, '2024-01-01', '2024-05-31', config['MAX_QUERY_DAYS'],
+                                 pollutant.start_date)
+        if not region:
+            lat, lon = parse_point(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    start_date, end_date = start.isoformat(), end.isoformat()
+
+    grid = config['CACHE_GRID']
+    if region:
+        try:
+            place = _region_index().get(region)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+        if place.polygon is None and 'buffer' in request.args:
+            place = place._replace(buffer=buffer)
+    else:
+        # Clicks near a catalogue region use it; others are snapped to the grid
+        place = _region_index().resolve(lat, lon, buffer, grid, config['REGION_SNAP_DISTANCE'])
+    cache_key = make_key(pollutant.name, place.lat, place.lon, place.buffer, start_date, end_date, grid,
+                         place.name if place.polygon else None, stretch if stretch != 'minmax' else None)
+    with metrics.span('result_cache'):
+        cached = _result_cache().get(cache_key)
+    metrics.cache_lookup('result', cached is not None)
+    if cached is not None:
+        return _respond(cached)
+
+    # Oversized queries are downscaled rather than run at full resolution, and
+    # what is left is charged to the client's budget
+    scale, sample_days, cost = shape(pollutant, place.buffer, (end - start).days, config['MAX_QUERY_COST'],
+                                     config['MAX_SCALE'])
+    try:
+        if limiter:
+            limiter.charge(client, cost)
+    except RateLimited as e:
+        return _rate_limited(e)
+
+    try:
+        ee = _earth_engine()
+    except EarthEngineUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+
+    params = dict(place_params(place), pollutant=pollutant.name, start_date=start_date, end_date=end_date,
+                  stretch=stretch, scale=scale, sample_days=sample_days)
+
+    # Runs on the EE pool; identical requests in flight share one computation
+    try:
+        result, sizes = _offload(cache_key, _density_layer, ee, params, cache_key, request.script_root)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except TimeoutError:
+        return jsonify({'error': 'Earth Engine did not answer in time; try again shortly.'}), 504
+
+    if result is None:
+        return jsonify({'error': 'No data available for the requested region and dates.',
+                        'sizes': sizes}), 404
+    return _respond(result)
+
+
+def _offload(key, fn, *args):
+    # Run fn(*args) on the EE pool inside this app's context and wait for it;
+    # its spans count towards the request that started the computation
+    app = current_app._get_current_object()
+    profile = metrics.current()
+
+    def run():
+        with app.app_context(), metrics.activate(profile):
+            return fn(*args)
+
+    return _offloader().run(key, run, timeout=app.config['EE_TIMEOUT'])
+
+
+def _density_layer(ee, params, cache_key, script_root):
+    result, url_format, sizes = _map_layer(ee, params)
+    if result is None:
+        return None, sizes
+
+    # Tiles go through our proxy, which caches them; the EE URL stays server-side.
+    # The layer keeps its colour range so renewed map ids draw the same stretch.
+    vis_range = [result['min'], result['max']]
+    key = layer_key(cache_key, vis_range)
+    _tile_cache().put_layer(key, dict(params, vis_range=vis_range), url_format,
+                            time.time() + current_app.config['CACHE_TTL'])
+    result['tile_url'] = f"{script_root}/tiles/{key}/{{z}}/{{x}}/{{y}}.png"
+
+    _result_cache().put(cache_key, result)
+    return result, sizes
+
+
+def _map_layer(ee, params, vis_range=None):
+    # Colour stretch and EE tile URL for a layer: (result, url_format, sizes),
+    # with result None when an input collection has no images. A given
+    # vis_range is used as is instead of computing the stretch.
+    from flaskapp.pollutants import build_layer, get_pollutant
+
+    pollutant = get_pollutant(params['pollutant'])
+    stretch = parse_stretch(params.get('stretch'))
+
+    with metrics.span('graph_build'):
+        # The buffered point (or polygon) is shared by every request for this place
+        region = region_geometry(place_from_params(params))
+        layer = build_layer(pollutant, region, params['start_date'], params['end_date'], params.get('sample_days'))
+
+    if vis_range is None:
+        vis_range, sizes, source = _layer_range(ee, pollutant, params, layer, stretch)
+        if vis_range is None:
+            return None, None, sizes
+    else:
+        sizes, source = None, 'layer'
+    low, high = vis_range
+
+    min_value = round(low or 0, 2)
+    max_value = round(high or 0, 2)
+
+    vis_params = {
+        'min': min_value,
+        'max': max_value,
+        'palette': ['blue', 'cyan', 'green', 'yellow', 'red']
+    }
+    with metrics.ee_call('getMapId'):
+        map_id = layer.image.getMapId(vis_params)
+    url_format = map_id['tile_fetcher'].url_format
+
+    result = {'min': min_value, 'max': max_value, 'units': pollutant.units, 'range_source': source,
+              'region': params.get('region'), 'start_date': params['start_date'], 'end_date': params['end_date'],
+              'scale': params.get('scale', 1000), 'sample_days': params.get('sample_days')}
+    return result, url_format, sizes
+
+
+def _layer_range(ee, pollutant, params, layer, stretch):
+    # ((low, high) or None when there is no data, sizes, range source)
+    from flaskapp.pollutants import summarise
+
+    # Exported daily composites answer circles they cover without Earth
+    # Engine; the statistics index answers from monthly per-cell summaries
+    rasters = _raster_store()
+    indexed = _stats_index()
+    composite = summary = None
+    if rasters and not params.get('polygon'):
+        composite = rasters.composite_stats(pollutant.name, params['lat'], params['lon'], params['buffer'],
+                                            params['start_date'], params['end_date'], stretch or ())
+    if indexed and composite is None:
+        with metrics.span('stats_index'):
+            summary = indexed.summary(pollutant.name, params['lat'], params['lon'], params['buffer'],
+                                      params['start_date'], params['end_date'])
+        metrics.cache_lookup('stats_index', summary is not None)
+    if composite:
+        if not composite['count']:
+            return None, {pollutant.name: 0}, 'raster_store'
+        names = ('min', 'max') if stretch is None else tuple(f'p{p}' for p in stretch)
+        low, high = (composite[name] for name in names)
+        sizes, source = None, 'raster_store'
+    elif summary:
+        low, high = stretch_range(summary, stretch)
+        sizes, source = None, 'index'
+    else:
+        # Emptiness checks and the min/max reduction come back in a single round trip
+        output_band = pollutant.output_band
+        if stretch is None:
+            reducer, names = ee.Reducer.minMax(), (f'{output_band}_min', f'{output_band}_max')
+        else:
+            reducer = ee.Reducer.percentile(list(stretch))
+            names = tuple(f'{output_band}_p{p}' for p in stretch)
+        with metrics.ee_call('summarise'):
+            info = summarise(layer, reducer, scale=params.get('scale', 1000), best_effort=True).getInfo()
+
+        sizes, source = info['sizes'], 'earthengine'
+        if info.get('stats') is None:
+            return None, sizes, source
+        low, high = (info['stats'].get(name) for name in names)
+    return (low, high), sizes, source
+
+
+@bp.route('/tiles/<key>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_tile(key, z, x, y):
+    if not 0 <= z <= 24 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return jsonify({'error': 'Invalid tile coordinates.'}), 404
+
+    tiles = _tile_cache()
+    cached = tiles.get(key, z, x, y)
+    metrics.cache_lookup('tile', cached is not None)
+    if cached is None:
+        if tiles.layer(key) is None:
+            return jsonify({'error': 'Unknown layer.'}), 404
+        try:
+            ee = _earth_engine()
+        except EarthEngineUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        try:
+            cached = _offload(('tile', key, z, x, y), _fetch_tile, ee, key, z, x, y)
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+        except TimeoutError:
+            return jsonify({'error': 'Earth Engine did not answer in time; try again shortly.'}), 504
+        if cached is None:
+            return jsonify({'error': 'No data available for this layer.'}), 404
+
+    data, etag = cached
+    response = Response(data, mimetype='image/png')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['TILE_MAX_AGE']
+    return response.make_conditional(request)
+
+
+def _fetch_tile(ee, key, z, x, y):
+    # (data, etag) from Earth Engine, renewing the layer's map id if it expired
+    tiles = _tile_cache()
+    params, url_format, expires_at = tiles.layer(key)
+    if expires_at > time.time():
+        try:
+            with metrics.ee_call('fetch_tile'):
+                data = ee.data.TileFetcher(url_format).fetch_tile(x, y, z)
+            return data, tiles.put(key, z, x, y, data)
+        except ee.EEException:
+            pass  # map id no longer valid, render it again below
+
+    url_format = _renew_layer(ee, key, params, url_format)
+    if url_format is None:
+        return None
+    with metrics.ee_call('fetch_tile'):
+        data = ee.data.TileFetcher(url_format).fetch_tile(x, y, z)
+    return data, tiles.put(key, z, x, y, data)
+
+
+def _renew_layer(ee, key, params, stale_url):
+    # One renewal per layer: tiles of the same layer that arrive meanwhile wait
+    # and pick up the new URL
+    with _layer_locks[hash(key) % len(_layer_locks)]:
+        tiles = _tile_cache()
+        _, url_format, expires_at = tiles.layer(key)
+        if url_format != stale_url and expires_at > time.time():
+            return url_format
+        _, url_format, _ = _map_layer(ee, params, params.get('vis_range'))
+        if url_format is not None:
+            tiles.put_layer(key, params, url_format, time.time() + current_app.config['CACHE_TTL'])
+        return url_format
+
+
+@bp.route('/api/tile-stats', methods=['GET'])
+def tile_stats():
+    return jsonify(_tile_cache().stats())
+
+
+@bp.route('/api/stats-index', methods=['GET'])
+def stats_index_stats():
+    index = _stats_index()
+    if index is None:
+        return jsonify({'error': 'The statistics index is not configured.'}), 404
+    return jsonify(index.stats())
+
+
+@bp.route('/api/raster-store', methods=['GET'])
+def raster_store_stats():
+    rasters = _raster_store()
+    if rasters is None:
+        return jsonify({'error': 'The raster store is not configured.'}), 404
+    return jsonify(rasters.stats())
+
+
+@bp.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(_result_cache().stats())
+
+
+@bp.route('/api/timeseries', methods=['GET'])
+def get_timeseries():
+    config = current_app.config
+    limiter = _client_limiter()
+    client = _client_id()
+    try:
+        if limiter:
+            limiter.check_rate(client)
+    except RateLimited as e:
+        return _rate_limited(e)
+
+    region = request.args.get('region')
+    freq = request.args.get('freq', 'monthly')
+    if freq not in FREQUENCIES:
+        return jsonify({'error': f"freq must be one of {', '.join(FREQUENCIES)}."}), 400
+
+    from flaskapp.pollutants import get_pollutant
+
+    # Stored series may span the whole mission, so the range is not limited;
+    # days before the collection starts are stored as missing
+    try:
+        pollutant = get_pollutant(request.args.get('pollutant', 'CO'))
+        buffer = parse_buffer(request.args, max_buffer=config['MAX_BUFFER'])
+        start, end = parse_dates(request.args, '2023-01-01', '2024-01-01', max_days=None)
+        if not region:
+            lat, lon = parse_point(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    grid = config['CACHE_GRID']
+    if region:
+        try:
+            place = _region_index().get(region)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+        if place.polygon is None and 'buffer' in request.args:
+            place = place._replace(buffer=buffer)
+    else:
+        place = _region_index().resolve(lat, lon, buffer, grid, config['REGION_SNAP_DISTANCE'])
+    store = _timeseries_store()
+
+    # A series already stored, or whose missing days the raster store holds,
+    # is answered locally without Earth Engine or a slot in its pool;
+    # otherwise only the days not stored yet are fetched
+    key, missing, _ = series_gaps(store, pollutant.name, place, start, end, grid)
+    rasters = _raster_store()
+    if not missing:
+        metrics.cache_lookup('timeseries', True)
+    elif rasters and place.polygon is None and all(
+            rasters.holds(pollutant.name, place.lat, place.lon, place.buffer, gap_start, gap_end)
+            for gap_start, gap_end in missing):
+        key = ensure(store, pollutant.name, place, start, end, grid, rasters=rasters)
+        missing = []
+
+    # Only the days fetched from Earth Engine are limited, downscaled and
+    # charged. Daily values cannot be sampled, so only the scale is shaped.
+    scale = None
+    if missing:
+        days = sum((gap_end - gap_start).days for gap_start, gap_end in missing)
+        if days > config['MAX_SERIES_FETCH_DAYS']:
+            return jsonify({'error': f'{days} days of this series are not stored yet; request at most '
+                                     f"{config['MAX_SERIES_FETCH_DAYS']} of them at a time."}), 400
+        if (not store.series(key) and not _in_catalogue(place)
+                and _adhoc_series(store) >= config['MAX_ADHOC_SERIES']):
+            return jsonify({'error': 'No more places can be tracked; use a catalogue region (see /api/regions).'}), 400
+        scale = shape(pollutant, place.buffer, days, config['MAX_QUERY_COST'], config['MAX_SCALE'])[0]
+        try:
+            if limiter:
+                limiter.charge(client, estimate_cost(pollutant, place.buffer, days, scale))
+        except RateLimited as e:
+            return _rate_limited(e)
+    try:
+        if missing:
+            _earth_engine()
+            key = _offload(('timeseries', pollutant.name, place, start, end, scale),
+                           partial(ensure, scale=scale, rasters=rasters), store, pollutant.name, place, start, end,
+                           grid)
+    except EarthEngineUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except TimeoutError:
+        return jsonify({'error': 'Earth Engine did not answer in time; try again shortly.'}), 504
+
+    series = [{'period': period, 'value': value, 'days': days}
+              for period, value, days in store.query(key, start, end, freq)]
+    return jsonify({'pollutant': pollutant.name, 'units': pollutant.units, 'region': place.name,
+                    'lat': place.lat, 'lon': place.lon, 'buffer': place.buffer, 'freq': freq, 'series': series})
+
+
+def _in_catalogue(place):
+    # Catalogue regions with their own buffer; other series are ad hoc
+    try:
+        return place.name is not None and _region_index().get(place.name) == place
+    except ValueError:
+        return False
+
+
+def _adhoc_series(store):
+    return sum(1 for _, place, _, _ in store.series().values() if not _in_catalogue(place))
+
+
+@bp.route('/api/regions', methods=['GET'])
+def get_regions():
+    # The catalogue, or with lat/lon the nearest region within max_distance meters
+    index = _region_index()
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return jsonify({'regions': [place_params(index.get(name)) for name in index.names()]})
+
+    max_distance = request.args.get('max_distance', default=50000, type=float)
+    limit = current_app.config['MAX_REGION_DISTANCE']
+    if max_distance is None or not 0 <= max_distance <= limit:
+        return jsonify({'error': f'max_distance must be between 0 and {limit} meters.'}), 400
+
+    found = index.nearest(lat, lon, max_distance)
+    if found is None:
+        return jsonify({'error': 'No region nearby.'}), 404
+    return jsonify(dict(place_params(found[0]), distance=round(found[1])))
+
+
+@bp.route('/api/ee-stats', methods=['GET'])
+def ee_stats():
+    stats = _offloader().stats()
+    limiter = _client_limiter()
+    if limiter:
+        stats['limiter'] = limiter.stats()
+    return jsonify(stats)
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Prometheus text format; pool and cache state is sampled at scrape time
+    pool = _offloader().stats()
+    results = _result_cache().stats()
+    samples = {
+        'ee_pool_in_flight': ('gauge', 'Earth Engine computations running or queued.', pool['in_flight']),
+        'ee_pool_rejected_total': ('counter', 'Computations rejected because the queue was full.', pool['rejected']),
+        'ee_pool_coalesced_total': ('counter', 'Requests that joined a computation in flight.', pool['coalesced']),
+        'ee_pool_timeouts_total': ('counter', 'Requests that stopped waiting for Earth Engine.', pool['timeouts']),
+        'result_cache_entries': ('gauge', 'Entries in the result cache.', results['entries']),
+        'result_cache_bytes': ('gauge', 'Bytes held by the result cache.', results['bytes']),
+    }
+    return Response(metrics.REGISTRY.render(samples), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/api/forecast', methods=['GET'])
+def get_forecast():
+    pollutant = request.args.get('pollutant', 'CO').upper()
+    city = request.args.get('city', 'Houston')
+    days = request.args.get('days', default=30, type=int)
+
+    max_days = current_app.config['MAX_FORECAST_DAYS']
+    if not days or not 1 <= days <= max_days:
+        return jsonify({'error': f'days must be between 1 and {max_days}.'}), 400
+
+    try:
+        predictions = _forecast_batcher().submit(pollutant, city, days).result(timeout=30)
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 404
+    except TimeoutError:
+        return jsonify({'error': 'The forecast did not finish in time; try again shortly.'}), 504
+    except Exception:
+        # e.g. a corrupt or incompatible artifact
+        current_app.logger.exception('Forecast failed for %s/%s', pollutant, city)
+        return jsonify({'error': f'The forecast for {pollutant}/{city} failed.'}), 500
+
+    return jsonify({'pollutant': pollutant, 'city': city, 'predictions': predictions})
+
+
+@bp.route('/api/forecast/models', methods=['GET'])
+def forecast_models():
+    return jsonify(_model_pool().stats())
+
+
+@bp.route('/')
 def index():
     return render_template('home.html')
 
 if __name__ == '__main__':
-    app.run(debug=True)
-
+    create_app().run(debug=True)
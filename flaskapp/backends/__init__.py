@@ -0,0 +1,45 @@
+import threading
+
+# The module the Earth Engine code talks to. It is the real `ee` client by
+# default; flaskapp.backends.local mirrors the part of its API we use with
+# NumPy rasters so the app and the dataset builders can run offline.
+_active = {'backend': None}
+_lock = threading.Lock()
+
+
+def get_backend():
+    backend = _active['backend']
+    if backend is None:
+        import ee
+
+        backend = ee
+    return backend
+
+
+def set_backend(backend):
+    # Pass None to go back to the real Earth Engine client
+    with _lock:
+        _active['backend'] = backend
+
+
+def use_local(**settings):
+    from flaskapp.backends import local
+
+    local.configure(**settings)
+    set_backend(local)
+    return local
+
+
+def is_local(backend=None):
+    return getattr(backend or get_backend(), 'IS_LOCAL', False)
+
+
+class _BackendProxy:
+    # `from flaskapp.backends import ee` gives code an `ee` that always
+    # resolves to the active backend, so it reads exactly like ee client code
+
+    def __getattr__(self, name):
+        return getattr(get_backend(), name)
+
+
+ee = _BackendProxy()
@@ -0,0 +1,841 @@
+import datetime
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+# Offline stand-in for the parts of the Earth Engine client used by this
+# project. Objects are evaluated eagerly over NumPy rasters built from
+# synthetic (or user supplied) per-band fields; getInfo and getMapId count
+# as round trips and sleep for the configured latency.
+IS_LOCAL = True
+
+METERS_PER_DEGREE = 111320.0
+MAX_COLLECTION_ELEMENTS = 5000  # Earth Engine aborts larger collection queries
+
+_settings = {
+    'latency': 0.0,  # seconds added to every getInfo/getMapId
+    'jitter': 0.0,  # extra random latency, up to this many seconds
+    'max_pixels': 250000,  # reductions coarsen the grid beyond this
+    'fields': {},  # band -> fn(day, lats, lons) overriding the synthetic field
+}
+_stats = {'rpcs': 0}
+_lock = threading.Lock()
+_maps = {}  # map id -> (image, vis_params), for data.TileFetcher
+
+
+def configure(latency=None, jitter=None, max_pixels=None, fields=None):
+    for key, value in [('latency', latency), ('jitter', jitter), ('max_pixels', max_pixels)]:
+        if value is not None:
+            _settings[key] = value
+    if fields is not None:
+        _settings['fields'] = dict(fields)
+
+
+def rpc_count():
+    return _stats['rpcs']
+
+
+def reset_stats():
+    with _lock:
+        _stats['rpcs'] = 0
+
+
+def Initialize(*args, **kwargs):
+    pass
+
+
+class EEException(Exception):
+    pass
+
+
+def _rpc():
+    with _lock:
+        _stats['rpcs'] += 1
+    delay = _settings['latency'] + random.uniform(0, _settings['jitter'])
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _unwrap(value):
+    if isinstance(value, (Number, Dictionary, List, Date, Feature, FeatureCollection)):
+        return value._value()
+    if isinstance(value, dict):
+        return {k: _unwrap(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_unwrap(v) for v in value]
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    return value
+
+
+def _truthy(value):
+    # Earth Engine's rules for non-boolean conditions
+    value = _unwrap(value)
+    if value is None:
+        return False
+    if isinstance(value, float) and math.isnan(value):
+        return False
+    return bool(value)
+
+
+# ---------------------------------------------------------------- values
+
+class Number:
+    def __init__(self, value):
+        self.value = _unwrap(value)
+
+    def _value(self):
+        return self.value
+
+    def _op(self, other, fn):
+        return Number(fn(self.value, _unwrap(other)))
+
+    def gt(self, other):
+        return self._op(other, lambda a, b: int(a > b))
+
+    def lt(self, other):
+        return self._op(other, lambda a, b: int(a < b))
+
+    def add(self, other):
+        return self._op(other, lambda a, b: a + b)
+
+    def subtract(self, other):
+        return self._op(other, lambda a, b: a - b)
+
+    def multiply(self, other):
+        return self._op(other, lambda a, b: a * b)
+
+    def divide(self, other):
+        return self._op(other, lambda a, b: a / b)
+
+    def round(self):
+        return Number(round(self.value))
+
+    def getInfo(self):
+        _rpc()
+        return self.value
+
+
+class List:
+    def __init__(self, items):
+        self.items = list(items.items if isinstance(items, List) else items)
+
+    def _value(self):
+        return [_unwrap(item) for item in self.items]
+
+    @staticmethod
+    def sequence(start, end, step=1):
+        start, end, step = _unwrap(start), _unwrap(end), _unwrap(step)
+        count = int(math.floor((end - start) / step)) + 1
+        return List([start + i * step for i in range(max(count, 0))])
+
+    def map(self, fn):
+        return List([fn(Number(item) if isinstance(item, (int, float)) else item) for item in self.items])
+
+    def reduce(self, reducer):
+        return Number(reducer._reduce_list(self._value()))
+
+    def size(self):
+        return Number(len(self.items))
+
+    def get(self, index):
+        return self.items[_unwrap(index)]
+
+    def getInfo(self):
+        _rpc()
+        return self._value()
+
+
+class Dictionary:
+    def __init__(self, values=None):
+        if isinstance(values, Dictionary):
+            values = values.values_dict
+        self.values_dict = dict(values or {})
+
+    def _value(self):
+        return {k: _unwrap(v) for k, v in self.values_dict.items()}
+
+    def get(self, key, defaultValue=None):
+        # Both branches of Algorithms.If are built eagerly here, so a missing
+        # key gives the default instead of failing like it would server-side
+        return self.values_dict.get(_unwrap(key), defaultValue)
+
+    def keys(self):
+        return List(self.values_dict.keys())
+
+    def values(self, keys=None):
+        keys = self.values_dict.keys() if keys is None else _unwrap(keys)
+        return List([self.values_dict[k] for k in keys])
+
+    def getInfo(self):
+        _rpc()
+        return self._value()
+
+
+class Date:
+    def __init__(self, value):
+        value = _unwrap(value) if not isinstance(value, Date) else value.date
+        if isinstance(value, datetime.datetime):
+            value = value.date()
+        elif isinstance(value, str):
+            value = datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+        elif isinstance(value, (int, float)):
+            value = datetime.datetime.fromtimestamp(value / 1000, datetime.timezone.utc).date()
+        self.date = value
+
+    def _value(self):
+        return {'type': 'Date', 'value': self.millis()}
+
+    @staticmethod
+    def fromYMD(year, month, day):
+        return Date(datetime.date(_unwrap(year), _unwrap(month), _unwrap(day)))
+
+    def advance(self, delta, unit):
+        delta = int(_unwrap(delta))
+        if unit == 'day':
+            return Date(self.date + datetime.timedelta(days=delta))
+        if unit == 'month':
+            months = self.date.year * 12 + self.date.month - 1 + delta
+            return Date(self.date.replace(year=months // 12, month=months % 12 + 1))
+        if unit == 'year':
+            return Date(self.date.replace(year=self.date.year + delta))
+        raise EEException(f'Unsupported unit: {unit}')
+
+    def difference(self, start, unit):
+        days = (self.date - Date(start).date).days
+        if unit == 'day':
+            return Number(days)
+        raise EEException(f'Unsupported unit: {unit}')
+
+    def format(self, fmt=None):
+        return self.date.isoformat()
+
+    def millis(self):
+        epoch = datetime.date(1970, 1, 1)
+        return (self.date - epoch).days * 86400000
+
+
+class Reducer:
+    def __init__(self, name, args=None, parts=None):
+        self.name = name
+        self.args = args
+        self.parts = parts or [self]
+
+    @staticmethod
+    def mean():
+        return Reducer('mean')
+
+    @staticmethod
+    def min():
+        return Reducer('min')
+
+    @staticmethod
+    def max():
+        return Reducer('max')
+
+    @staticmethod
+    def minMax():
+        return Reducer('minMax')
+
+    @staticmethod
+    def count():
+        return Reducer('count')
+
+    @staticmethod
+    def percentile(percentiles):
+        return Reducer('percentile', list(percentiles))
+
+    @staticmethod
+    def fixedHistogram(min, max, steps):
+        return Reducer('fixedHistogram', (float(min), float(max), int(steps)))
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        return Reducer('combined', parts=self.parts + reducer2.parts)
+
+    def _outputs(self):
+        names = []
+        for part in self.parts:
+            if part.name == 'minMax':
+                names += ['min', 'max']
+            elif part.name == 'percentile':
+                names += [f'p{p}' for p in part.args]
+            elif part.name == 'fixedHistogram':
+                names.append('histogram')
+            else:
+                names.append(part.name)
+        return names
+
+    def _reduce_list(self, values):
+        values = [v for v in values if v is not None]
+        if self.name == 'min':
+            return min(values) if values else None
+        if self.name == 'max':
+            return max(values) if values else None
+        if self.name == 'mean':
+            return sum(values) / len(values) if values else None
+        raise EEException(f'Reducer {self.name} is not supported on lists')
+
+    def _reduce_pixels(self, values):
+        # values: 1-D array of unmasked pixels -> list of outputs, see _outputs
+        empty = values.size == 0
+        results = []
+        for part in self.parts:
+            if part.name == 'count':
+                results.append(int(values.size))
+            elif part.name == 'fixedHistogram':
+                low, high, steps = part.args
+                counts, edges = np.histogram(values, bins=steps, range=(low, high))
+                results.append([[float(e), int(c)] for e, c in zip(edges[:-1], counts)])
+            elif empty:
+                results += [None] * (2 if part.name == 'minMax' else len(part.args or [None]))
+            elif part.name == 'mean':
+                results.append(float(values.mean()))
+            elif part.name == 'min':
+                results.append(float(values.min()))
+            elif part.name == 'max':
+                results.append(float(values.max()))
+            elif part.name == 'minMax':
+                results += [float(values.min()), float(values.max())]
+            elif part.name == 'percentile':
+                results += [float(np.percentile(values, p)) for p in part.args]
+            else:
+                raise EEException(f'Unsupported reducer: {part.name}')
+        return results
+
+
+class Algorithms:
+    @staticmethod
+    def If(condition, trueCase, falseCase):
+        return trueCase if _truthy(condition) else falseCase
+
+
+# -------------------------------------------------------------- geometry
+
+class Geometry:
+    def __init__(self, circles=None, rect=None, polygons=None):
+        self.circles = circles or []  # (lon, lat, radius_m)
+        self.rect = rect  # (west, south, east, north)
+        self.polygons = polygons or []  # outer rings as [(lon, lat), ...]
+
+    @staticmethod
+    def Point(coords, lat=None, *args, **kwargs):
+        lon, lat = (coords if lat is None else (coords, lat))
+        return Geometry(circles=[(float(lon), float(lat), 0.0)])
+
+    @staticmethod
+    def Rectangle(coords, *args, **kwargs):
+        return Geometry(rect=tuple(float(c) for c in coords))
+
+    @staticmethod
+    def Polygon(coords, *args, **kwargs):
+        # [[lon, lat], ...] or [[[lon, lat], ...]]; holes are ignored
+        ring = coords[0] if isinstance(coords[0][0], (list, tuple)) else coords
+        return Geometry(polygons=[[(float(lon), float(lat)) for lon, lat in ring]])
+
+    def buffer(self, distance, *args, **kwargs):
+        distance = float(_unwrap(distance))
+        return Geometry(circles=[(lon, lat, r + distance) for lon, lat, r in self.circles], rect=self.rect,
+                        polygons=self.polygons)
+
+    def simplify(self, maxError=None, *args, **kwargs):
+        return self
+
+    def bounds(self, *args, **kwargs):
+        return Geometry(rect=self._bbox())
+
+    def _bbox(self):
+        boxes = [self.rect] if self.rect else []
+        for lon, lat, r in self.circles:
+            dlat = r / METERS_PER_DEGREE
+            dlon = r / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+            boxes.append((lon - dlon, lat - dlat, lon + dlon, lat + dlat))
+        for ring in self.polygons:
+            lons, lats = zip(*ring)
+            boxes.append((min(lons), min(lats), max(lons), max(lats)))
+        if not boxes:
+            raise EEException('Empty geometry')
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def _mask(self, grid):
+        mask = np.zeros(grid.lats.shape, dtype=bool)
+        if self.rect:
+            west, south, east, north = self.rect
+            mask |= (grid.lons >= west) & (grid.lons <= east) & (grid.lats >= south) & (grid.lats <= north)
+        for lon, lat, r in self.circles:
+            dx = (grid.lons - lon) * math.cos(math.radians(lat)) * METERS_PER_DEGREE
+            dy = (grid.lats - lat) * METERS_PER_DEGREE
+            # A bare point still covers the pixel it falls in
+            radius = max(r, grid.scale / 2)
+            mask |= dx * dx + dy * dy <= radius * radius
+        for ring in self.polygons:
+            # Even-odd ray casting
+            inside = np.zeros(grid.lats.shape, dtype=bool)
+            for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+                crosses = (y0 > grid.lats) != (y1 > grid.lats)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    x_cross = x0 + (grid.lats - y0) * (x1 - x0) / (y1 - y0)
+                inside ^= crosses & (grid.lons < x_cross)
+            mask |= inside
+        return mask
+
+
+class _Grid:
+    # Pixel centres covering a bounding box at roughly `scale` meters
+    def __init__(self, bbox, scale):
+        west, south, east, north = bbox
+        res = scale / METERS_PER_DEGREE
+        n_lat = max(1, int(math.ceil((north - south) / res)))
+        n_lon = max(1, int(math.ceil((east - west) / res)))
+        factor = math.sqrt(n_lat * n_lon / _settings['max_pixels'])
+        if factor > 1:
+            # Like bestEffort: coarsen until the reduction fits
+            n_lat = max(1, int(n_lat / factor))
+            n_lon = max(1, int(n_lon / factor))
+            scale *= factor
+        self.scale = scale
+        lats = np.linspace(south, north, n_lat + 2)[1:-1] if n_lat > 1 else np.array([(south + north) / 2])
+        lons = np.linspace(west, east, n_lon + 2)[1:-1] if n_lon > 1 else np.array([(west + east) / 2])
+        self.lons, self.lats = np.meshgrid(lons, lats)
+
+
+# ----------------------------------------------------------------- images
+
+# Synthetic fields per collection band: (mean, spread). Values vary smoothly
+# with location and season so reductions and min/max ranges are non-trivial.
+COLLECTIONS = {
+    'COPERNICUS/S5P/OFFL/L3_CO': ('2018-06-28', {
+        'CO_column_number_density': (0.03, 0.006),
+        'H2O_column_number_density': (1500.0, 600.0),
+    }),
+    'COPERNICUS/S5P/OFFL/L3_NO2': ('2018-06-28', {'NO2_column_number_density': (1e-4, 5e-5)}),
+    'COPERNICUS/S5P/OFFL/L3_SO2': ('2018-12-05', {'SO2_column_number_density': (2e-4, 1e-4)}),
+    'COPERNICUS/S5P/OFFL/L3_O3': ('2018-09-08', {'O3_column_number_density': (0.13, 0.013)}),
+    'COPERNICUS/S5P/OFFL/L3_HCHO': ('2018-12-05', {'tropospheric_HCHO_column_number_density': (1e-4, 4e-5)}),
+    'COPERNICUS/S5P/OFFL/L3_CH4': ('2019-02-08', {'CH4_column_volume_mixing_ratio_dry_air': (1880.0, 20.0)}),
+    'COPERNICUS/S5P/OFFL/L3_AER_AI': ('2018-07-04', {'absorbing_aerosol_index': (0.0, 1.0)}),
+    'ECMWF/ERA5_LAND/DAILY_AGGR': ('1950-01-02', {'surface_pressure': (101000.0, 1500.0)}),
+}
+
+
+def _synthetic_field(band, day, lats, lons):
+    override = _settings['fields'].get(band)
+    if override is not None:
+        return np.asarray(override(day, lats, lons), dtype=np.float64)
+    mean, spread = None, None
+    for _, bands in COLLECTIONS.values():
+        if band in bands:
+            mean, spread = bands[band]
+    phase = (zlib.crc32(band.encode()) % 1000) / 1000 * 2 * math.pi
+    season = math.sin(2 * math.pi * day.timetuple().tm_yday / 365.25 + phase)
+    spatial = np.sin(np.radians(lats) * 7 + phase) * np.cos(np.radians(lons) * 5 - phase)
+    return mean + spread * (0.6 * season + 0.4 * spatial)
+
+
+def _has_image(collection_id, day):
+    # Sentinel-5P misses some days; ERA5 is complete
+    if collection_id.startswith('ECMWF/'):
+        return True
+    return zlib.crc32(f'{collection_id}{day.isoformat()}'.encode()) % 10 != 0
+
+
+class Image:
+    def __init__(self, bands=(), fn=None):
+        if isinstance(bands, Image):
+            # ee.Image(image), e.g. around an Algorithms.If result
+            bands, fn = bands.bands, bands._fn
+        self.bands = list(bands)
+        self._fn = fn or (lambda grid: {})
+
+    @staticmethod
+    def constant(value):
+        value = float(_unwrap(value))
+        return Image(['constant'], lambda grid: {'constant': np.full(grid.lats.shape, value)})
+
+    @staticmethod
+    def cat(*images):
+        images = list(images[0]) if len(images) == 1 and isinstance(images[0], (list, tuple)) else list(images)
+        bands = [b for image in images for b in image.bands]
+        if len(set(bands)) != len(bands):
+            raise EEException('Image.cat: duplicate band names')
+
+        def fn(grid):
+            values = {}
+            for image in images:
+                values.update(image._eval(grid))
+            return values
+
+        return Image(bands, fn)
+
+    def _eval(self, grid):
+        return self._fn(grid)
+
+    def bandNames(self):
+        return List(self.bands)
+
+    def select(self, names):
+        names = [names] if isinstance(names, str) else list(names)
+        fn = self._fn
+        return Image(names, lambda grid: {b: fn(grid)[b] for b in names})
+
+    def rename(self, names):
+        names = [names] if isinstance(names, str) else list(names)
+        fn, old = self._fn, self.bands
+        if len(names) != len(old):
+            if not old:
+                return self
+            raise EEException(f'Can not rename {len(old)} bands to {len(names)} names')
+        return Image(names, lambda grid: dict(zip(names, (fn(grid)[b] for b in old))))
+
+    def unmask(self, value=0):
+        fn, value = self._fn, float(_unwrap(value))
+        return Image(self.bands, lambda grid: {b: np.where(np.isfinite(v), v, value) for b, v in fn(grid).items()})
+
+    def clip(self, geometry):
+        fn = self._fn
+
+        def clipped(grid):
+            mask = geometry._mask(grid)
+            return {b: np.where(mask, values, np.nan) for b, values in fn(grid).items()}
+
+        return Image(self.bands, clipped)
+
+    def _binary(self, other, op):
+        if not self.bands:
+            return self
+        fn = self._fn
+        if isinstance(other, Image):
+            if not other.bands:
+                return Image()
+            other_fn, other_bands = other._fn, other.bands
+
+            def combined(grid):
+                left, right = fn(grid), other_fn(grid)
+                return {b: op(left[b], right[other_bands[min(i, len(other_bands) - 1)]])
+                        for i, b in enumerate(self.bands)}
+        else:
+            value = float(_unwrap(other))
+
+            def combined(grid):
+                return {b: op(values, value) for b, values in fn(grid).items()}
+
+        return Image(self.bands, combined)
+
+    def add(self, other):
+        return self._binary(other, np.add)
+
+    def subtract(self, other):
+        return self._binary(other, np.subtract)
+
+    def multiply(self, other):
+        return self._binary(other, np.multiply)
+
+    def divide(self, other):
+        return self._binary(other, np.divide)
+
+    def _reduce(self, reducer, geometry, scale):
+        # {band: {output: value}}
+        grid = _Grid(geometry._bbox(), scale)
+        mask = geometry._mask(grid)
+        outputs = reducer._outputs()
+        result = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for band, values in self._eval(grid).items():
+                values = values[mask]
+                result[band] = dict(zip(outputs, reducer._reduce_pixels(values[np.isfinite(values)])))
+        return result
+
+    def reduceRegion(self, reducer, geometry=None, scale=1000, bestEffort=False, **kwargs):
+        # Single-output reducers are named after the band, others band_output
+        stats = {}
+        for band, outputs in self._reduce(reducer, geometry, scale or 1000).items():
+            if len(outputs) == 1:
+                stats[band] = next(iter(outputs.values()))
+            else:
+                stats.update({f'{band}_{name}': value for name, value in outputs.items()})
+        return Dictionary(stats)
+
+    def reduceRegions(self, collection, reducer, scale=1000, **kwargs):
+        features = []
+        for feature in collection._features():
+            stats = {}
+            for band, outputs in self._reduce(reducer, feature.geometry, scale or 1000).items():
+                if len(self.bands) == 1:
+                    stats.update(outputs)
+                else:
+                    stats.update({f'{band}_{name}': value for name, value in outputs.items()})
+            features.append(Feature(feature.geometry, dict(feature.properties, **stats)))
+        return FeatureCollection(features)
+
+    def getMapId(self, vis_params=None):
+        _rpc()
+        map_id = uuid.uuid4().hex
+        _maps[map_id] = (self, dict(vis_params or {}))
+        return {
+            'mapid': map_id,
+            'token': '',
+            'image': self,
+            'tile_fetcher': data.TileFetcher(f'{TILE_URL_ROOT}/{map_id}/tiles/{{z}}/{{x}}/{{y}}'),
+        }
+
+
+# ------------------------------------------------------------------ tiles
+
+TILE_URL_ROOT = 'https://earthengine.local/v1/maps'
+TILE_SIZE = 256
+
+COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 128, 0),
+    'blue': (0, 0, 255), 'cyan': (0, 255, 255), 'yellow': (255, 255, 0), 'magenta': (255, 0, 255),
+    'orange': (255, 165, 0), 'purple': (128, 0, 128), 'gray': (128, 128, 128), 'grey': (128, 128, 128),
+}
+
+
+def _color(value):
+    if value in COLORS:
+        return COLORS[value]
+    value = value.lstrip('#')
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+class _TileGrid:
+    # Pixel centres of a web-mercator tile
+    def __init__(self, x, y, z):
+        n = 2 ** z
+        cols = (x + (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE) / n
+        rows = (y + (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE) / n
+        lons = cols * 360 - 180
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * rows))))
+        self.lons, self.lats = np.meshgrid(lons, lats)
+        self.scale = 2 * math.pi * 6378137 / (n * TILE_SIZE)
+
+
+def _encode_png(rgba):
+    height, width, _ = rgba.shape
+    raw = b''.join(b'\x00' + rgba[row].tobytes() for row in range(height))
+
+    def chunk(kind, payload):
+        return (struct.pack('>I', len(payload)) + kind + payload
+                + struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def _render(image, vis, x, y, z):
+    bands = image._eval(_TileGrid(x, y, z))
+    if not bands:
+        values = np.full((TILE_SIZE, TILE_SIZE), np.nan)
+    else:
+        values = bands[image.bands[0]]
+    low, high = float(vis.get('min', 0)), float(vis.get('max', 1))
+    palette = np.array([_color(c) for c in vis.get('palette', ['black', 'white'])], dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        t = np.clip((values - low) / ((high - low) or 1), 0, 1)
+    position = np.nan_to_num(t) * (len(palette) - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, len(palette) - 1)
+    frac = (position - lower)[..., None]
+    rgb = palette[lower] * (1 - frac) + palette[upper] * frac
+    alpha = np.where(np.isfinite(values), 255, 0)[..., None]
+    return _encode_png(np.concatenate([rgb, alpha], axis=-1).astype(np.uint8))
+
+
+class _PixelGrid:
+    # Pixel centres of a computePixels grid (EPSG:4326, north-up)
+    def __init__(self, grid):
+        width, height = grid['dimensions']['width'], grid['dimensions']['height']
+        transform = grid['affineTransform']
+        lons = transform['translateX'] + (np.arange(width) + 0.5) * transform['scaleX']
+        lats = transform['translateY'] + (np.arange(height) + 0.5) * transform['scaleY']
+        self.lons, self.lats = np.meshgrid(lons, lats)
+        self.scale = abs(transform['scaleX']) * METERS_PER_DEGREE
+
+
+class data:
+    # Namespace mirroring ee.data
+
+    @staticmethod
+    def computePixels(params):
+        # NUMPY_NDARRAY result: a (height, width) structured array, one field per band
+        if params.get('fileFormat', 'NUMPY_NDARRAY') != 'NUMPY_NDARRAY':
+            raise EEException('Only NUMPY_NDARRAY is supported offline')
+        _rpc()
+        image = params['expression']
+        grid = _PixelGrid(params['grid'])
+        bands = params.get('bandIds') or image.bands
+        values = image._eval(grid)
+        out = np.empty(grid.lats.shape, dtype=[(b, np.float32) for b in bands])
+        for b in bands:
+            out[b] = values[b]
+        return out
+
+    class TileFetcher:
+        def __init__(self, url_format, map_name=None):
+            self.url_format = url_format
+
+        def format_tile_url(self, x, y, z):
+            return self.url_format.format(x=x % 2 ** z, y=y, z=z)
+
+        def fetch_tile(self, x, y, z):
+            map_id = self.url_format[len(TILE_URL_ROOT) + 1:].split('/')[0]
+            if map_id not in _maps:
+                raise EEException(f'Map {map_id} not found or expired.')
+            _rpc()
+            image, vis = _maps[map_id]
+            return _render(image, vis, x % 2 ** z, y, z)
+
+
+class ImageCollection:
+    def __init__(self, collection_id, bands=None, start=None, end=None, filters=()):
+        if collection_id not in COLLECTIONS:
+            raise EEException(f"ImageCollection.load: ImageCollection asset '{collection_id}' not found.")
+        self.collection_id = collection_id
+        first_day, all_bands = COLLECTIONS[collection_id]
+        self.bands = list(all_bands) if bands is None else bands
+        self.start = max(Date(first_day).date, start or datetime.date.min)
+        self.end = min(datetime.date.today(), end or datetime.date.max)
+        self.filters = tuple(filters)
+
+    def _copy(self, **changes):
+        kwargs = dict(bands=self.bands, start=self.start, end=self.end, filters=self.filters)
+        kwargs.update(changes)
+        return ImageCollection(self.collection_id, **kwargs)
+
+    def filterBounds(self, geometry):
+        return self
+
+    def filterDate(self, start, end=None):
+        start = Date(start).date
+        end = Date(end).date if end is not None else start + datetime.timedelta(days=1)
+        return self._copy(start=max(self.start, start), end=min(self.end, end))
+
+    def filter(self, filter_):
+        return self._copy(filters=self.filters + (filter_,))
+
+    def select(self, bands):
+        bands = [bands] if isinstance(bands, str) else list(bands)
+        missing = [b for b in bands if b not in COLLECTIONS[self.collection_id][1]]
+        if missing:
+            raise EEException(f'Band pattern {missing[0]!r} did not match any bands.')
+        return self._copy(bands=bands)
+
+    def _days(self):
+        days = []
+        day = self.start
+        while day < self.end:
+            if _has_image(self.collection_id, day) and all(f._accepts(day) for f in self.filters):
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    def size(self):
+        return Number(len(self._days()))
+
+    def mean(self):
+        days = self._days()
+        if not days:
+            return Image()
+        bands = list(self.bands)
+
+        def fn(grid):
+            return {b: np.mean([_synthetic_field(b, day, grid.lats, grid.lons) for day in days], axis=0)
+                    for b in bands}
+
+        return Image(bands, fn)
+
+
+class Filter:
+    def __init__(self, accepts):
+        self._accepts = accepts
+
+    @staticmethod
+    def calendarRange(start, end=None, field='day_of_year'):
+        start = _unwrap(start)
+        end = start if end is None else _unwrap(end)
+        getters = {
+            'day_of_year': lambda d: d.timetuple().tm_yday,
+            'day_of_month': lambda d: d.day,
+            'month': lambda d: d.month,
+            'year': lambda d: d.year,
+        }
+        get = getters[field]
+        return Filter(lambda d: start <= get(d) <= end)
+
+    @staticmethod
+    def Or(*filters):
+        if len(filters) == 1 and isinstance(filters[0], (list, tuple)):
+            filters = filters[0]
+        return Filter(lambda d: any(f._accepts(d) for f in filters))
+
+
+# --------------------------------------------------------------- features
+
+class Feature:
+    def __init__(self, geometry, properties=None):
+        self.geometry = geometry
+        self.properties = dict(properties or {})
+
+    def _value(self):
+        return {'type': 'Feature', 'geometry': None, 'properties': _unwrap(self.properties)}
+
+    def get(self, name):
+        return self.properties.get(_unwrap(name))
+
+    def set(self, name, value):
+        return Feature(self.geometry, dict(self.properties, **{name: value}))
+
+    def getInfo(self):
+        _rpc()
+        return self._value()
+
+
+class FeatureCollection:
+    def __init__(self, features):
+        self.items = list(features.items if isinstance(features, (List, FeatureCollection)) else features)
+
+    def _features(self):
+        return [f for f in self.items if isinstance(f, Feature)]
+
+    def _value(self):
+        return {'type': 'FeatureCollection', 'features': [f._value() for f in self._features()]}
+
+    def flatten(self):
+        features = []
+        for item in self.items:
+            features.extend(item._features() if isinstance(item, FeatureCollection) else [item])
+        return FeatureCollection(features)
+
+    def map(self, fn):
+        return FeatureCollection([fn(f) for f in self._features()])
+
+    def geometry(self, *args, **kwargs):
+        # Circles are kept; rectangles are merged into their bounding box
+        circles, rects, polygons = [], [], []
+        for f in self._features():
+            circles.extend(f.geometry.circles)
+            polygons.extend(f.geometry.polygons)
+            if f.geometry.rect:
+                rects.append(f.geometry.rect)
+        rect = None
+        if rects:
+            rect = (min(r[0] for r in rects), min(r[1] for r in rects),
+                    max(r[2] for r in rects), max(r[3] for r in rects))
+        return Geometry(circles=circles, rect=rect, polygons=polygons)
+
+    def size(self):
+        return Number(len(self._features()))
+
+    def getInfo(self):
+        _rpc()
+        if len(self._features()) > MAX_COLLECTION_ELEMENTS:
+            raise EEException(f'Collection query aborted after accumulating over '
+                              f'{MAX_COLLECTION_ELEMENTS} elements.')
+        return self._value()
@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# Earth Engine map ids (and the tile URLs built from them) stop working after a
+# few hours, so cached results must not outlive them.
+DEFAULT_TTL = 2 * 60 * 60  # seconds
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_GRID = 0.01  # degrees, roughly 1 km
+
+
+def snap(value, grid=DEFAULT_GRID):
+    # Round a coordinate onto the cache grid so near-identical clicks share a key
+    return round(round(value / grid) * grid, 6)
+
+
+def make_key(pollutant, lat, lon, buffer, start_date, end_date, grid=DEFAULT_GRID, *extra):
+    # extra: further request options that change the result, e.g. the stretch
+    return '|'.join([
+        str(pollutant).upper(),
+        '%.6f' % snap(lat, grid),
+        '%.6f' % snap(lon, grid),
+        str(int(buffer)),
+        str(start_date),
+        str(end_date),
+    ] + [str(e) for e in extra if e])
+
+
+class ResultCache:
+    # LRU cache of JSON-serialisable results with a TTL and an entry/byte budget.
+    # When db_path is given, entries are also written to SQLite so a restarted
+    # worker comes back warm.
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, db_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, expires_at REAL, value TEXT)'
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        now = time.time()
+        self._db.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+        self._db.commit()
+        rows = self._db.execute(
+            'SELECT key, expires_at, value FROM results ORDER BY expires_at'
+        ).fetchall()
+        for key, expires_at, payload in rows:
+            self._insert(key, expires_at, json.loads(payload), len(payload))
+
+    def _insert(self, key, expires_at, value, size):
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._bytes > self.max_bytes):
+            old_key, (_, old_size, _) = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            self.evictions += 1
+            if self._db is not None:
+                self._db.execute('DELETE FROM results WHERE key = ?', (old_key,))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._insert(key, expires_at, value, len(payload))
+            if self._db is not None:
+                # An entry larger than max_bytes is evicted by _insert itself
+                if key in self._entries:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO results (key, expires_at, value) VALUES (?, ?, ?)',
+                        (key, expires_at, payload)
+                    )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'persistent': self._db is not None,
+            }
@@ -0,0 +1,80 @@
+import datetime
+import logging
+import threading
+import time
+
+
+# Path to your GCP service account key JSON file
+SERVICE_ACCOUNT_FILE = '/home/ubuntu/SSTA/config/creds2.json'
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# Refresh the access token this long before it expires
+REFRESH_MARGIN = 5 * 60  # seconds
+
+
+class EarthEngineUnavailable(Exception):
+    pass
+
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {'ee': None, 'credentials': None, 'refresher': None}
+
+
+def get_ee(service_account_file=SERVICE_ACCOUNT_FILE):
+    # The initialised ee module. Authentication happens once per process, on
+    # first use, instead of at import time; later calls return immediately.
+    ee = _state['ee']
+    if ee is not None:
+        return ee
+    with _lock:
+        if _state['ee'] is None:
+            _state['ee'] = _initialize(service_account_file)
+        return _state['ee']
+
+
+def _initialize(service_account_file):
+    import ee
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+
+    # Authenticate to GEE using the service account
+    try:
+        credentials = service_account.Credentials.from_service_account_file(
+            service_account_file,
+            scopes=SCOPES
+        )
+        credentials.refresh(Request())
+        ee.Initialize(credentials)
+    except Exception as e:
+        raise EarthEngineUnavailable(f'Earth Engine initialisation failed: {e}') from e
+
+    _state['credentials'] = credentials
+    refresher = threading.Thread(target=_refresh_loop, args=(credentials,), name='ee-credentials', daemon=True)
+    refresher.start()
+    _state['refresher'] = refresher
+    return ee
+
+
+def _refresh_loop(credentials):
+    # Renew the token in the background so no request pays for the refresh
+    from google.auth.transport.requests import Request
+
+    while True:
+        expiry = credentials.expiry
+        if expiry is None:
+            delay = 30 * 60
+        else:
+            # google-auth stores expiry as a naive UTC datetime
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            delay = (expiry - now).total_seconds() - REFRESH_MARGIN
+        time.sleep(max(delay, 30))
+        try:
+            credentials.refresh(Request())
+        except Exception:
+            log.exception('Earth Engine credential refresh failed')
+
+
+def is_initialized():
+    return _state['ee'] is not None
@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+import pandas as pd
+
+from lstm.artifact import build_keras_model, load_artifact, model_path
+from lstm.forecast import forecast_many, make_predictor
+from lstm.runtime import load_numpy_model
+
+
+# model: the loaded network; predictor: its compiled batch call
+# scaler: MinMaxScaler fitted at training time
+# seq_length: window the model was trained with, from its artifact
+# history: last seq_length unscaled values; last_date: date of history[-1]
+ModelEntry = namedtuple('ModelEntry', ['key', 'model', 'predictor', 'scaler', 'seq_length', 'history', 'last_date',
+                                       'nbytes'])
+
+
+def model_key(pollutant, city):
+    # Cities are matched the way model_path names artifacts, so "Houston" and
+    # "houston" share one loaded model
+    return pollutant.upper(), city.lower().replace(' ', '_')
+
+
+def load_entry(pollutant, city, runtime='numpy'):
+    # Everything comes from the model artifact; the dataset is not read. The
+    # NumPy runtime keeps TensorFlow out of the web workers; runtime='keras'
+    # runs the network with TensorFlow instead.
+    path = model_path(pollutant, city)
+    if not os.path.isdir(path):
+        raise KeyError(f'No model for {pollutant}/{city}')
+    artifact = load_artifact(path)
+    model = load_numpy_model(artifact) if runtime == 'numpy' else build_keras_model(artifact)
+
+    nbytes = sum(w.nbytes for w in artifact.weights)
+    return ModelEntry((pollutant, city), model, make_predictor(model), artifact.scaler,
+                      artifact.seq_length, artifact.history[:, 0], artifact.last_date, nbytes)
+
+
+class ModelPool:
+    # Loaded models keyed by (pollutant, city), loaded on first use and evicted
+    # least-recently-used once their weights exceed the memory budget
+
+    def __init__(self, memory_budget=256 * 1024 * 1024, loader=load_entry):
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, pollutant, city):
+        key = model_key(pollutant, city)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+            # Concurrent requests for the same model wait for a single load
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            return entry if entry is not None else self.get(pollutant, city)
+
+        try:
+            entry = self.loader(*key)
+            with self._lock:
+                self._entries[key] = entry
+                self._nbytes += entry.nbytes
+                while len(self._entries) > 1 and self._nbytes > self.memory_budget:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._nbytes -= evicted.nbytes
+            return entry
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def preload(self, keys):
+        for pollutant, city in keys:
+            try:
+                self.get(pollutant, city)
+            except Exception as e:
+                print(f"Could not preload {pollutant}/{city}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models': ['/'.join(key) for key in self._entries],
+                'bytes': self._nbytes,
+                'memory_budget': self.memory_budget,
+            }
+
+
+class ForecastBatcher:
+    # Collects concurrent forecast requests for up to max_wait seconds. Requests
+    # for the same model share one forecast over the longest horizon asked for,
+    # since they start from the same history. Models are loaded by the calling
+    # thread, so a cold load never holds up forecasts of models already loaded.
+
+    def __init__(self, pool, max_wait=0.005, max_batch=256):
+        self.pool = pool
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='forecast-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, pollutant, city, days):
+        future = Future()
+        try:
+            entry = self.pool.get(pollutant, city)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            self._queue.put((entry, days, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0].key, []).append(item)
+            for items in groups.values():
+                self._forecast(items[0][0], items)
+
+    def _forecast(self, entry, items):
+        try:
+            horizon = max(days for _, days, _ in items)
+            values = forecast_many(entry.model, [entry.history], [entry.scaler],
+                                   horizon, entry.seq_length, entry.predictor)[0]
+            dates = pd.date_range(entry.last_date + pd.Timedelta(days=1), periods=horizon, freq='D')
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+
+        predictions = [
+            {'date': date.strftime('%Y-%m-%d'), 'value': round(float(value), 3)}
+            for date, value in zip(dates, values)
+        ]
+        for _, days, future in items:
+            future.set_result(predictions[:days])
+
+
+def parse_preload(value):
+    # "CO:Houston,NO2:Delhi" -> [('CO', 'Houston'), ('NO2', 'Delhi')]
+    keys = []
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        pollutant, _, city = item.partition(':')
+        keys.append(model_key(pollutant, city))
+    return keys
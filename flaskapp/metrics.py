@@ -0,0 +1,267 @@
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+# Process-wide counters and latency histograms, rendered in the Prometheus
+# text format. Spans time a pipeline stage (or an Earth Engine round trip) and
+# also add it to the current request's Profile, whose stage list is only kept
+# for profiled requests. With metrics disabled span() and ee_call() return a
+# shared no-op, so instrumented code costs one function call.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+_enabled = True
+_local = threading.local()
+
+
+def configure(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def enabled():
+    return _enabled
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_text(self.labels, values)} {count}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def totals(self):
+        # {label values: (count, sum)}
+        with self._lock:
+            return {values: (series[-2], series[-1]) for values, series in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_label_text(names, values + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_label_text(names, values + ("+Inf",))} {series[-2]}')
+                lines.append(f'{self.name}_count{_label_text(self.labels, values)} {series[-2]}')
+                lines.append(f'{self.name}_sum{_label_text(self.labels, values)} {series[-1]:.6f}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, samples=None):
+        # samples: {name: (type, help, value)} read by the caller at scrape
+        # time from state kept elsewhere (pool and cache statistics)
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for name, (kind, help_text, value) in sorted((samples or {}).items()):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+EE_RPCS = REGISTRY.counter('ee_rpcs_total', 'Earth Engine round trips.', ['call'])
+EE_SECONDS = REGISTRY.histogram('ee_call_seconds', 'Earth Engine round trip latency.', ['call'])
+STAGE_SECONDS = REGISTRY.histogram('stage_seconds', 'Pipeline stage duration.', ['stage'])
+ERRORS = REGISTRY.counter('errors_total', 'Exceptions raised in a stage or Earth Engine call.', ['stage', 'error'])
+CACHE_LOOKUPS = REGISTRY.counter('cache_lookups_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+REQUESTS = REGISTRY.counter('http_requests_total', 'HTTP requests by endpoint and status.', ['endpoint', 'status'])
+REQUEST_SECONDS = REGISTRY.histogram('http_request_seconds', 'HTTP request latency.', ['endpoint', 'pollutant'])
+REQUEST_RPCS = REGISTRY.histogram('http_request_ee_rpcs', 'Earth Engine round trips per HTTP request.',
+                                  ['endpoint'], COUNT_BUCKETS)
+
+
+class Profile:
+    # Per-request totals; stages (name, seconds) only when detailed
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.started = time.perf_counter()
+        self.ee_rpcs = 0
+        self.stages = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        return {
+            'total_ms': round(self.elapsed() * 1000, 1),
+            'ee_rpcs': self.ee_rpcs,
+            'stages': [{'stage': name, 'ms': round(seconds * 1000, 1)} for name, seconds in self.stages],
+        }
+
+
+def start(detailed=False):
+    profile = Profile(detailed)
+    _local.profile = profile
+    return profile
+
+
+def current():
+    return getattr(_local, 'profile', None)
+
+
+def finish():
+    profile = current()
+    _local.profile = None
+    return profile
+
+
+class activate:
+    # Makes a request's profile current in another thread (the EE pool)
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __enter__(self):
+        self.previous = current()
+        _local.profile = self.profile
+
+    def __exit__(self, *exc):
+        _local.profile = self.previous
+
+
+class _Span:
+    __slots__ = ('name', 'histogram', 'rpc', 'started')
+
+    def __init__(self, name, histogram, rpc):
+        self.name = name
+        self.histogram = histogram
+        self.rpc = rpc
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        self.histogram.observe(seconds, self.name)
+        profile = getattr(_local, 'profile', None)
+        if self.rpc:
+            EE_RPCS.inc(self.name)
+            if profile is not None:
+                profile.ee_rpcs += 1
+        if profile is not None and profile.detailed:
+            profile.stages.append((f'ee.{self.name}' if self.rpc else self.name, seconds))
+        if exc_type is not None:
+            ERRORS.inc(self.name, exc_type.__name__)
+        return False
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    # with span('graph_build'): ...
+    return _Span(name, STAGE_SECONDS, False) if _enabled else _NO_SPAN
+
+
+def ee_call(name):
+    # with ee_call('getMapId'): ... around exactly one Earth Engine round trip
+    return _Span(name, EE_SECONDS, True) if _enabled else _NO_SPAN
+
+
+def cache_lookup(cache, hit):
+    if _enabled:
+        CACHE_LOOKUPS.inc(cache, 'hit' if hit else 'miss')
+
+
+def observe_request(endpoint, pollutant, status, profile):
+    if _enabled:
+        REQUESTS.inc(endpoint, status)
+        REQUEST_SECONDS.observe(profile.elapsed(), endpoint, pollutant)
+        REQUEST_RPCS.observe(profile.ee_rpcs, endpoint)
+
+
+def summary():
+    # One line per stage and EE call, for the batch pipelines' logs
+    lines = []
+    for kind, histogram in (('stage', STAGE_SECONDS), ('ee', EE_SECONDS)):
+        for (name,), (count, total) in sorted(histogram.totals().items()):
+            lines.append(f'{kind} {name}: {count} x, {total:.2f}s total, {total / count * 1000:.1f}ms mean')
+    return '\n'.join(lines)
+
+
+def write_textfile(path):
+    # For batch jobs: a file node_exporter's textfile collector can pick up
+    with open(path + '.tmp', 'w') as f:
+        f.write(REGISTRY.render({'job_last_success_unixtime': ('gauge', 'When the job last finished.', math.floor(time.time()))}))
+    os.replace(path + '.tmp', path)
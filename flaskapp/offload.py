@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+# Earth Engine calls run on a small dedicated pool instead of the web
+# worker's thread. Requests for a key that is already being computed wait on
+# the same future, and once max_workers + max_queue computations are pending
+# new ones are rejected instead of piling up.
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE = 32
+DEFAULT_TIMEOUT = 60  # seconds
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Offloader:
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ee')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if not self._slots.acquire(blocking=False):
+                self.rejected += 1
+                raise QueueFull(f'Too many pending Earth Engine requests ({self.max_workers + self.max_queue}).')
+            self.submitted += 1
+            future = self._executor.submit(fn, *args)
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        self._slots.release()
+
+    def run(self, key, fn, *args, timeout=DEFAULT_TIMEOUT):
+        # On timeout the computation keeps running (and fills the caches); only
+        # this caller stops waiting
+        future = self.submit(key, fn, *args)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._inflight),
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+            }
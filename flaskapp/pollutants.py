@@ -0,0 +1,261 @@
+import datetime
+from collections import namedtuple
+from functools import lru_cache
+
+from flaskapp import metrics
+from flaskapp.backends import ee, get_backend
+
+
+# Constants
+g = 9.82  # m/s^2
+m_H2O = 0.01801528  # kg/mol
+m_dry_air = 0.0289644  # kg/mol
+
+# Every column-density pollutant is normalised by the dry-air column, which
+# needs the H2O column (from the S5P CO product) and ERA5 surface pressure.
+H2O_COLLECTION = 'COPERNICUS/S5P/OFFL/L3_CO'
+H2O_BAND = 'H2O_column_number_density'
+SURFACE_PRESSURE_COLLECTION = 'ECMWF/ERA5_LAND/DAILY_AGGR'
+SURFACE_PRESSURE_BAND = 'surface_pressure'
+
+# Earth Engine aborts collection queries that accumulate more elements than this
+MAX_ELEMENTS = 5000
+
+# collection/band: the S5P product and the band to read from it
+# output_band: name of the band in the computed image (and in reduceRegion results)
+# mixing_ratio: True if band is a column density (mol/m^2) that has to be
+#   converted to a dry-air mixing ratio in ppb; False if it is used as-is
+# start_date: first day the collection has data; earlier days are never queried
+Pollutant = namedtuple('Pollutant', ['name', 'collection', 'band', 'output_band', 'mixing_ratio', 'units', 'start_date'])
+
+POLLUTANTS = {p.name: p for p in [
+    Pollutant('CO', 'COPERNICUS/S5P/OFFL/L3_CO', 'CO_column_number_density', 'XCO_ppb', True, 'ppb', '2018-06-28'),
+    Pollutant('NO2', 'COPERNICUS/S5P/OFFL/L3_NO2', 'NO2_column_number_density', 'XNO2_ppb', True, 'ppb', '2018-06-28'),
+    Pollutant('SO2', 'COPERNICUS/S5P/OFFL/L3_SO2', 'SO2_column_number_density', 'XSO2_ppb', True, 'ppb', '2018-12-05'),
+    Pollutant('O3', 'COPERNICUS/S5P/OFFL/L3_O3', 'O3_column_number_density', 'XO3_ppb', True, 'ppb', '2018-09-08'),
+    Pollutant('HCHO', 'COPERNICUS/S5P/OFFL/L3_HCHO', 'tropospheric_HCHO_column_number_density', 'XHCHO_ppb', True, 'ppb', '2018-12-05'),
+    # Already a dry-air mixing ratio in ppb
+    Pollutant('CH4', 'COPERNICUS/S5P/OFFL/L3_CH4', 'CH4_column_volume_mixing_ratio_dry_air', 'XCH4_ppb', False, 'ppb', '2019-02-08'),
+    # Unitless index
+    Pollutant('AER_AI', 'COPERNICUS/S5P/OFFL/L3_AER_AI', 'absorbing_aerosol_index', 'AER_AI', False, 'index', '2018-07-04'),
+]}
+
+# image: the per-pixel result for the requested region and dates
+# sizes: ee.Dictionary of the number of images behind each input collection
+Layer = namedtuple('Layer', ['pollutant', 'image', 'sizes', 'region'])
+
+
+def get_pollutant(name):
+    try:
+        return POLLUTANTS[str(name).upper()]
+    except KeyError:
+        raise ValueError(f'Unsupported pollutant: {name}')
+
+
+def _resolve(pollutant):
+    return get_pollutant(pollutant) if isinstance(pollutant, str) else pollutant
+
+
+@lru_cache(maxsize=None)
+def _collection(backend, collection_id, band):
+    # The unfiltered, band-selected collection is the same for every request
+    return backend.ImageCollection(collection_id).select(band)
+
+
+def _filtered(collection_id, band, region, start_date, end_date, sample_days=None):
+    collection = _collection(get_backend(), collection_id, band)
+    collection = collection.filterBounds(region).filterDate(start_date, end_date)
+    if sample_days:
+        # Temporal sampling: only the first sample_days days of every month
+        collection = collection.filter(ee.Filter.calendarRange(1, sample_days, 'day_of_month'))
+    return collection
+
+
+def dry_air_column(surface_pressure, h2o_column):
+    # Total column of dry air (mol/m^2) from surface pressure and the H2O column
+    return surface_pressure.divide(g * m_dry_air).subtract(h2o_column.multiply(m_H2O / m_dry_air))
+
+
+def build_layer(pollutant, region, start_date, end_date, sample_days=None):
+    pollutant = _resolve(pollutant)
+
+    columns = _filtered(pollutant.collection, pollutant.band, region, start_date, end_date, sample_days)
+    column_mean = columns.mean().clip(region)
+
+    if not pollutant.mixing_ratio:
+        image = column_mean.rename(pollutant.output_band)
+        return Layer(pollutant, image, ee.Dictionary({pollutant.name: columns.size()}), region)
+
+    surface_pressure = _filtered(SURFACE_PRESSURE_COLLECTION, SURFACE_PRESSURE_BAND, region, start_date, end_date,
+                                 sample_days)
+    sizes = {pollutant.name: columns.size(), 'ERA5': surface_pressure.size()}
+    h2o = _filtered(H2O_COLLECTION, H2O_BAND, region, start_date, end_date, sample_days)
+    if pollutant.collection != H2O_COLLECTION:
+        sizes['H2O'] = h2o.size()
+
+    tc_dry_air = dry_air_column(surface_pressure.mean().clip(region), h2o.mean().clip(region))
+
+    # Dry-air mixing ratio, converted to ppb
+    image = column_mean.divide(tc_dry_air).multiply(1e9).rename(pollutant.output_band)
+    return Layer(pollutant, image, ee.Dictionary(sizes), region)
+
+
+def _has_data(layer):
+    return ee.Number(ee.List(layer.sizes.values()).reduce(ee.Reducer.min())).gt(0)
+
+
+def _reduce_if_data(layer, reducer, scale, best_effort):
+    # The reduction is only evaluated when every input collection has images
+    return ee.Algorithms.If(
+        _has_data(layer),
+        layer.image.reduceRegion(
+            reducer=reducer,
+            geometry=layer.region,
+            scale=scale,
+            bestEffort=best_effort
+        ),
+        None
+    )
+
+
+def summarise(layer, reducer, scale=1000, best_effort=False):
+    # Collection sizes and the region reduction as one ee.Dictionary, so a single
+    # getInfo answers both "is there data?" and "what are the statistics?".
+    stats = _reduce_if_data(layer, reducer, scale, best_effort)
+    return ee.Dictionary({'sizes': layer.sizes, 'stats': stats})
+
+
+def daily_series(pollutant, region, start_date, end_date, scale=1000):
+    # FeatureCollection with one (date, value) feature per day in
+    # [start_date, end_date), computed entirely server-side
+    pollutant = _resolve(pollutant)
+    start = ee.Date(start_date)
+    n_days = ee.Date(end_date).difference(start, 'day').round()
+
+    def day_feature(offset):
+        day = start.advance(offset, 'day')
+        layer = build_layer(pollutant, region, day, day.advance(1, 'day'))
+        stats = _reduce_if_data(layer, ee.Reducer.mean(), scale, False)
+        value = ee.Algorithms.If(stats, ee.Dictionary(stats).get(pollutant.output_band), None)
+        return ee.Feature(None, {'date': day.format('YYYY-MM-dd'), 'value': value})
+
+    return ee.FeatureCollection(ee.List.sequence(0, n_days.subtract(1)).map(day_feature))
+
+
+def regions_collection(regions):
+    # FeatureCollection of buffered points from (name, lat, lon, buffer) tuples
+    return ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Point(lon, lat).buffer(buffer), {'city': name})
+        for name, lat, lon, buffer in regions
+    ])
+
+
+def daily_regions_series(pollutant, regions, start_date, end_date, scale=1000):
+    # Like daily_series, but every region of the FeatureCollection is reduced
+    # together with reduceRegions, giving one (city, date, value) feature per
+    # region and day with data
+    pollutant = _resolve(pollutant)
+    start = ee.Date(start_date)
+    n_days = ee.Date(end_date).difference(start, 'day').round()
+    bounds = regions.geometry().bounds()
+
+    def day_features(offset):
+        day = start.advance(offset, 'day')
+        date = day.format('YYYY-MM-dd')
+        layer = build_layer(pollutant, bounds, day, day.advance(1, 'day'))
+        reduced = layer.image.reduceRegions(
+            collection=regions,
+            reducer=ee.Reducer.mean(),
+            scale=scale
+        ).map(lambda f: ee.Feature(None, {'city': f.get('city'), 'date': date, 'value': f.get('mean')}))
+        return ee.Algorithms.If(_has_data(layer), reduced, ee.FeatureCollection([]))
+
+    days = ee.List.sequence(0, n_days.subtract(1)).map(day_features)
+    return ee.FeatureCollection(days).flatten()
+
+
+def reduce_regions(pollutant, regions, start_date, end_date, reducer, scale=1000):
+    # The layer over [start_date, end_date) reduced for every region of the
+    # FeatureCollection; empty when an input collection has no images
+    pollutant = _resolve(pollutant)
+    layer = build_layer(pollutant, regions.geometry().bounds(), start_date, end_date)
+    reduced = layer.image.reduceRegions(collection=regions, reducer=reducer, scale=scale)
+    return ee.FeatureCollection(ee.Algorithms.If(_has_data(layer), reduced, ee.FeatureCollection([])))
+
+
+def date_chunks(start_date, end_date, chunk='year'):
+    # Split [start_date, end_date) into calendar month or year pieces
+    start = _as_date(start_date)
+    end = _as_date(end_date)
+    while start < end:
+        if chunk == 'month':
+            next_start = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        elif chunk == 'year':
+            next_start = start.replace(year=start.year + 1, month=1, day=1)
+        else:
+            raise ValueError(f'Unsupported chunk size: {chunk}')
+        yield start, min(next_start, end)
+        start = next_start
+
+
+def _as_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _days(start, end):
+    return [start + datetime.timedelta(days=i) for i in range((end - start).days)]
+
+
+def fetch_series(pollutant, region, start_date, end_date, scale=1000, chunk='year'):
+    # Daily values for [start_date, end_date) as a list of (date, value) pairs,
+    # with one getInfo per chunk. Days before the collection starts are
+    # returned as None without querying Earth Engine.
+    pollutant = _resolve(pollutant)
+    start = _as_date(start_date)
+    end = _as_date(end_date)
+    first_day = max(start, _as_date(pollutant.start_date))
+
+    rows = [(day, None) for day in _days(start, min(first_day, end))]
+    for chunk_start, chunk_end in date_chunks(first_day, end, chunk):
+        rows.extend(fetch_chunk(pollutant, region, chunk_start, chunk_end, scale))
+    return rows
+
+
+def fetch_chunk(pollutant, region, start_date, end_date, scale=1000):
+    pollutant = _resolve(pollutant)
+    start = _as_date(start_date)
+    end = _as_date(end_date)
+    with metrics.ee_call('fetch_chunk'):
+        features = daily_series(pollutant, region, start.isoformat(), end.isoformat(), scale).getInfo()['features']
+    values = {f['properties']['date']: f['properties'].get('value') for f in features}
+    return [(day, values.get(day.isoformat())) for day in _days(start, end)]
+
+
+def fetch_regions_chunk(pollutant, regions, start_date, end_date, scale=1000, max_elements=MAX_ELEMENTS):
+    # (city, date, value) for every (name, lat, lon, buffer) region and day in
+    # [start_date, end_date). Each getInfo returns one feature per region and
+    # day, so regions and days are split into requests of at most
+    # max_elements features.
+    pollutant = _resolve(pollutant)
+    start = _as_date(start_date)
+    end = _as_date(end_date)
+    days = _days(start, end)
+    names = [name for name, _, _, _ in regions]
+    if end <= _as_date(pollutant.start_date):
+        return [(name, day, None) for day in days for name in names]
+
+    group_size = min(len(regions), max_elements)
+    step = max(1, max_elements // max(group_size, 1))
+    values = {}
+    for i in range(0, len(regions), group_size):
+        group = regions_collection(regions[i:i + group_size])
+        for j in range(0, len(days), step):
+            part_start, part_end = days[j], days[min(j + step, len(days)) - 1] + datetime.timedelta(days=1)
+            with metrics.ee_call('fetch_regions_chunk'):
+                series = daily_regions_series(pollutant, group, part_start.isoformat(), part_end.isoformat(), scale)
+                features = series.getInfo()['features']
+            for f in features:
+                values[(f['properties']['city'], f['properties']['date'])] = f['properties'].get('value')
+    return [(name, day, values.get((name, day.isoformat()))) for day in days for name in names]
@@ -0,0 +1,327 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from flaskapp import metrics
+from flaskapp.regions import CATALOGUE, EARTH_RADIUS
+from flaskapp.stats_index import month_range, months
+
+
+# Daily composites of each pollutant layer over regions of interest, exported
+# from Earth Engine once and kept as memory-mapped NumPy arrays:
+#   <root>/<POLLUTANT>/<region>/grid.json   pixel grid and exported months
+#   <root>/<POLLUTANT>/<region>/YYYY-MM.npy float32 (days, height, width), NaN
+#                                           where there is no data
+# Queries for a circle inside a region and a date range the store holds are
+# answered with masked NumPy reductions over the mapped days, without Earth
+# Engine. Period statistics average the daily composites per pixel (a mean
+# of daily mixing ratios, where Earth Engine divides the period means).
+RESOLUTION = 0.01  # degrees per pixel
+EXPORT_RADIUS = 50000  # meters around each catalogue city
+LAG_DAYS = 5  # Sentinel-5P days younger than this are not final yet
+NODATA = -9999.0
+
+
+def region_grid(lat, lon, radius, resolution=RESOLUTION):
+    # North-up pixel grid covering the bounding box of a buffered point
+    dlat = radius / 111320.0
+    dlon = radius / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    west = math.floor((lon - dlon) / resolution) * resolution
+    north = math.ceil((lat + dlat) / resolution) * resolution
+    return {
+        'west': round(west, 9),
+        'north': round(north, 9),
+        'resolution': resolution,
+        'width': int(math.ceil((lon + dlon - west) / resolution)),
+        'height': int(math.ceil((north - (lat - dlat)) / resolution)),
+    }
+
+
+def _covers(grid, lat, lon, buffer):
+    dlat = buffer / 111320.0
+    dlon = buffer / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    east = grid['west'] + grid['width'] * grid['resolution']
+    south = grid['north'] - grid['height'] * grid['resolution']
+    return grid['west'] <= lon - dlon and lon + dlon <= east and south <= lat - dlat and lat + dlat <= grid['north']
+
+
+@lru_cache(maxsize=1024)
+def _window(west, north, resolution, width, height, lat, lon, buffer):
+    # (row slice, col slice, mask) of the pixels whose centre lies within
+    # buffer meters, cropped to their bounding box so only those rows are read
+    rows = north - (np.arange(height) + 0.5) * resolution
+    cols = west + (np.arange(width) + 0.5) * resolution
+    lats, lons = np.radians(rows)[:, None], np.radians(cols)[None, :]
+    p = math.radians(lat)
+    a = (np.sin((lats - p) / 2) ** 2
+         + math.cos(p) * np.cos(lats) * np.sin((lons - math.radians(lon)) / 2) ** 2)
+    inside = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0))) <= buffer
+    r, c = np.nonzero(inside)
+    if not len(r):
+        return None
+    window = slice(r.min(), r.max() + 1), slice(c.min(), c.max() + 1)
+    return window[0], window[1], inside[window]
+
+
+def _grid_window(grid, lat, lon, buffer):
+    return _window(grid['west'], grid['north'], grid['resolution'], grid['width'], grid['height'], lat, lon, buffer)
+
+
+class RasterStore:
+
+    def __init__(self, root, check_interval=5.0):
+        self.root = root
+        self.check_interval = check_interval  # seconds between looks for new exports
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._arrays = {}  # (path, through) -> memmap; a re-export changes through
+        self._grids = {}  # pollutant -> (checked at, {region: (grid.json mtime, grid)})
+
+    def _dir(self, pollutant, region):
+        return os.path.join(self.root, pollutant, region)
+
+    def grid(self, pollutant, region):
+        path = os.path.join(self._dir(pollutant, region), 'grid.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_grid(self, pollutant, region, grid):
+        path = os.path.join(self._dir(pollutant, region), 'grid.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(grid, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def regions(self, pollutant):
+        # {region: grid}, kept in memory; the directory is looked at again at
+        # most every check_interval seconds and only changed grids are re-read
+        with self._lock:
+            cached = self._grids.get(pollutant)
+        if cached is None or time.monotonic() - cached[0] > self.check_interval:
+            known = cached[1] if cached else {}
+            directory = os.path.join(self.root, pollutant)
+            entries = {}
+            for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+                try:
+                    mtime = os.stat(os.path.join(directory, name, 'grid.json')).st_mtime_ns
+                except OSError:
+                    continue
+                entry = known.get(name)
+                if entry is None or entry[0] != mtime:
+                    entry = (mtime, self.grid(pollutant, name))
+                entries[name] = entry
+            cached = (time.monotonic(), entries)
+            with self._lock:
+                self._grids[pollutant] = cached
+        return {name: grid for name, (_, grid) in cached[1].items()}
+
+    def put_month(self, pollutant, region, grid, month, values, through):
+        # values: (days in month, height, width); days from `through` on are
+        # not final and are exported again later
+        directory = self._dir(pollutant, region)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{month}.npy')
+        out = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float32, shape=values.shape)
+        out[:] = values
+        out.flush()
+        del out
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            stored = self.grid(pollutant, region) or dict(grid, months={})
+            stored['months'][month] = through.isoformat()
+            self._write_grid(pollutant, region, stored)
+            self._grids.pop(pollutant, None)
+
+    def _array(self, pollutant, region, month, through):
+        key = (os.path.join(self._dir(pollutant, region), f'{month}.npy'), through)
+        with self._lock:
+            array = self._arrays.get(key)
+        if array is None:
+            array = np.load(key[0], mmap_mode='r')
+            with self._lock:
+                for stale in [k for k in self._arrays if k[0] == key[0]]:
+                    del self._arrays[stale]
+                self._arrays[key] = array
+        return array
+
+    def _find(self, pollutant, lat, lon, buffer, start, end):
+        # (grid, [(month array, first day index, last day index)]) or None
+        # unless one region holds the circle and every day of [start, end)
+        for region, grid in self.regions(pollutant).items():
+            if not _covers(grid, lat, lon, buffer):
+                continue
+            chunks = []
+            for month in months(start, end):
+                through = grid['months'].get(month)
+                month_start, month_end = month_range(month)
+                if through is None or datetime.date.fromisoformat(through) < min(end, month_end):
+                    break
+                first = (max(start, month_start) - month_start).days
+                last = (min(end, month_end) - month_start).days
+                chunks.append((self._array(pollutant, region, month, through), first, last))
+            else:
+                return grid, chunks
+        return None
+
+    def holds(self, pollutant, lat, lon, buffer, start_date, end_date):
+        # Whether every day of [start_date, end_date) in the circle is stored
+        start = datetime.date.fromisoformat(str(start_date)[:10])
+        end = datetime.date.fromisoformat(str(end_date)[:10])
+        found = end > start and self._find(pollutant, lat, lon, buffer, start, end)
+        return bool(found) and _grid_window(found[0], lat, lon, buffer) is not None
+
+    def _windows(self, pollutant, lat, lon, buffer, start_date, end_date):
+        # (first day, mask, [(days, rows, cols) views of the month arrays]) of
+        # the circle's bounding box, or None if not stored
+        start = datetime.date.fromisoformat(str(start_date)[:10])
+        end = datetime.date.fromisoformat(str(end_date)[:10])
+        found = end > start and self._find(pollutant, lat, lon, buffer, start, end)
+        window = found and _grid_window(found[0], lat, lon, buffer)
+        with self._lock:
+            if window:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache_lookup('raster_store', bool(window))
+        if not window:
+            return None
+        rows, cols, mask = window
+        return start, mask, [data[first:last, rows, cols] for data, first, last in found[1]]
+
+    def composite_stats(self, pollutant, lat, lon, buffer, start_date, end_date, percentiles=()):
+        # {'count', 'min', 'max', 'mean', 'p<N>'...} of the per-pixel period
+        # means; count 0 when there is no data; None if not stored
+        with metrics.span('raster_store'):
+            found = self._windows(pollutant, lat, lon, buffer, start_date, end_date)
+            if found is None:
+                return None
+            mask = found[1]
+            total = np.zeros(mask.shape)
+            days = np.zeros(mask.shape, dtype=np.int64)
+            for chunk in found[2]:
+                valid = ~np.isnan(chunk)
+                total += np.where(valid, chunk, 0).sum(axis=0, dtype=np.float64)
+                days += valid.sum(axis=0)
+            mask = mask & (days > 0)
+            pixels = total[mask] / days[mask]
+            if not len(pixels):
+                return {'count': 0}
+            stats = {'count': int(len(pixels)), 'min': float(pixels.min()), 'max': float(pixels.max()),
+                     'mean': float(pixels.mean())}
+            for p in percentiles:
+                stats[f'p{p}'] = float(np.percentile(pixels, p))
+            return stats
+
+    def daily_means(self, pollutant, lat, lon, buffer, start_date, end_date):
+        # [(date, spatial mean or None)] for every day, or None if not stored
+        with metrics.span('raster_store'):
+            found = self._windows(pollutant, lat, lon, buffer, start_date, end_date)
+            if found is None:
+                return None
+            start, mask = found[0], found[1]
+            totals, counts = [], []
+            for chunk in found[2]:
+                valid = ~np.isnan(chunk) & mask
+                totals.append(np.where(valid, chunk, 0).sum(axis=(1, 2), dtype=np.float64))
+                counts.append(valid.sum(axis=(1, 2)))
+            totals, counts = np.concatenate(totals), np.concatenate(counts)
+            return [(start + datetime.timedelta(days=i), float(totals[i] / counts[i]) if counts[i] else None)
+                    for i in range(len(totals))]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+def export_month(store, pollutant, region, grid, month):
+    # One computePixels round trip: every final day of the month as a band
+    from flaskapp.backends import ee
+    from flaskapp.pollutants import _has_data, build_layer, get_pollutant
+
+    pollutant = get_pollutant(pollutant)
+    month_start, month_end = month_range(month)
+    through = min(month_end, datetime.date.today() - datetime.timedelta(days=LAG_DAYS))
+    n_days = (month_end - month_start).days
+    values = np.full((n_days, grid['height'], grid['width']), np.nan, dtype=np.float32)
+    first_day = datetime.date.fromisoformat(pollutant.start_date)
+    days = [month_start + datetime.timedelta(days=i) for i in range((through - month_start).days)]
+    days = [day for day in days if day >= first_day]
+
+    if days:
+        res = grid['resolution']
+        bounds = ee.Geometry.Rectangle([grid['west'], grid['north'] - grid['height'] * res,
+                                        grid['west'] + grid['width'] * res, grid['north']])
+        bands = []
+        for day in days:
+            layer = build_layer(pollutant, bounds, day.isoformat(), (day + datetime.timedelta(days=1)).isoformat())
+            image = ee.Algorithms.If(_has_data(layer), layer.image.unmask(NODATA), ee.Image.constant(NODATA))
+            bands.append(ee.Image(image).rename(f'd{day.day:02d}'))
+        with metrics.ee_call('computePixels'):
+            pixels = ee.data.computePixels({
+                'expression': ee.Image.cat(*bands),
+                'fileFormat': 'NUMPY_NDARRAY',
+                'grid': {
+                    'dimensions': {'width': grid['width'], 'height': grid['height']},
+                    'affineTransform': {'scaleX': res, 'shearX': 0, 'translateX': grid['west'],
+                                        'shearY': 0, 'scaleY': -res, 'translateY': grid['north']},
+                    'crsCode': 'EPSG:4326',
+                },
+            })
+        for day in days:
+            day_values = np.asarray(pixels[f'd{day.day:02d}'], dtype=np.float32)
+            values[(day - month_start).days] = np.where(day_values == NODATA, np.nan, day_values)
+
+    store.put_month(pollutant.name, region, grid, month, values, max(through, month_start))
+
+
+def missing_months(store, pollutant, region, month_list):
+    # Months not exported yet, or exported before all their days were final
+    stored = (store.grid(pollutant, region) or {}).get('months', {})
+    return [month for month in month_list
+            if stored.get(month) is None or datetime.date.fromisoformat(stored[month]) < month_range(month)[1]]
+
+
+if __name__ == '__main__':
+    from flaskapp.backends import use_local
+    from flaskapp.earthengine import SERVICE_ACCOUNT_FILE, get_ee
+
+    places = {place.name: place for place in CATALOGUE}
+    parser = argparse.ArgumentParser(description='Export daily composites into the local raster store')
+    parser.add_argument('--root', default=os.environ.get('RASTER_STORE_DIR', 'instance/rasters'))
+    parser.add_argument('--pollutants', nargs='+', default=['CO', 'NO2'])
+    parser.add_argument('--cities', nargs='+', default=list(places), choices=list(places))
+    parser.add_argument('--radius', type=int, default=EXPORT_RADIUS, help='Meters around each city to export')
+    parser.add_argument('--resolution', type=float, default=RESOLUTION, help='Degrees per pixel')
+    parser.add_argument('--start', default='2023-01')
+    parser.add_argument('--end', default=datetime.date.today().strftime('%Y-%m'), help='Last month, inclusive')
+    parser.add_argument('--offline', action='store_true', help='Use the local synthetic Earth Engine backend')
+    args = parser.parse_args()
+
+    if args.offline:
+        use_local()
+    else:
+        get_ee(os.environ.get('EE_SERVICE_ACCOUNT_FILE', SERVICE_ACCOUNT_FILE))
+
+    store = RasterStore(args.root)
+    month_list = months(args.start + '-01', month_range(args.end)[1])
+    for city in args.cities:
+        place = places[city]
+        for pollutant in args.pollutants:
+            pollutant = pollutant.upper()
+            grid = store.grid(pollutant, city) or region_grid(place.lat, place.lon, args.radius, args.resolution)
+            todo = missing_months(store, pollutant, city, month_list)
+            print(f"{city} {pollutant}: {grid['width']}x{grid['height']} pixels, {len(todo)} months to export")
+            for month in todo:
+                export_month(store, pollutant, city, grid, month)
+    print(metrics.summary())
@@ -0,0 +1,155 @@
+import json
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+from flaskapp.backends import get_backend
+from flaskapp.cache import DEFAULT_GRID, snap
+
+
+# A named region is a buffered point or a polygon ([lon, lat] vertices). For
+# polygons lat/lon is the vertex centroid and buffer the radius that covers
+# them, so code that works on circles (cache keys, the statistics index) can
+# use it too. Ad-hoc clicks near a catalogue region resolve to that region;
+# the rest are snapped onto the cache grid, so nearby requests share one
+# geometry, one Earth Engine expression and one cache entry.
+Place = namedtuple('Place', ['name', 'lat', 'lon', 'buffer', 'polygon'])
+
+# Cities offered on the home page and used by the scripts
+CATALOGUE = [
+    Place('Houston', 29.7604, -95.3698, 25000, None),
+    Place('Delhi', 28.7041, 77.1025, 25000, None),
+    Place('Hyderabad', 17.3850, 78.4867, 25000, None),
+    Place('Bangalore', 12.971599, 77.594566, 25000, None),
+]
+
+EARTH_RADIUS = 6371000.0  # meters
+SNAP_DISTANCE = 2000  # clicks this close to a region's centre use the region
+INDEX_CELL = 1.0  # degrees per spatial index bucket
+MAX_ERROR = 100  # meters of error allowed when Earth Engine approximates geometries
+
+
+def distance(lat1, lon1, lat2, lon2):
+    # Haversine distance in meters
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def polygon_place(name, polygon):
+    polygon = tuple((float(lon), float(lat)) for lon, lat in polygon)
+    lat = sum(p[1] for p in polygon) / len(polygon)
+    lon = sum(p[0] for p in polygon) / len(polygon)
+    radius = max(distance(lat, lon, p[1], p[0]) for p in polygon)
+    return Place(name, lat, lon, int(math.ceil(radius)), polygon)
+
+
+def load_catalogue(path):
+    # JSON list of {"name", "lat", "lon", "buffer"} or {"name", "polygon"}
+    with open(path) as f:
+        entries = json.load(f)
+    places = []
+    for entry in entries:
+        if entry.get('polygon'):
+            places.append(polygon_place(entry['name'], entry['polygon']))
+        else:
+            places.append(Place(entry['name'], float(entry['lat']), float(entry['lon']),
+                                int(entry.get('buffer', 25000)), None))
+    return places
+
+
+class RegionIndex:
+    # Regions bucketed by INDEX_CELL degree cells; nearest() scans rings of
+    # cells outwards, so a lookup touches a handful of regions, not all of them.
+    # Bucket columns wrap around the antimeridian.
+
+    def __init__(self, places=CATALOGUE, cell=INDEX_CELL):
+        self.cell = cell
+        self._columns = int(round(360 / cell))
+        self._by_name = {}
+        self._buckets = {}
+        for place in places:
+            self._by_name[place.name.lower()] = place
+            self._buckets.setdefault(self._bucket(place.lat, place.lon), []).append(place)
+
+    def _bucket(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell)) % self._columns
+
+    def get(self, name):
+        try:
+            return self._by_name[str(name).lower()]
+        except KeyError:
+            raise ValueError(f'Unknown region: {name}')
+
+    def names(self):
+        return [place.name for place in self._by_name.values()]
+
+    def nearest(self, lat, lon, max_distance):
+        # (place, distance) of the closest region within max_distance, or None
+        row, col = self._bucket(lat, lon)
+        cell_meters = self.cell * 111320.0 * max(math.cos(math.radians(min(abs(lat) + self.cell, 89.0))), 0.01)
+        rings = int(math.ceil(max_distance / cell_meters)) + 1
+        if (2 * rings + 1) ** 2 > len(self._buckets):
+            # The rings would touch more cells than hold regions: check every region
+            return self._closest(lat, lon, max_distance, self._by_name.values())
+
+        best = None
+        for ring in range(rings + 1):
+            cells = [(r, c % self._columns)
+                     for r in range(row - ring, row + ring + 1)
+                     for c in range(col - ring, col + ring + 1)
+                     if max(abs(r - row), abs(c - col)) == ring]
+            places = [place for cell in cells for place in self._buckets.get(cell, [])]
+            found = self._closest(lat, lon, max_distance, places)
+            if found is not None and (best is None or found[1] < best[1]):
+                best = found
+            if best is not None and best[1] <= ring * cell_meters:
+                # Nothing in a further ring can be closer
+                break
+        return best
+
+    @staticmethod
+    def _closest(lat, lon, max_distance, places):
+        best = None
+        for place in places:
+            d = distance(lat, lon, place.lat, place.lon)
+            if d <= max_distance and (best is None or d < best[1]):
+                best = place, d
+        return best
+
+    def resolve(self, lat, lon, buffer, grid=DEFAULT_GRID, snap_distance=SNAP_DISTANCE):
+        # The catalogue region for a click near one (keeping the requested
+        # buffer for circular regions), else the click snapped to the grid
+        found = self.nearest(lat, lon, snap_distance)
+        if found is not None:
+            place = found[0]
+            if place.polygon is None:
+                return place._replace(buffer=buffer)
+            return place
+        return Place(None, snap(lat, grid), snap(lon, grid), buffer, None)
+
+
+def place_params(place):
+    # JSON-serialisable form, stored with tile layers
+    return {'region': place.name, 'lat': place.lat, 'lon': place.lon, 'buffer': place.buffer,
+            'polygon': [list(p) for p in place.polygon] if place.polygon else None}
+
+
+def place_from_params(params):
+    polygon = params.get('polygon')
+    return Place(params.get('region'), params['lat'], params['lon'], params['buffer'],
+                 tuple(tuple(p) for p in polygon) if polygon else None)
+
+
+def geometry(place, max_error=MAX_ERROR):
+    # The same place always gives the same geometry object, so identical
+    # requests build identical Earth Engine expressions (and hit EE's caches)
+    return _geometry(get_backend(), place.lat, place.lon, place.buffer, place.polygon, max_error)
+
+
+@lru_cache(maxsize=4096)
+def _geometry(backend, lat, lon, buffer, polygon, max_error):
+    if polygon:
+        return backend.Geometry.Polygon([list(p) for p in polygon]).simplify(max_error)
+    return backend.Geometry.Point(lon, lat).buffer(buffer, max_error)
@@ -0,0 +1,162 @@
+import datetime
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+# Request shaping for the Earth Engine endpoints: parameters are validated
+# before anything is computed, each query's cost is estimated from its area,
+# days and input collections, oversized queries are downscaled (coarser
+# reduction scale, then sampling days of each month) and every client has a
+# request rate and a cost budget.
+MIN_BUFFER = 1000  # meters
+MAX_BUFFER = 250000
+MAX_DAYS = 3 * 366
+
+DEFAULT_SCALE = 1000  # meters
+MAX_SCALE = 10000
+MAX_QUERY_COST = 20.0  # megapixel-images per query after downscaling
+MIN_SAMPLE_DAYS = 3  # days of each month kept when sampling
+SAMPLE_MIN_SPAN = 60  # only queries longer than this many days are sampled
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_point(args):
+    # (lat, lon) from request args; 0 is a valid coordinate
+    try:
+        lat = float(args['lat'])
+        lon = float(args['lon'])
+    except KeyError:
+        raise ValueError('Latitude, longitude and buffer are required parameters.')
+    except ValueError:
+        raise ValueError('Latitude and longitude must be numbers.')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Latitude must be within [-90, 90] and longitude within [-180, 180].')
+    return lat, lon
+
+
+def parse_buffer(args, default=25000, max_buffer=MAX_BUFFER):
+    try:
+        buffer = int(float(args.get('buffer', default)))
+    except ValueError:
+        raise ValueError('buffer must be a number of meters.')
+    if not MIN_BUFFER <= buffer <= max_buffer:
+        raise ValueError(f'buffer must be between {MIN_BUFFER} and {max_buffer} meters.')
+    return buffer
+
+
+def parse_dates(args, default_start, default_end, max_days=MAX_DAYS, earliest=None):
+    # [start, end) as dates; a start before the collection's first day is
+    # moved up to it
+    try:
+        start = datetime.date.fromisoformat(args.get('start_date', default_start))
+        end = datetime.date.fromisoformat(args.get('end_date', default_end))
+    except ValueError:
+        raise ValueError('Dates must be given as YYYY-MM-DD.')
+    if earliest:
+        start = max(start, datetime.date.fromisoformat(earliest))
+    end = min(end, datetime.date.today() + datetime.timedelta(days=1))
+    if end <= start:
+        raise ValueError('end_date must be after start_date (and after the first day with data).')
+    if max_days and (end - start).days > max_days:
+        raise ValueError(f'The date range may cover at most {max_days} days.')
+    return start, end
+
+
+def estimate_cost(pollutant, buffer, days, scale=DEFAULT_SCALE, sample_days=None):
+    # Pixels in the region x images read, in millions. Mixing ratios also read
+    # the ERA5 surface pressure and H2O collections.
+    pixels = math.pi * buffer ** 2 / scale ** 2
+    collections = 3 if pollutant.mixing_ratio else 1
+    if sample_days:
+        days = days * min(sample_days, 28) / 30.4
+    return pixels * days * collections / 1e6
+
+
+def shape(pollutant, buffer, days, max_cost=MAX_QUERY_COST, max_scale=MAX_SCALE):
+    # (scale, sample_days, cost): full resolution when it fits, else the
+    # smallest downscaling that brings the cost under max_cost
+    scale, sample_days = DEFAULT_SCALE, None
+    cost = estimate_cost(pollutant, buffer, days, scale)
+    while cost > max_cost and scale < max_scale:
+        scale = min(scale * 2, max_scale)
+        cost = estimate_cost(pollutant, buffer, days, scale)
+    if cost > max_cost and days > SAMPLE_MIN_SPAN:
+        sample_days = 28
+        while cost > max_cost and sample_days > MIN_SAMPLE_DAYS:
+            sample_days = max(sample_days // 2, MIN_SAMPLE_DAYS)
+            cost = estimate_cost(pollutant, buffer, days, scale, sample_days)
+    return scale, sample_days, cost
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount=1.0):
+        # 0 when the tokens were taken, else seconds until they would be there.
+        # More than capacity is charged as a full bucket.
+        amount = min(amount, self.capacity)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class ClientLimiter:
+    # Per-client request rate and query-cost budget, as token buckets. The
+    # least recently seen clients are forgotten beyond max_clients.
+
+    def __init__(self, requests_per_second=5.0, burst=20, cost_per_minute=60.0, cost_burst=120.0,
+                 max_clients=10000):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.cost_per_minute = cost_per_minute
+        self.cost_burst = cost_burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._clients = OrderedDict()  # client -> (request bucket, cost bucket)
+        self._lock = threading.Lock()
+
+    def _buckets(self, client):
+        buckets = self._clients.get(client)
+        if buckets is None:
+            buckets = (TokenBucket(self.requests_per_second, self.burst),
+                       TokenBucket(self.cost_per_minute / 60, self.cost_burst))
+            self._clients[client] = buckets
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client)
+        return buckets
+
+    def check_rate(self, client):
+        with self._lock:
+            wait = self._buckets(client)[0].take()
+            if wait:
+                self.limited += 1
+                raise RateLimited('Too many requests; slow down.', wait)
+
+    def charge(self, client, cost):
+        with self._lock:
+            wait = self._buckets(client)[1].take(cost)
+            if wait:
+                self.limited += 1
+                raise RateLimited(f'Query cost budget exhausted ({cost:.1f} Mpx requested).', wait)
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'limited': self.limited,
+                    'requests_per_second': self.requests_per_second, 'cost_per_minute': self.cost_per_minute}
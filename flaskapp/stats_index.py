@@ -0,0 +1,272 @@
+import argparse
+import datetime
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from flaskapp import metrics
+
+
+# Per (pollutant, grid cell, month) pixel statistics: count, min, max, sum and
+# a fixed-bin histogram. All of them merge by addition (or min/max), so any
+# buffer and date range is answered by combining the cells and months it
+# touches, without an Earth Engine reduction.
+CELL_SIZE = 0.25  # degrees
+HISTOGRAM_BINS = 256
+
+# Histogram range per pollutant, in the layer's units. Pixels outside it still
+# count towards min/max/mean but not towards percentiles.
+HISTOGRAM_RANGES = {
+    'CO': (0.0, 400.0),
+    'NO2': (0.0, 20.0),
+    'SO2': (-20.0, 60.0),
+    'O3': (150.0, 550.0),
+    'HCHO': (-5.0, 15.0),
+    'CH4': (1700.0, 2100.0),
+    'AER_AI': (-5.0, 10.0),
+}
+
+STRETCH = re.compile(r'^p(\d{1,2})-(\d{1,3})$')
+
+# count: pixels behind the summary; histogram: counts per bin over hist_range
+Summary = namedtuple('Summary', ['count', 'min', 'max', 'mean', 'histogram', 'hist_range'])
+
+
+def parse_stretch(value):
+    # 'minmax' or percentiles like 'p2-98' -> None or (2, 98)
+    if value in (None, '', 'minmax'):
+        return None
+    match = STRETCH.match(value)
+    if not match or not 0 <= int(match.group(1)) < int(match.group(2)) <= 100:
+        raise ValueError(f"Unsupported stretch: {value} (use 'minmax' or e.g. 'p2-98')")
+    return int(match.group(1)), int(match.group(2))
+
+
+def cell_of(lat, lon, cell_size=CELL_SIZE):
+    return int(math.floor(lat / cell_size)), int(math.floor(lon / cell_size))
+
+
+def cell_bounds(cell, cell_size=CELL_SIZE):
+    # (west, south, east, north)
+    row, col = cell
+    return col * cell_size, row * cell_size, (col + 1) * cell_size, (row + 1) * cell_size
+
+
+def cells_for_region(lat, lon, buffer, cell_size=CELL_SIZE):
+    # Cells touching the bounding box of the buffered point
+    dlat = buffer / 111320.0
+    dlon = buffer / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    row0, col0 = cell_of(lat - dlat, lon - dlon, cell_size)
+    row1, col1 = cell_of(lat + dlat, lon + dlon, cell_size)
+    return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+
+def months(start_date, end_date):
+    # 'YYYY-MM' of every month overlapping [start_date, end_date)
+    start = datetime.date.fromisoformat(str(start_date)[:10])
+    end = datetime.date.fromisoformat(str(end_date)[:10])
+    result = []
+    month = start.replace(day=1)
+    while month < end:
+        result.append(month.strftime('%Y-%m'))
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+    return result
+
+
+def month_range(month):
+    start = datetime.date.fromisoformat(month + '-01')
+    return start, (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def percentile(summary, p):
+    # Interpolated from the histogram and clamped to the exact min/max
+    counts = summary.histogram
+    total = counts.sum()
+    if total == 0:
+        return summary.min if p < 50 else summary.max
+    low, high = summary.hist_range
+    width = (high - low) / len(counts)
+    cumulative = np.cumsum(counts)
+    target = p / 100 * total
+    i = int(np.searchsorted(cumulative, target))
+    i = min(i, len(counts) - 1)
+    before = cumulative[i - 1] if i else 0
+    fraction = (target - before) / counts[i] if counts[i] else 0.0
+    value = low + (i + fraction) * width
+    return float(min(max(value, summary.min), summary.max))
+
+
+def stretch_range(summary, stretch=None):
+    # (low, high) for the colour palette
+    if stretch is None:
+        return summary.min, summary.max
+    return percentile(summary, stretch[0]), percentile(summary, stretch[1])
+
+
+class StatsIndex:
+
+    def __init__(self, path, cell_size=CELL_SIZE):
+        self.path = path
+        self.cell_size = cell_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cell_stats '
+            '(pollutant TEXT, cell_size REAL, cell_row INTEGER, cell_col INTEGER, month TEXT, '
+            'count INTEGER, min REAL, max REAL, sum REAL, hist_low REAL, hist_high REAL, histogram BLOB, '
+            'updated TEXT, PRIMARY KEY (pollutant, cell_size, cell_row, cell_col, month))'
+        )
+        self._db.commit()
+
+    def put(self, pollutant, month, rows, updated=None):
+        # rows: (cell, count, min, max, sum, histogram counts)
+        low, high = HISTOGRAM_RANGES[pollutant]
+        updated = updated or datetime.date.today().isoformat()
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO cell_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(pollutant, self.cell_size, cell[0], cell[1], month, count, vmin, vmax, vsum, low, high,
+                  np.asarray(histogram, dtype=np.int64).tobytes(), updated)
+                 for cell, count, vmin, vmax, vsum, histogram in rows]
+            )
+            self._db.commit()
+
+    def _rows(self, pollutant, cells, month_list):
+        rows = []
+        with self._lock:
+            for month in month_list:
+                rows += self._db.execute(
+                    'SELECT cell_row, cell_col, month, count, min, max, sum, hist_low, hist_high, histogram, updated '
+                    'FROM cell_stats WHERE pollutant = ? AND cell_size = ? AND month = ?',
+                    (pollutant, self.cell_size, month)
+                ).fetchall()
+        cells = set(cells)
+        return [r for r in rows if (r[0], r[1]) in cells]
+
+    def summary(self, pollutant, lat, lon, buffer, start_date, end_date):
+        # Merged statistics, or None unless every cell and month is indexed
+        # and has pixels
+        cells = cells_for_region(lat, lon, buffer, self.cell_size)
+        month_list = months(start_date, end_date)
+        rows = self._rows(pollutant, cells, month_list)
+        if not month_list or len(rows) < len(cells) * len(month_list):
+            self.misses += 1
+            return None
+        rows = [r for r in rows if r[3]]
+        if not rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        count = sum(r[3] for r in rows)
+        return Summary(
+            count=count,
+            min=min(r[4] for r in rows),
+            max=max(r[5] for r in rows),
+            mean=sum(r[6] for r in rows) / count,
+            histogram=sum(np.frombuffer(r[9], dtype=np.int64) for r in rows),
+            hist_range=(rows[0][7], rows[0][8]),
+        )
+
+    def missing_months(self, pollutant, cells, month_list, lag_days=5):
+        # Months with a cell not indexed yet, or indexed before the month's
+        # data was final (Sentinel-5P products arrive a few days late)
+        missing = []
+        for month in month_list:
+            rows = self._rows(pollutant, cells, [month])
+            final = (month_range(month)[1] + datetime.timedelta(days=lag_days)).isoformat()
+            if len(rows) < len(cells) or any(r[10] < final for r in rows):
+                missing.append(month)
+        return missing
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM cell_stats').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': entries,
+            'cell_size': self.cell_size,
+        }
+
+
+def build(index, pollutant, cells, month_list, scale=1000):
+    # Offline job: one reduceRegions round trip per month covering every cell
+    from flaskapp.backends import ee
+    from flaskapp.pollutants import get_pollutant, reduce_regions
+
+    pollutant = get_pollutant(pollutant)
+    low, high = HISTOGRAM_RANGES[pollutant.name]
+    reducer = (ee.Reducer.minMax()
+               .combine(ee.Reducer.mean(), '', True)
+               .combine(ee.Reducer.count(), '', True)
+               .combine(ee.Reducer.fixedHistogram(low, high, HISTOGRAM_BINS), '', True))
+    regions = ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Rectangle(list(cell_bounds(cell, index.cell_size))), {'cell': f'{cell[0]}_{cell[1]}'})
+        for cell in cells
+    ])
+
+    for month in month_list:
+        start, end = month_range(month)
+        end = min(end, datetime.date.today())
+        if end <= datetime.date.fromisoformat(pollutant.start_date):
+            features = []
+        else:
+            with metrics.ee_call('reduce_regions'):
+                features = reduce_regions(pollutant, regions, start.isoformat(), end.isoformat(),
+                                          reducer, scale).getInfo()['features']
+        found = {f['properties']['cell']: f['properties'] for f in features}
+
+        rows = []
+        for cell in cells:
+            props = found.get(f'{cell[0]}_{cell[1]}', {})
+            count = props.get('count') or 0
+            if not count or props.get('min') is None:
+                rows.append((cell, 0, None, None, 0.0, np.zeros(HISTOGRAM_BINS)))
+                continue
+            histogram = [c for _, c in props.get('histogram') or []] or np.zeros(HISTOGRAM_BINS)
+            rows.append((cell, count, props['min'], props['max'], props['mean'] * count, histogram))
+        index.put(pollutant.name, month, rows)
+        print(f"{pollutant.name} {month}: {sum(1 for r in rows if r[1])}/{len(cells)} cells with data")
+
+
+if __name__ == '__main__':
+    from flaskapp.backends import use_local
+    from flaskapp.earthengine import SERVICE_ACCOUNT_FILE, get_ee
+    from flaskapp.tiles import POPULAR_CITIES
+
+    parser = argparse.ArgumentParser(description='Build the per-cell monthly statistics index')
+    parser.add_argument('--db', default=os.environ.get('STATS_INDEX_DB', 'instance/stats_index.db'))
+    parser.add_argument('--pollutants', nargs='+', default=['CO'])
+    parser.add_argument('--cities', nargs='+', default=list(POPULAR_CITIES), choices=list(POPULAR_CITIES))
+    parser.add_argument('--radius', type=int, default=100000, help='Meters around each city to index')
+    parser.add_argument('--start', default='2019-01')
+    parser.add_argument('--end', default=datetime.date.today().strftime('%Y-%m'), help='Last month, inclusive')
+    parser.add_argument('--scale', type=int, default=1000)
+    parser.add_argument('--force', action='store_true', help='Recompute months that are already indexed')
+    parser.add_argument('--offline', action='store_true', help='Use the local synthetic Earth Engine backend')
+    args = parser.parse_args()
+
+    if args.offline:
+        use_local()
+    else:
+        get_ee(os.environ.get('EE_SERVICE_ACCOUNT_FILE', SERVICE_ACCOUNT_FILE))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    index = StatsIndex(args.db)
+    month_list = months(args.start + '-01', month_range(args.end)[1])
+    for city in args.cities:
+        lat, lon = POPULAR_CITIES[city]
+        cells = cells_for_region(lat, lon, args.radius, index.cell_size)
+        for pollutant in args.pollutants:
+            todo = month_list if args.force else index.missing_months(pollutant, cells, month_list)
+            print(f"{city} {pollutant}: {len(cells)} cells, {len(todo)} months to index")
+            build(index, pollutant, cells, todo, args.scale)
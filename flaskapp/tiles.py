@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+
+
+# Rendered map tiles are kept in an MBTiles-style SQLite file (one `tiles`
+# table keyed by layer, with TMS row numbering) and evicted least recently
+# used once the file holds more than max_bytes of tile data.
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60  # seconds browsers may reuse a tile
+
+# Cities offered on the home page, seeded by default
+POPULAR_CITIES = {
+    'Houston': (29.7604, -95.3698),
+    'Delhi': (28.7041, 77.1025),
+}
+
+
+def layer_key(cache_key, vis_range):
+    # Short, URL-safe id for a layer. The colour range is part of it: a layer
+    # re-registered with a new stretch gets new tiles instead of mixing in the
+    # cached ones drawn with the old stretch.
+    return hashlib.sha1(f'{cache_key}|{vis_range[0]}|{vis_range[1]}'.encode()).hexdigest()[:20]
+
+
+def tile_range(lat, lon, buffer, zoom):
+    # (x, y) of every web-mercator tile touching the buffered point at this zoom
+    dlat = buffer / 111320.0
+    dlon = buffer / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    n = 2 ** zoom
+
+    def tile_x(value):
+        return min(n - 1, max(0, int((value + 180) / 360 * n)))
+
+    def tile_y(value):
+        value = max(min(value, 85.0511), -85.0511)
+        return min(n - 1, max(0, int((1 - math.asinh(math.tan(math.radians(value))) / math.pi) / 2 * n)))
+
+    return [(x, y) for x in range(tile_x(lon - dlon), tile_x(lon + dlon) + 1)
+            for y in range(tile_y(lat + dlat), tile_y(lat - dlat) + 1)]
+
+
+class TileCache:
+    # Also remembers, per layer key, the request parameters and the current
+    # upstream tile URL so a layer can be re-rendered after its EE map id expires.
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS layers
+                (key TEXT PRIMARY KEY, params TEXT, url_format TEXT, expires_at REAL);
+            CREATE TABLE IF NOT EXISTS tiles
+                (layer TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                 tile_data BLOB, etag TEXT, size INTEGER, last_access REAL,
+                 PRIMARY KEY (layer, zoom_level, tile_column, tile_row));
+            CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access);
+            INSERT OR IGNORE INTO metadata VALUES ('format', 'png');
+        ''')
+        self._db.commit()
+        self._bytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM tiles').fetchone()[0]
+
+    def put_layer(self, key, params, url_format, expires_at):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO layers VALUES (?, ?, ?, ?)',
+                             (key, json.dumps(params), url_format, expires_at))
+            self._db.commit()
+
+    def layer(self, key):
+        # (params, url_format, expires_at) or None for an unknown key
+        with self._lock:
+            row = self._db.execute('SELECT params, url_format, expires_at FROM layers WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def get(self, key, z, x, y):
+        # (tile bytes, etag) or None
+        tile = (key, z, x, 2 ** z - 1 - y)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT tile_data, etag FROM tiles '
+                'WHERE layer = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', tile
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                'UPDATE tiles SET last_access = ? '
+                'WHERE layer = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', (time.time(),) + tile
+            )
+            self._db.commit()
+        return bytes(row[0]), row[1]
+
+    def put(self, key, z, x, y, data):
+        etag = hashlib.sha1(data).hexdigest()
+        tile = (key, z, x, 2 ** z - 1 - y)
+        with self._lock:
+            old = self._db.execute(
+                'SELECT size FROM tiles WHERE layer = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', tile
+            ).fetchone()
+            self._bytes -= old[0] if old else 0
+            self._db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             tile + (data, etag, len(data), time.time()))
+            self._bytes += len(data)
+            self._evict()
+            self._db.commit()
+        return etag
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            rows = self._db.execute(
+                'SELECT rowid, size FROM tiles ORDER BY last_access LIMIT 256'
+            ).fetchall()
+            if not rows:
+                break
+            for rowid, size in rows:
+                if self._bytes <= self.max_bytes:
+                    break
+                self._db.execute('DELETE FROM tiles WHERE rowid = ?', (rowid,))
+                self._bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            tiles, layers = self._db.execute(
+                'SELECT (SELECT COUNT(*) FROM tiles), (SELECT COUNT(*) FROM layers)'
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'tiles': tiles,
+                'layers': layers,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def seed(app, cities, pollutants, zooms, buffer=25000, start_date='2024-01-01', end_date='2024-05-31'):
+    # Render every tile of the given layers through the app, so the first
+    # visitor of a popular city gets them from the cache
+    client = app.test_client()
+    counts = {'layers': 0, 'tiles': 0, 'failed': 0}
+    for city, (lat, lon) in cities.items():
+        for pollutant in pollutants:
+            response = client.get('/api/get-co-density', query_string={
+                'lat': lat, 'lon': lon, 'buffer': buffer, 'pollutant': pollutant,
+                'start_date': start_date, 'end_date': end_date,
+            })
+            if response.status_code != 200:
+                print(f"{city} {pollutant}: {response.json.get('error')}")
+                continue
+            counts['layers'] += 1
+            tile_url = response.json['tile_url']
+            for zoom in zooms:
+                for x, y in tile_range(lat, lon, buffer, zoom):
+                    status = client.get(tile_url.format(z=zoom, x=x, y=y)).status_code
+                    counts['tiles' if status == 200 else 'failed'] += 1
+            print(f"{city} {pollutant}: seeded zoom {min(zooms)}-{max(zooms)}")
+    return counts
+
+
+if __name__ == '__main__':
+    from flaskapp.app import create_app
+
+    parser = argparse.ArgumentParser(description='Pre-render map tiles for popular cities')
+    parser.add_argument('--cities', nargs='+', default=list(POPULAR_CITIES), choices=list(POPULAR_CITIES))
+    parser.add_argument('--pollutants', nargs='+', default=['CO'])
+    parser.add_argument('--zooms', type=int, nargs='+', default=[8, 9, 10, 11])
+    parser.add_argument('--buffer', type=int, default=25000)
+    parser.add_argument('--start-date', default='2024-01-01')
+    parser.add_argument('--end-date', default='2024-05-31')
+    args = parser.parse_args()
+
+    counts = seed(create_app(), {c: POPULAR_CITIES[c] for c in args.cities}, args.pollutants, args.zooms,
+                  args.buffer, args.start_date, args.end_date)
+    print(f"{counts['layers']} layers, {counts['tiles']} tiles cached, {counts['failed']} failed")
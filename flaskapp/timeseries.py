@@ -0,0 +1,179 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from flaskapp import metrics
+from flaskapp.cache import snap
+from flaskapp.regions import Place, geometry, place_from_params, place_params
+
+
+# Daily values per tracked series (pollutant + region) in
+# SQLite. Each series remembers the [first_day, last_day) range already
+# fetched, so extending it only asks Earth Engine for the days outside it;
+# monthly and yearly values are aggregated from the stored days.
+FREQUENCIES = {
+    'daily': 10,  # length of the date prefix each frequency groups by
+    'monthly': 7,
+    'yearly': 4,
+}
+
+# Sentinel-5P products arrive a few days late; days newer than this are
+# fetched again on the next update
+LAG_DAYS = 5
+
+log = logging.getLogger(__name__)
+
+
+def series_key(pollutant, place, grid):
+    parts = [str(pollutant).upper(), '%.6f' % snap(place.lat, grid), '%.6f' % snap(place.lon, grid),
+             str(int(place.buffer))]
+    return '|'.join(parts + [place.name] if place.polygon else parts)
+
+
+def _as_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+class TimeseriesStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._series_locks = {}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS series
+                (key TEXT PRIMARY KEY, pollutant TEXT, place TEXT, first_day TEXT, last_day TEXT, updated TEXT);
+            CREATE TABLE IF NOT EXISTS daily
+                (key TEXT, date TEXT, value REAL, PRIMARY KEY (key, date));
+        ''')
+        self._db.commit()
+
+    def series_lock(self, key):
+        with self._lock:
+            return self._series_locks.setdefault(key, threading.Lock())
+
+    def series(self, key=None):
+        # {key: (pollutant, place, first_day, last_day)}
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT key, pollutant, place, first_day, last_day FROM series'
+                + (' WHERE key = ?' if key else ''), (key,) if key else ()
+            ).fetchall()
+        return {r[0]: (r[1], place_from_params(json.loads(r[2])), _as_date(r[3]), _as_date(r[4])) for r in rows}
+
+    def put(self, key, pollutant, place, first_day, last_day, rows):
+        # rows: (date, value) for days in [first_day, last_day)
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?)',
+                                 [(key, day.isoformat(), value) for day, value in rows])
+            self._db.execute('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, pollutant, json.dumps(place_params(place)), first_day.isoformat(),
+                              last_day.isoformat(),
+                              datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')))
+            self._db.commit()
+
+    def query(self, key, start_date, end_date, freq='daily'):
+        # [(period, mean value, days with data)] over [start_date, end_date)
+        width = FREQUENCIES[freq]
+        with self._lock:
+            return self._db.execute(
+                'SELECT substr(date, 1, ?) AS period, AVG(value), COUNT(value) FROM daily '
+                'WHERE key = ? AND date >= ? AND date < ? GROUP BY period ORDER BY period',
+                (width, key, _as_date(start_date).isoformat(), _as_date(end_date).isoformat())
+            ).fetchall()
+
+    def stats(self):
+        with self._lock:
+            series, days = self._db.execute(
+                'SELECT (SELECT COUNT(*) FROM series), (SELECT COUNT(*) FROM daily)'
+            ).fetchone()
+        return {'series': series, 'days': days}
+
+
+def gaps(store, pollutant, place, start_date, end_date, grid):
+    # (series key, [(gap start, gap end)] of days in [start_date, end_date)
+    # that can be final by now but are not stored, (first_day, last_day))
+    key = series_key(pollutant, place, grid)
+    start = _as_date(start_date)
+    end = min(_as_date(end_date), datetime.date.today() - datetime.timedelta(days=LAG_DAYS))
+    known = store.series(key).get(key)
+    first_day, last_day = (known[2], known[3]) if known else (start, start)
+    missing = []
+    if start < first_day:
+        missing.append((start, first_day))
+    if last_day < end:
+        missing.append((last_day, end))
+    return key, missing, (first_day, last_day)
+
+
+def ensure(store, pollutant, place, start_date, end_date, grid, scale=1000, chunk='year', rasters=None):
+    # Make sure the store holds every day of [start_date, end_date) that can
+    # be final by now, fetching only the missing ones; returns the series key.
+    # Gaps a raster store (flaskapp.raster_store) holds are filled from it.
+    from flaskapp.pollutants import fetch_series, get_pollutant
+
+    pollutant = get_pollutant(pollutant)
+    key = series_key(pollutant.name, place, grid)
+
+    with store.series_lock(key):
+        key, missing, (first_day, last_day) = gaps(store, pollutant.name, place, start_date, end_date, grid)
+        metrics.cache_lookup('timeseries', not missing)
+        if not missing:
+            return key
+
+        region = None
+        for gap_start, gap_end in missing:
+            rows = None
+            if rasters and place.polygon is None:
+                rows = rasters.daily_means(pollutant.name, place.lat, place.lon, place.buffer, gap_start, gap_end)
+            if rows is None:
+                # Built only here, so gaps the raster store fills need no Earth Engine
+                region = geometry(place) if region is None else region
+                rows = fetch_series(pollutant, region, gap_start, gap_end, scale, chunk)
+            first_day, last_day = min(first_day, gap_start), max(last_day, gap_end)
+            store.put(key, pollutant.name, place, first_day, last_day, rows)
+            log.info('%s: stored %d days from %s to %s', key, len(rows), gap_start, gap_end)
+    return key
+
+
+def update_all(store, grid, scale=1000):
+    # The incremental job: extend every tracked series up to today
+    today = datetime.date.today()
+    for key, (pollutant, place, first_day, last_day) in store.series().items():
+        ensure(store, pollutant, place, first_day, today, grid, scale)
+
+
+if __name__ == '__main__':
+    from flaskapp.backends import use_local
+    from flaskapp.cache import DEFAULT_GRID
+    from flaskapp.earthengine import SERVICE_ACCOUNT_FILE, get_ee
+
+    parser = argparse.ArgumentParser(description='Extend the stored daily series with newly available days')
+    parser.add_argument('--db', default=os.environ.get('TIMESERIES_DB', 'instance/timeseries.db'))
+    parser.add_argument('--add', nargs=4, metavar=('POLLUTANT', 'LAT', 'LON', 'BUFFER'),
+                        help='Start tracking a new series')
+    parser.add_argument('--start-date', default='2019-01-01', help='History start for --add')
+    parser.add_argument('--offline', action='store_true', help='Use the local synthetic Earth Engine backend')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.offline:
+        use_local()
+    else:
+        get_ee(os.environ.get('EE_SERVICE_ACCOUNT_FILE', SERVICE_ACCOUNT_FILE))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    store = TimeseriesStore(args.db)
+    if args.add:
+        pollutant, lat, lon, buffer = args.add
+        place = Place(None, snap(float(lat)), snap(float(lon)), int(buffer), None)
+        ensure(store, pollutant, place, args.start_date, datetime.date.today(), DEFAULT_GRID)
+    update_all(store, DEFAULT_GRID)
+    print(store.stats())
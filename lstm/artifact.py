@@ -0,0 +1,124 @@
+import datetime
+import json
+import os
+import shutil
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+
+# A model artifact is a directory holding everything inference needs:
+#   manifest.json   format version, model config, scaler parameters,
+#                   seq_length, features, training range and the last
+#                   seq_length observed values
+#   weights/NNN.npy one uncompressed array per weight tensor, so they can be
+#                   memory-mapped and shared between worker processes
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+WEIGHTS_DIR = 'weights'
+MODEL_DIR = 'model'
+
+Artifact = namedtuple('Artifact', ['path', 'manifest', 'weights', 'scaler', 'seq_length', 'features',
+                                   'history', 'last_date'])
+
+
+def model_path(pollutant, city, model_dir=MODEL_DIR):
+    # Artifact directory, e.g. model/co_houston
+    name = f"{pollutant.lower()}_{city.lower().replace(' ', '_')}"
+    return os.path.join(model_dir, name)
+
+
+def save_artifact(path, model, scaler, seq_length, data, features=('value',), pollutant=None, city=None):
+    # data: the date-indexed frame the model was trained on
+    features = list(features)
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'pollutant': pollutant,
+        'city': city,
+        'seq_length': seq_length,
+        'features': features,
+        'model_config': json.loads(model.to_json()),
+        'scaler': {
+            'feature_range': list(scaler.feature_range),
+            'data_min': scaler.data_min_.tolist(),
+            'data_max': scaler.data_max_.tolist(),
+            'n_samples_seen': int(scaler.n_samples_seen_),
+        },
+        'training_range': {
+            'start': data.index[0].strftime('%Y-%m-%d'),
+            'end': data.index[-1].strftime('%Y-%m-%d'),
+            'days': len(data),
+        },
+        'history': {
+            'last_date': data.index[-1].strftime('%Y-%m-%d'),
+            'values': data[features].to_numpy()[-seq_length:].tolist(),
+        },
+    }
+
+    # Write into a temporary directory and swap it in, so readers never see a
+    # half-written artifact
+    tmp_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_path, WEIGHTS_DIR))
+    weights = model.get_weights()
+    for i, w in enumerate(weights):
+        np.save(os.path.join(tmp_path, WEIGHTS_DIR, f'{i:03d}.npy'), np.asarray(w, dtype=np.float32))
+    manifest['weights'] = len(weights)
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _scaler(params):
+    # Rebuild a fitted MinMaxScaler from its saved parameters
+    scaler = MinMaxScaler(feature_range=tuple(params['feature_range']))
+    data_min = np.asarray(params['data_min'], dtype=np.float64)
+    data_max = np.asarray(params['data_max'], dtype=np.float64)
+    data_range = data_max - data_min
+    low, high = scaler.feature_range
+    scaler.data_min_ = data_min
+    scaler.data_max_ = data_max
+    scaler.data_range_ = data_range
+    scaler.scale_ = (high - low) / np.where(data_range == 0, 1.0, data_range)
+    scaler.min_ = low - data_min * scaler.scale_
+    scaler.n_features_in_ = len(data_min)
+    scaler.n_samples_seen_ = params['n_samples_seen']
+    return scaler
+
+
+def load_artifact(path, mmap=True):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"{path}: artifact format {manifest['format_version']} is newer than "
+                         f"supported ({FORMAT_VERSION})")
+
+    weights = [
+        np.load(os.path.join(path, WEIGHTS_DIR, f'{i:03d}.npy'), mmap_mode='r' if mmap else None)
+        for i in range(manifest['weights'])
+    ]
+    history = manifest['history']
+    return Artifact(
+        path=path,
+        manifest=manifest,
+        weights=weights,
+        scaler=_scaler(manifest['scaler']),
+        seq_length=manifest['seq_length'],
+        features=manifest['features'],
+        history=np.asarray(history['values'], dtype=np.float64),
+        last_date=pd.Timestamp(history['last_date']),
+    )
+
+
+def build_keras_model(artifact):
+    from tensorflow.keras.models import model_from_json
+
+    model = model_from_json(json.dumps(artifact.manifest['model_config']))
+    model.set_weights([np.asarray(w) for w in artifact.weights])
+    return model
@@ -1,115 +1,146 @@
-import ee
+import argparse
+import os
+import sys
 import pandas as pd
 import datetime
 
-# Initialize the Earth Engine API
-ee.Initialize()
-
-# Constants
-g = 9.82  # m/s^2
-m_H2O = 0.01801528  # kg/mol
-m_dry_air = 0.0289644  # kg/mol
-
-def get_co_data(start_date, end_date, region, scale):
-    try:
-        # Define the Sentinel-5P CO dataset
-        filtered_collection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CO') \
-        .filterBounds(region) \
-        .filterDate(start_date, end_date) \
-        .select(['CO_column_number_density', 'H2O_column_number_density'])
-
-        surface_pressure_collection = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-        .filterBounds(region) \
-        .filterDate(start_date, end_date) \
-        .select('surface_pressure')
-
-        # Check if the collections are empty
-        if filtered_collection.size().getInfo() == 0 or surface_pressure_collection.size().getInfo() == 0:
-            return None
-
-        # Calculate the mean over the collection for CO, H2O, and surface pressure
-        CO_mean_month = filtered_collection.select('CO_column_number_density').mean().clip(region)
-        H2O_mean_month = filtered_collection.select('H2O_column_number_density').mean().clip(region)
-        surface_pressure_mean_month = surface_pressure_collection.mean().clip(region)
-
-        # Calculate TC_dry_air for the month
-        TC_dry_air_month = surface_pressure_mean_month.divide(g * m_dry_air).subtract(H2O_mean_month.multiply(m_H2O / m_dry_air))
-
-        # Calculate XCO for the month
-        XCO_month = CO_mean_month.divide(TC_dry_air_month).rename('XCO')
-        XCO_ppb_month = XCO_month.multiply(1e9).rename('XCO_ppb')
-
-        # Calculate the mean CO concentration for the month
-        mean_value = XCO_ppb_month.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=region,
-        scale=1000
-        ).getInfo()
-        # Convert XCO to ppb
-        co_value = mean_value.get('XCO_ppb')
-
-        if co_value is None:
-            raise ValueError(f"No data available for date range: {start_date} to {end_date}")
-        return co_value
-
-    except Exception as e:
-        print(f"Error retrieving data for {start_date} to {end_date}: {e}")
-        return None
-
-def generate_dates(start_year, end_year):
-    dates = []
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp import metrics
+from flaskapp.backends import ee, use_local
+from flaskapp.pollutants import date_chunks, fetch_regions_chunk, fetch_series
+from flaskapp.regions import Place, geometry
+from lstm import store
+from lstm.downloader import Checkpoint, run_tasks
+
+CHECKPOINT_DIR = 'dataset/checkpoints'
+
+def download_co_data(lat, lon, start_year, end_year, city='Houston', scale=1000, chunk='month',
+                     max_workers=4, store_dir=store.STORE_DIR, checkpoint_dir=CHECKPOINT_DIR):
+    region = geometry(Place(city, lat, lon, 25000, None))  # 25 km buffer radius
     start_date = datetime.date(start_year, 1, 1)
-    end_date = datetime.date(end_year, 12, 31)
-    delta = datetime.timedelta(days=1)
-    
-    while start_date <= end_date:
-        dates.append(start_date.strftime('%Y-%m-%d'))
-        start_date += delta
-    
-    return dates
-
-def download_co_data(lat, lon, start_year, end_year, scale=1000):
-    region = ee.Geometry.Point(lon, lat).buffer(25000)  # 25 km buffer radius
-    dates = generate_dates(start_year, end_year)
-    
-    data = []
-
-    for i in range(len(dates) - 1):
-        start_date = dates[i]
-        end_date = dates[i + 1]
-        try:
-            co_conc = get_co_data(start_date, end_date, region, scale)
-            if co_conc is not None:
-                data.append([start_date, co_conc * 1e9])  # Convert from mol/m^2 to ppb
-            else:
-                data.append([start_date, None])
-            print(f"Downloaded data for {start_date} to {end_date}")
-        except Exception as e:
-            print(f"Error on {start_date} to {end_date}: {e}")
-            data.append([start_date, None])
-
-    # Handle the last date separately if needed
-    last_date = dates[-1]
-    try:
-        co_conc = get_co_data(last_date, last_date, region, scale)
-        if co_conc is not None:
-            data.append([last_date, co_conc * 1e9])
-        else:
-            data.append([last_date, None])
-        print(f"Downloaded data for {last_date}")
-    except Exception as e:
-        print(f"Error on {last_date}: {e}")
-        data.append([last_date, None])
-
-    df = pd.DataFrame(data, columns=['Date', 'CO_conc_ppb'])
-    df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d').dt.strftime('%d%m%Y')
-    df.to_csv('dataset/historical_co_density.csv', index=False)
-    print("Data saved to historical_co_density.csv")
+    end_date = datetime.date(end_year + 1, 1, 1)
+
+    # Finished chunks are appended to a per-location checkpoint, so a rerun
+    # only fetches the dates that are still missing.
+    checkpoint = Checkpoint(
+        os.path.join(checkpoint_dir, f'co_{lat:.4f}_{lon:.4f}.csv'),
+        ['Date', 'CO_conc_ppb']
+    )
+    done = {date for (date,) in checkpoint.done('Date')}
+
+    tasks = []
+    for chunk_start, chunk_end in date_chunks(start_date, end_date, chunk):
+        missing = [day for day in pd.date_range(chunk_start, chunk_end, inclusive='left').date
+                   if day.isoformat() not in done]
+        if missing:
+            task = (missing[0], missing[-1] + datetime.timedelta(days=1))
+            tasks.append((f'{task[0]} to {task[1]}', task))
+
+    # The daily XCO values are computed server-side and come back with one
+    # request per chunk; days before Sentinel-5P data exists are not queried.
+    def fetch(task):
+        rows = fetch_series('CO', region, task[0], task[1], scale, chunk)
+        return [(day.isoformat(), value) for day, value in rows]
+
+    print(f"{len(done)} days already downloaded, {len(tasks)} chunks to fetch with {max_workers} workers")
+    failed = run_tasks(tasks, fetch, checkpoint, max_workers=max_workers)
+    if failed:
+        print(f"{len(failed)} chunks failed; run again to retry them")
+
+    df = pd.read_csv(checkpoint.path)
+    df = df[(df['Date'] >= start_date.isoformat()) & (df['Date'] < end_date.isoformat())]
+    df = df.drop_duplicates('Date', keep='last')
+    rows = store.append(pd.DataFrame({
+        'city': city,
+        'date': df['Date'],
+        'pollutant': 'CO',
+        'value': df['CO_conc_ppb'],
+    }), root=store_dir)
+    print(f"{rows} new days saved to {store_dir}")
+
+def read_cities(path, default_buffer=25000):
+    # CSV with city, lat, lon and an optional buffer column (meters)
+    cities = pd.read_csv(path)
+    if 'buffer' not in cities:
+        cities['buffer'] = default_buffer
+    cities['buffer'] = cities['buffer'].fillna(default_buffer)
+    return [(str(row.city), float(row.lat), float(row.lon), float(row.buffer))
+            for row in cities.itertuples(index=False)]
+
+def download_batch(cities, start_year, end_year, pollutants=('CO',), scale=1000, chunk='month',
+                   max_workers=4, job='batch', store_dir=store.STORE_DIR, checkpoint_dir=CHECKPOINT_DIR):
+    # All cities are reduced together per date chunk with reduceRegions, so the
+    # number of EE requests depends on the date range, not on the city count
+    # (until cities x days exceeds what one request may return, see
+    # fetch_regions_chunk).
+    if isinstance(cities, str):
+        cities = read_cities(cities)
+    names = [name for name, _, _, _ in cities]
+    pollutants = [pollutant.upper() for pollutant in pollutants]
+    start_date = datetime.date(start_year, 1, 1)
+    end_date = datetime.date(end_year + 1, 1, 1)
+
+    checkpoint = Checkpoint(
+        os.path.join(checkpoint_dir, f'{job}.csv'),
+        ['city', 'date', 'pollutant', 'value']
+    )
+    done = checkpoint.done('city', 'date', 'pollutant')
+
+    tasks = []
+    for pollutant in pollutants:
+        for chunk_start, chunk_end in date_chunks(start_date, end_date, chunk):
+            days = pd.date_range(chunk_start, chunk_end, inclusive='left').date
+            if any((city, day.isoformat(), pollutant) not in done for day in days for city in names):
+                tasks.append((f'{pollutant} {chunk_start} to {chunk_end}', (pollutant, chunk_start, chunk_end)))
+
+    def fetch(task):
+        pollutant, chunk_start, chunk_end = task
+        rows = fetch_regions_chunk(pollutant, cities, chunk_start, chunk_end, scale)
+        return [(city, day.isoformat(), pollutant, value) for city, day, value in rows]
+
+    print(f"{len(cities)} cities, {len(tasks)} chunks to fetch with {max_workers} workers")
+    failed = run_tasks(tasks, fetch, checkpoint, max_workers=max_workers)
+    if failed:
+        print(f"{len(failed)} chunks failed; run again to retry them")
+
+    df = pd.read_csv(checkpoint.path)
+    df = df[df['city'].isin(names) & df['pollutant'].isin(pollutants)]
+    df = df[(df['date'] >= start_date.isoformat()) & (df['date'] < end_date.isoformat())]
+    df = df.drop_duplicates(['city', 'date', 'pollutant'], keep='last')
+    rows = store.append(df, root=store_dir)
+    print(f"{rows} new rows saved to {store_dir}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download daily CO history for a location')
     # Example coordinates for the region of interest
-    lat = 29.7604  # Houston latitude
-    lon = -95.3698  # Houston longitude
-
-    # Download CO data for 10 years
-    download_co_data(lat, lon, 2014, 2023)
+    parser.add_argument('--lat', type=float, default=29.7604)  # Houston latitude
+    parser.add_argument('--lon', type=float, default=-95.3698)  # Houston longitude
+    parser.add_argument('--city', default='Houston')
+    parser.add_argument('--start-year', type=int, default=2014)
+    parser.add_argument('--end-year', type=int, default=2023)
+    parser.add_argument('--chunk', choices=['month', 'year'], default='month')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--cities', help='CSV of city,lat,lon[,buffer] to download together')
+    parser.add_argument('--pollutants', nargs='+', default=['CO'])
+    parser.add_argument('--offline', action='store_true', help='Use the local synthetic Earth Engine backend')
+    parser.add_argument('--metrics-file', help='Write Prometheus metrics here when done (textfile collector)')
+    args = parser.parse_args()
+
+    if args.offline:
+        use_local()
+    # Initialize the Earth Engine API
+    ee.Initialize()
+
+    if args.cities:
+        download_batch(args.cities, args.start_year, args.end_year, pollutants=args.pollutants,
+                       chunk=args.chunk, max_workers=args.workers,
+                       job=os.path.splitext(os.path.basename(args.cities))[0])
+    else:
+        # Download CO data for 10 years
+        download_co_data(args.lat, args.lon, args.start_year, args.end_year, city=args.city,
+                         chunk=args.chunk, max_workers=args.workers)
+
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
@@ -0,0 +1,135 @@
+import csv
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flaskapp import metrics
+
+
+# Messages Earth Engine uses when a request is throttled rather than wrong
+QUOTA_ERRORS = (
+    'too many concurrent',
+    'quota',
+    'rate limit',
+    'too many requests',
+    '429',
+    'computation timed out',
+)
+
+
+def is_quota_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in QUOTA_ERRORS)
+
+
+def with_retries(fn, retries=5, backoff=2.0, max_backoff=60.0):
+    # Call fn(), retrying throttling errors with exponential backoff and jitter
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not is_quota_error(e):
+                raise
+            metrics.ERRORS.inc('retry', type(e).__name__)
+            delay = min(max_backoff, backoff * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+class Checkpoint:
+    # Append-only CSV of finished rows. Every chunk is written as soon as it
+    # completes so a crashed or interrupted download can resume from here.
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(path):
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerow(self.columns)
+
+    def rows(self):
+        with open(self.path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def done(self, *key_columns):
+        return {tuple(row[c] for c in key_columns) for row in self.rows()}
+
+    def append(self, rows):
+        with self._lock:
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                for row in rows:
+                    writer.writerow(['' if value is None else value for value in row])
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class Progress:
+    # Prints one line per finished task with throughput and an ETA
+
+    def __init__(self, total_tasks, unit='days'):
+        self.total_tasks = total_tasks
+        self.unit = unit
+        self.done_tasks = 0
+        self.failed_tasks = 0
+        self.items = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, label, items=0, failed=False):
+        with self._lock:
+            self.done_tasks += 1
+            self.failed_tasks += int(failed)
+            self.items += items
+            elapsed = time.perf_counter() - self.started
+            rate = self.items / elapsed if elapsed else 0.0
+            remaining = self.total_tasks - self.done_tasks
+            eta = elapsed / self.done_tasks * remaining if self.done_tasks else 0.0
+            status = 'FAILED' if failed else 'ok'
+            print(f"[{self.done_tasks}/{self.total_tasks}] {label} {status} | "
+                  f"{self.items} {self.unit}, {rate:.1f} {self.unit}/s, "
+                  f"elapsed {elapsed:.0f}s, eta {eta:.0f}s")
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.items / elapsed if elapsed else 0.0
+        return (f"{self.done_tasks - self.failed_tasks}/{self.total_tasks} chunks ok, "
+                f"{self.failed_tasks} failed, {self.items} {self.unit} in {elapsed:.0f}s "
+                f"({rate:.1f} {self.unit}/s)")
+
+
+def _timed(fetch, task):
+    with metrics.span('download_chunk'):
+        return fetch(task)
+
+
+def run_tasks(tasks, fetch, checkpoint, max_workers=4, retries=5, backoff=2.0):
+    # Run fetch(task) -> rows for every task on a bounded thread pool, appending
+    # each result to the checkpoint as it arrives. tasks is a list of
+    # (label, task) pairs. Failed tasks are reported and left out of the
+    # checkpoint so the next run picks them up again.
+    progress = Progress(len(tasks))
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(with_retries, lambda t=task: _timed(fetch, t), retries, backoff): label
+            for label, task in tasks
+        }
+        for future in as_completed(futures):
+            label = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"Error on {label}: {e}")
+                failed.append(label)
+                progress.update(label, failed=True)
+                continue
+            checkpoint.append(rows)
+            progress.update(label, items=len(rows))
+    print(progress.summary())
+    return failed
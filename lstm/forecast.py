@@ -0,0 +1,74 @@
+import numpy as np
+
+from flaskapp import metrics
+
+
+class RingBuffer:
+    # The last seq_length scaled values of many series. Every value is stored
+    # twice, seq_length apart, so the current window is always one contiguous
+    # slice and pushing a step never reallocates or shifts the history.
+
+    def __init__(self, history, seq_length):
+        history = np.asarray(history, dtype=np.float32)
+        if history.ndim == 1:
+            history = history[None]
+        if history.shape[1] < seq_length:
+            raise ValueError(f'need at least {seq_length} values per series, got {history.shape[1]}')
+        self.seq_length = seq_length
+        self._data = np.empty((history.shape[0], 2 * seq_length), dtype=np.float32)
+        self._data[:, :seq_length] = history[:, -seq_length:]
+        self._data[:, seq_length:] = history[:, -seq_length:]
+        self._pos = 0
+
+    def window(self):
+        # (n_series, seq_length, 1) view, oldest value first
+        return self._data[:, self._pos:self._pos + self.seq_length, None]
+
+    def push(self, values):
+        self._data[:, self._pos] = values
+        self._data[:, self._pos + self.seq_length] = values
+        self._pos = (self._pos + 1) % self.seq_length
+
+
+def make_predictor(model):
+    # array (batch, seq_length, 1) -> array (batch, 1). Keras models are called
+    # through a compiled tf.function, which avoids model.predict's per-call
+    # setup; other runtimes can provide their own predict_batch.
+    if hasattr(model, 'predict_batch'):
+        return model.predict_batch
+
+    import tensorflow as tf
+
+    call = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    return lambda x: call(tf.convert_to_tensor(x, dtype=tf.float32)).numpy()
+
+
+def forecast(model, histories, horizon, seq_length, predictor=None):
+    # Autoregressive forecast of `horizon` steps for every row of `histories`
+    # (already scaled), one batched model call per step
+    predictor = predictor or make_predictor(model)
+    buffer = RingBuffer(histories, seq_length)
+    predictions = np.empty((buffer._data.shape[0], horizon), dtype=np.float32)
+    with metrics.span('forecast'):
+        for step in range(horizon):
+            values = np.asarray(predictor(buffer.window())).reshape(-1)
+            predictions[:, step] = values
+            buffer.push(values)
+    return predictions
+
+
+def inverse_scale(scaler, values):
+    values = np.asarray(values)
+    return scaler.inverse_transform(values.reshape(-1, 1)).reshape(values.shape)
+
+
+def forecast_many(model, series, scalers, horizon, seq_length, predictor=None):
+    # Forecast several unscaled series (e.g. one per city) with their own
+    # fitted scalers as a single batch. Scaling is applied once on the way in
+    # and inverted once on the way out.
+    histories = np.stack([
+        scaler.transform(np.asarray(s[-seq_length:], dtype=np.float64).reshape(-1, 1)).reshape(-1)
+        for s, scaler in zip(series, scalers)
+    ])
+    scaled = forecast(model, histories, horizon, seq_length, predictor)
+    return np.stack([inverse_scale(scaler, row) for row, scaler in zip(scaled, scalers)])
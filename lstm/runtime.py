@@ -0,0 +1,156 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lstm.artifact import MANIFEST, load_artifact
+
+
+# Inference for the trained networks with NumPy only, so web workers never
+# import TensorFlow. The layer stack comes from the Keras config saved in the
+# artifact and the weights from its .npy files (Keras order: LSTM kernel,
+# recurrent kernel, bias; Dense kernel, bias). LSTM gates are packed i, f, c, o
+# as in Keras. Every call runs the whole batch through each time step at once.
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 0.5 * np.tanh(0.5 * x) + 0.5,  # no overflow for large |x|
+}
+
+# Layers that do nothing at inference time
+SKIPPED_LAYERS = {'InputLayer', 'Dropout', 'SpatialDropout1D', 'GaussianNoise'}
+
+
+def _activation(name):
+    if isinstance(name, dict):
+        name = name.get('config')  # Keras 3 may serialise activations as objects
+    try:
+        return ACTIVATIONS[name]
+    except KeyError:
+        raise ValueError(f'Unsupported activation: {name}')
+
+
+def layer_specs(model_config):
+    # [(class name, config)] of the layers that have to be computed
+    config = model_config.get('config', model_config)
+    layers = config['layers'] if isinstance(config, dict) else config
+    specs = []
+    for layer in layers:
+        name, layer_config = layer['class_name'], layer['config']
+        if name in SKIPPED_LAYERS:
+            continue
+        if name not in ('LSTM', 'Dense'):
+            raise ValueError(f'Unsupported layer: {name}')
+        if name == 'LSTM' and (layer_config.get('go_backwards') or layer_config.get('stateful')):
+            raise ValueError('Only forward, stateless LSTM layers are supported')
+        specs.append((name, layer_config))
+    return specs
+
+
+class LSTMLayer:
+
+    def __init__(self, config, kernel, recurrent_kernel, bias=None):
+        self.units = config['units']
+        self.return_sequences = config.get('return_sequences', False)
+        self.activation = _activation(config.get('activation', 'tanh'))
+        self.recurrent_activation = _activation(config.get('recurrent_activation', 'sigmoid'))
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.recurrent_kernel = np.asarray(recurrent_kernel, dtype=np.float32)
+        self.bias = np.zeros(4 * self.units, np.float32) if bias is None else np.asarray(bias, dtype=np.float32)
+
+    def __call__(self, x):
+        # x: (batch, steps, features)
+        batch, steps, _ = x.shape
+        units = self.units
+        # The input projection of every step in one matrix product
+        projected = (x.reshape(batch * steps, -1) @ self.kernel + self.bias).reshape(batch, steps, 4 * units)
+        h = np.zeros((batch, units), np.float32)
+        c = np.zeros((batch, units), np.float32)
+        outputs = np.empty((batch, steps, units), np.float32) if self.return_sequences else None
+        for t in range(steps):
+            z = projected[:, t] + h @ self.recurrent_kernel
+            i = self.recurrent_activation(z[:, :units])
+            f = self.recurrent_activation(z[:, units:2 * units])
+            g = self.activation(z[:, 2 * units:3 * units])
+            o = self.recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * self.activation(c)
+            if outputs is not None:
+                outputs[:, t] = h
+        return outputs if outputs is not None else h
+
+
+class DenseLayer:
+
+    def __init__(self, config, kernel, bias=None):
+        self.activation = _activation(config.get('activation', 'linear'))
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.bias = None if bias is None else np.asarray(bias, dtype=np.float32)
+
+    def __call__(self, x):
+        y = x @ self.kernel
+        if self.bias is not None:
+            y = y + self.bias
+        return self.activation(y)
+
+
+class NumpyModel:
+
+    def __init__(self, model_config, weights):
+        self.layers = []
+        weights = list(weights)
+        position = 0
+        for name, config in layer_specs(model_config):
+            count = (2 if name == 'LSTM' else 1) + int(config.get('use_bias', True))
+            tensors = weights[position:position + count]
+            if len(tensors) < count:
+                raise ValueError('The artifact has fewer weight tensors than its layers need')
+            position += count
+            self.layers.append(LSTMLayer(config, *tensors) if name == 'LSTM' else DenseLayer(config, *tensors))
+        if position != len(weights):
+            raise ValueError(f'The artifact has {len(weights)} weight tensors, its layers use {position}')
+        self.nbytes = sum(np.asarray(w).nbytes for w in weights)
+
+    def predict_batch(self, x):
+        # (batch, seq_length, features) -> (batch, outputs), like model(x)
+        y = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            y = layer(y)
+        return y
+
+    __call__ = predict_batch
+
+
+def load_numpy_model(artifact):
+    # The weights are copied out of the memory-mapped files once, as float32
+    return NumpyModel(artifact.manifest['model_config'], artifact.weights)
+
+
+def compare(artifact, batch_size=64, seed=0):
+    # Largest absolute difference between the NumPy and Keras outputs on
+    # random windows; needs TensorFlow
+    from lstm.artifact import build_keras_model
+
+    rng = np.random.default_rng(seed)
+    x = rng.random((batch_size, artifact.seq_length, len(artifact.features)), dtype=np.float32)
+    expected = build_keras_model(artifact)(x, training=False).numpy()
+    return float(np.abs(load_numpy_model(artifact).predict_batch(x) - expected).max())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the NumPy runtime reproduces a Keras model artifact')
+    parser.add_argument('artifacts', nargs='+', help=f'artifact directories (holding {MANIFEST})')
+    parser.add_argument('--tolerance', type=float, default=1e-5)
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.artifacts:
+        error = compare(load_artifact(path))
+        ok = error <= args.tolerance
+        failed = failed or not ok
+        print(f"{path}: max abs difference {error:.2e} {'ok' if ok else 'ABOVE TOLERANCE'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,125 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+# Partitioned Parquet store of daily values, laid out as
+#   dataset/store/pollutant=CO/city=Houston/year=2023/part-<ns>-0.parquet
+# New days are written as new part files, so history is never rewritten.
+STORE_DIR = 'dataset/store'
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('pollutant', pa.string()), ('city', pa.string()), ('year', pa.int16())]),
+    flavor='hive'
+)
+
+SCHEMA = pa.schema([
+    ('date', pa.timestamp('ns')),
+    ('value', pa.float32()),
+    ('pollutant', pa.string()),
+    ('city', pa.string()),
+    ('year', pa.int16()),
+])
+
+
+def _normalise(df):
+    # Long format (city, date, pollutant, value) with typed columns
+    df = df[['city', 'date', 'pollutant', 'value']].copy()
+    df['city'] = df['city'].astype(str)
+    df['pollutant'] = df['pollutant'].astype(str).str.upper()
+    df['date'] = pd.to_datetime(df['date'])
+    df['value'] = pd.to_numeric(df['value'], errors='coerce').astype('float32')
+    df['year'] = df['date'].dt.year.astype('int16')
+    return df
+
+
+def _dataset(root):
+    return ds.dataset(root, format='parquet', partitioning=PARTITIONING, schema=SCHEMA)
+
+
+def append(df, root=STORE_DIR, skip_existing=True):
+    # Write new rows as fresh part files in their pollutant/city/year partitions.
+    # With skip_existing, days already in the store are left out.
+    df = _normalise(df)
+    if skip_existing and os.path.isdir(root) and len(df):
+        existing = []
+        for (pollutant, city), part in df.groupby(['pollutant', 'city']):
+            stored = load(pollutant, city, part['date'].min(), part['date'].max(), root=root)
+            existing.append(pd.DataFrame({'pollutant': pollutant, 'city': city, 'date': stored.index}))
+        existing = pd.concat(existing, ignore_index=True)
+        df = df.merge(existing, on=['pollutant', 'city', 'date'], how='left', indicator=True)
+        df = df[df['_merge'] == 'left_only'].drop(columns='_merge')
+    if df.empty:
+        return 0
+
+    table = pa.Table.from_pandas(df[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+    ds.write_dataset(
+        table,
+        root,
+        format='parquet',
+        partitioning=PARTITIONING,
+        basename_template=f'part-{time.time_ns()}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore'
+    )
+    return len(df)
+
+
+def load(pollutant, city, start_date=None, end_date=None, root=STORE_DIR, columns=('value',)):
+    # Daily values for one pollutant and city in [start_date, end_date], indexed
+    # by date. Only the matching partitions and columns are read.
+    pollutant = pollutant.upper()
+    expr = (ds.field('pollutant') == pollutant) & (ds.field('city') == city)
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+        expr &= (ds.field('year') >= start_date.year) & (ds.field('date') >= start_date)
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+        expr &= (ds.field('year') <= end_date.year) & (ds.field('date') <= end_date)
+
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=list(columns), index=pd.DatetimeIndex([], name='date'))
+    table = _dataset(root).to_table(columns=['date'] + list(columns), filter=expr)
+    df = table.to_pandas()
+    # Later part files win when a day was written more than once
+    df = df.drop_duplicates('date', keep='last').sort_values('date')
+    return df.set_index('date')
+
+
+def cities(pollutant=None, root=STORE_DIR):
+    if not os.path.isdir(root):
+        return []
+    expr = None if pollutant is None else ds.field('pollutant') == pollutant.upper()
+    table = _dataset(root).to_table(columns=['city'], filter=expr)
+    return sorted(set(table.column('city').to_pylist()))
+
+
+def import_csv(path, city=None, pollutant='CO', root=STORE_DIR):
+    # Load either the long-format batch CSV or the old single-city
+    # historical_co_density.csv (Date as %d%m%Y, CO_conc_ppb)
+    df = pd.read_csv(path)
+    if 'CO_conc_ppb' in df:
+        if city is None:
+            raise ValueError('city is required for single-city CSV files')
+        df = pd.DataFrame({
+            'city': city,
+            'date': pd.to_datetime(df['Date'].astype(str).str.zfill(8), format='%d%m%Y'),
+            'pollutant': pollutant,
+            'value': df['CO_conc_ppb'],
+        })
+    return append(df, root=root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a CSV dataset into the Parquet store')
+    parser.add_argument('csv')
+    parser.add_argument('--city')
+    parser.add_argument('--pollutant', default='CO')
+    parser.add_argument('--root', default=STORE_DIR)
+    args = parser.parse_args()
+
+    rows = import_csv(args.csv, city=args.city, pollutant=args.pollutant, root=args.root)
+    print(f"Imported {rows} rows into {args.root}")
@@ -1,60 +1,164 @@
-import pandas as pd
-import numpy as np
+import argparse
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sklearn.preprocessing import MinMaxScaler
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense
-from tensorflow.keras.callbacks import ModelCheckpoint
 import datetime
 
-# Load the historical CO density data
-data = pd.read_csv('dataset/historical_co_density.csv')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Ensure the Date column is in the correct datetime format
-data['Date'] = pd.to_datetime(data['Date'], format='%d%m%Y')
+from flaskapp import metrics
+from lstm import store
+from lstm.artifact import MODEL_DIR, model_path, save_artifact
+from lstm.windowing import WindowedSeries
 
-# Sort data by date
-data = data.sort_values('Date')
+seq_length = 30  # Number of time steps to look back
 
-# Prepare the data for LSTM
-# Set the date column as index
-data.set_index('Date', inplace=True)
 
-# Normalize the data
-scaler = MinMaxScaler(feature_range=(0, 1))
-scaled_data = scaler.fit_transform(data[['CO_conc_ppb']])
+def build_model(seq_length, n_features=1):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Input, LSTM, Dense
 
-# Create sequences of time steps
-def create_sequences(data, seq_length):
-    xs, ys = [], []
-    for i in range(len(data) - seq_length):
-        x = data[i:i + seq_length]
-        y = data[i + seq_length]
-        xs.append(x)
-        ys.append(y)
-    return np.array(xs), np.array(ys)
+    model = Sequential()
+    model.add(Input(shape=(seq_length, n_features)))
+    model.add(LSTM(50, return_sequences=True))
+    model.add(LSTM(50, return_sequences=False))
+    model.add(Dense(25))
+    model.add(Dense(1))
+
+    # Compile the model
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+
+def load_training_data(pollutant, city, store_dir=store.STORE_DIR):
+    # Load the historical density data, indexed and sorted by date. Gaps between
+    # observed days are interpolated; leading/trailing days without data are dropped.
+    data = store.load(pollutant, city, root=store_dir)
+    data['value'] = data['value'].interpolate(limit_area='inside')
+    return data.dropna()
+
+
+def train_model(pollutant, city, batch_size=64, epochs=50, patience=5, threads=None,
+                store_dir=store.STORE_DIR, model_dir=MODEL_DIR):
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import Callback, EarlyStopping
+
+    if threads:
+        # Keep parallel workers from oversubscribing the CPU
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    label = f'{pollutant}/{city}'
+    with metrics.span('load_training_data'):
+        data = load_training_data(pollutant, city, store_dir)
+
+    # Normalize the data
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaled_data = scaler.fit_transform(data[['value']])
+
+    # Split the windows into training and test sets
+    windows = WindowedSeries(scaled_data, seq_length)
+    train, test = windows.split(0.8)
+    if not len(train) or not len(test):
+        raise ValueError(f'{label}: not enough data to train ({len(data)} days)')
+
+    # The training windows are reshuffled every epoch; validation batches are cached
+    train_ds = train.tf_dataset(batch_size, shuffle=True)
+    test_ds = test.tf_dataset(batch_size).cache()
+
+    class EpochTimer(Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            elapsed = time.perf_counter() - self.started
+            metrics.STAGE_SECONDS.observe(elapsed, 'train_epoch')
+            print(f"{label} epoch {epoch + 1}: {elapsed:.1f}s, "
+                  f"{len(train) / elapsed:.0f} samples/s, "
+                  f"loss {logs['loss']:.5f}, val_loss {logs['val_loss']:.5f}")
+
+    model = build_model(seq_length)
+
+    # Stop once the validation loss stops improving and keep the best weights
+    callbacks = [
+        EarlyStopping(monitor='val_loss', mode='min', patience=patience, restore_best_weights=True),
+        EpochTimer(),
+    ]
+
+    started = time.perf_counter()
+    with metrics.span('fit'):
+        history = model.fit(train_ds, validation_data=test_ds, epochs=epochs, callbacks=callbacks, verbose=0)
+    elapsed = time.perf_counter() - started
+
+    # The artifact bundles the weights with the fitted scaler, seq_length and
+    # recent history, so inference never needs the dataset
+    path = model_path(pollutant, city, model_dir)
+    os.makedirs(model_dir, exist_ok=True)
+    with metrics.span('save_artifact'):
+        save_artifact(path, model, scaler, seq_length, data, pollutant=pollutant, city=city)
+
+    print(f"{label}: trained {len(history.history['loss'])} epochs in {elapsed:.1f}s, saved to '{path}'")
+    return {
+        'pollutant': pollutant,
+        'city': city,
+        'path': path,
+        'epochs': len(history.history['loss']),
+        'val_loss': float(min(history.history['val_loss'])),
+        'seconds': elapsed,
+    }
 
-seq_length = 30  # Number of time steps to look back
-X, y = create_sequences(scaled_data, seq_length)
 
-# Split the data into training and test sets
-split = int(0.8 * len(X))
-X_train, y_train = X[:split], y[:split]
-X_test, y_test = X[split:], y[split:]
+def train_all(jobs, workers=1, **kwargs):
+    # Train one model per (pollutant, city) job, optionally on a process pool.
+    # Each worker gets an equal share of the CPU cores for TensorFlow.
+    results = []
+    if workers <= 1:
+        for pollutant, city in jobs:
+            try:
+                results.append(train_model(pollutant, city, **kwargs))
+            except Exception as e:
+                print(f"Training failed for {pollutant}/{city}: {e}")
+        return results
 
-# Build the LSTM model
-model = Sequential()
-model.add(LSTM(50, return_sequences=True, input_shape=(seq_length, 1)))
-model.add(LSTM(50, return_sequences=False))
-model.add(Dense(25))
-model.add(Dense(1))
+    kwargs.setdefault('threads', max(1, (os.cpu_count() or 1) // workers))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(train_model, pollutant, city, **kwargs): (pollutant, city)
+                   for pollutant, city in jobs}
+        for future in as_completed(futures):
+            pollutant, city = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Training failed for {pollutant}/{city}: {e}")
+    return results
 
-# Compile the model
-model.compile(optimizer='adam', loss='mean_squared_error')
 
-# Define a checkpoint to save the best model
-checkpoint = ModelCheckpoint('model/co_lstm_model.h5', save_best_only=True, monitor='val_loss', mode='min')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train LSTM models from the dataset store')
+    parser.add_argument('--pollutants', nargs='+', default=['CO'])
+    parser.add_argument('--cities', nargs='+', default=['Houston'],
+                        help="city names, or 'all' for every city in the store")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--patience', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help='models trained in parallel')
+    parser.add_argument('--metrics-file', help='Write Prometheus metrics here when done (textfile collector); '
+                                               'stages of models trained in worker processes are not included')
+    args = parser.parse_args()
 
-# Train the model
-model.fit(X_train, y_train, validation_data=(X_test, y_test), epochs=10, batch_size=1, callbacks=[checkpoint])
+    jobs = []
+    for pollutant in args.pollutants:
+        cities = store.cities(pollutant) if args.cities == ['all'] else args.cities
+        jobs.extend((pollutant.upper(), city) for city in cities)
 
-print("Model training completed and saved to 'model/co_lstm_model.h5'")
+    started = time.perf_counter()
+    results = train_all(jobs, workers=args.workers, batch_size=args.batch_size,
+                        epochs=args.epochs, patience=args.patience)
+    print(f"Model training completed: {len(results)}/{len(jobs)} models in {time.perf_counter() - started:.1f}s")
+    print(metrics.summary())
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
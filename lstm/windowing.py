@@ -0,0 +1,96 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _as_2d(data):
+    data = np.asarray(data)
+    return data[:, None] if data.ndim == 1 else data
+
+
+def make_windows(data, seq_length):
+    # Strided views over a (time, features) array: X[i] is data[i:i + seq_length]
+    # and y[i] is data[i + seq_length]. Nothing is copied until X is indexed.
+    data = _as_2d(data)
+    if len(data) <= seq_length:
+        empty = np.empty((0, seq_length, data.shape[1]), dtype=data.dtype)
+        return empty, data[:0]
+    X = sliding_window_view(data[:-1], seq_length, axis=0).transpose(0, 2, 1)
+    y = data[seq_length:]
+    return X, y
+
+
+def last_window(data, seq_length):
+    # The most recent seq_length steps, shaped (1, seq_length, features)
+    return _as_2d(data)[-seq_length:][None]
+
+
+class WindowedSeries:
+    # Windows over one or more series (e.g. one per city) that never cross a
+    # series boundary. All series share one contiguous buffer and windows are
+    # only materialised a batch at a time.
+
+    def __init__(self, series, seq_length, target_columns=None):
+        if isinstance(series, np.ndarray) or not isinstance(series, (list, tuple)):
+            series = [series]
+        series = [_as_2d(s) for s in series]
+        self.seq_length = seq_length
+        self.n_features = series[0].shape[1]
+        self.target_columns = (list(range(self.n_features))
+                               if target_columns is None else list(target_columns))
+
+        self.data = np.concatenate(series).astype(np.float32, copy=False)
+        if len(self.data) < seq_length:
+            self._windows = np.empty((0, seq_length, self.n_features), dtype=np.float32)
+        else:
+            self._windows = sliding_window_view(self.data, seq_length, axis=0).transpose(0, 2, 1)
+
+        # Start offsets of every window whose target is in the same series
+        starts = []
+        offset = 0
+        for s in series:
+            n_windows = len(s) - seq_length
+            if n_windows > 0:
+                starts.append(np.arange(offset, offset + n_windows))
+            offset += len(s)
+        self.starts = np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def split(self, fraction):
+        # Two views of the same buffer, first `fraction` of windows and the rest
+        head, tail = self._copy(), self._copy()
+        cut = int(fraction * len(self.starts))
+        head.starts, tail.starts = self.starts[:cut], self.starts[cut:]
+        return head, tail
+
+    def _copy(self):
+        other = object.__new__(WindowedSeries)
+        other.__dict__.update(self.__dict__)
+        return other
+
+    def batch(self, starts):
+        X = self._windows[starts]
+        y = self.data[starts + self.seq_length][:, self.target_columns]
+        return X, y
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        starts = self.starts
+        if shuffle:
+            starts = np.random.default_rng(seed).permutation(starts)
+        for i in range(0, len(starts), batch_size):
+            yield self.batch(starts[i:i + batch_size])
+
+    def tf_dataset(self, batch_size, shuffle=False, seed=None):
+        # tf.data pipeline over the batch generator; TensorFlow is only imported here
+        import tensorflow as tf
+
+        signature = (
+            tf.TensorSpec(shape=(None, self.seq_length, self.n_features), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, len(self.target_columns)), dtype=tf.float32),
+        )
+        dataset = tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, shuffle=shuffle, seed=seed),
+            output_signature=signature
+        )
+        return dataset.prefetch(tf.data.AUTOTUNE)
@@ -1,23 +1,248 @@
+import json
 import pickle
 import sys
 import os
+import threading
+import time
 from builtins import dict
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 
 import pandas as pd
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS, cross_origin
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 app = Flask(__name__, static_folder='./aqi-frontend/build/static',
             template_folder='./aqi-frontend/build')
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
 
+MODEL_FILE = os.environ.get('MODEL_FILE', 'xgb.pkl')
+MAX_BATCH_ROWS = 100000
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class ModelCache:
+    # The unpickled model, loaded once per worker and reloaded when the file's
+    # mtime (or size) changes; the file is stat'ed at most every check_interval
+    # seconds. A failed reload keeps serving the model already loaded.
+
+    def __init__(self, filename: str, check_interval: float = 1.0):
+        self.filename = filename
+        self.check_interval = check_interval
+        self.loads = 0
+        self._model = None
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._checked = time.monotonic()
+        try:
+            stat = os.stat(self.filename)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature != self._signature:
+                with open(self.filename, 'rb') as f:
+                    self._model = pickle.load(f)
+                self._signature = signature
+                self.loads += 1
+        except Exception as e:
+            if self._model is None:
+                raise ModelUnavailable(f'Could not load {self.filename}: {e}') from e
+            # e.g. a file still being written; tried again after check_interval
+            print(f"Keeping the loaded model, reloading {self.filename} failed: {e}")
+
+    def get(self):
+        if self._model is None or time.monotonic() - self._checked > self.check_interval:
+            with self._lock:
+                if self._model is None or time.monotonic() - self._checked > self.check_interval:
+                    self._load()
+        return self._model
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(filename: str):
+    with _models_lock:
+        cache = _models.get(filename)
+        if cache is None:
+            cache = _models[filename] = ModelCache(filename)
+    return cache.get()
+
+
+def feature_frame(model, rows) -> pd.DataFrame:
+    # DataFrame of the feature rows, columns in the order the model was trained on
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    names = getattr(model, 'feature_names_in_', None)
+    if names is None and hasattr(model, 'get_booster'):
+        names = model.get_booster().feature_names
+    if names is not None:
+        missing = [name for name in names if name not in df.columns]
+        if missing:
+            raise ValueError(f'Missing features: {", ".join(missing)}')
+        df = df[list(names)]
+    return df
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class WeatherClient:
+    # Current weather per city from OpenWeatherMap (or any server answering
+    # the same query at base_url). Connections are pooled and kept alive,
+    # every call has connect/read timeouts and idempotent failures are retried.
+    # Answers are cached per city for ttl seconds; after that the cached one is
+    # still served for up to stale_ttl seconds while a background refresh runs.
+    # Concurrent misses for one city share a single upstream call.
+
+    def __init__(self, base_url: str, api_key: str = None, ttl: float = 600, stale_ttl: float = 3600,
+                 not_found_ttl: float = 60, timeout=(2.0, 3.0), retries: int = 2, max_wait: float = 8.0,
+                 pool_size: int = 16, max_entries: int = 1000):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.not_found_ttl = not_found_ttl
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.max_entries = max_entries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=Retry(
+            total=retries, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=['GET'], respect_retry_after_header=False, raise_on_status=False))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.upstream_calls = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._cache = OrderedDict()  # city -> (status, body, fetched_at)
+        self._inflight = {}  # city -> Future
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='weather')
+
+    def _fetch(self, city: str):
+        params = {'q': city, 'units': 'metric'}
+        if self.api_key:
+            params['APPID'] = self.api_key
+        with self._lock:
+            self.upstream_calls += 1
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise UpstreamError(f'Weather service unavailable: {e}')
+        if response.status_code >= 500 or response.status_code == 429:
+            raise UpstreamError(f'Weather service answered {response.status_code}')
+        return response.status_code, body, time.monotonic()
+
+    def _start(self, city: str) -> Future:
+        # The in-flight upstream call for city, starting one if there is none
+        with self._lock:
+            future = self._inflight.get(city)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = self._inflight[city] = Future()
+
+        def run():
+            try:
+                entry = self._fetch(city)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                    del self._inflight[city]
+                future.set_exception(e)
+                return
+            with self._lock:
+                self._cache[city] = entry
+                self._cache.move_to_end(city)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                del self._inflight[city]
+            future.set_result(entry)
+
+        self._refresher.submit(run)
+        return future
+
+    def get(self, city: str):
+        # (upstream status, body); raises UpstreamError when nothing usable is cached
+        # and the upstream call fails or takes longer than max_wait
+        city = ' '.join(city.split()).lower()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(city)
+            if entry is not None:
+                self._cache.move_to_end(city)
+        if entry is not None:
+            status, body, fetched_at = entry
+            age = now - fetched_at
+            fresh_for = self.ttl if status == 200 else self.not_found_ttl
+            if age < fresh_for:
+                with self._lock:
+                    self.hits += 1
+                return status, body
+            if status == 200 and age < self.stale_ttl:
+                # Serve what we have and refresh in the background
+                with self._lock:
+                    self.stale_hits += 1
+                self._start(city)
+                return status, body
+
+        with self._lock:
+            self.misses += 1
+        try:
+            status, body, _ = self._start(city).result(timeout=self.max_wait)
+        except FutureTimeout:
+            raise UpstreamError('Weather service did not answer in time')
+        return status, body
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'upstream_calls': self.upstream_calls, 'hits': self.hits, 'stale_hits': self.stale_hits,
+                    'misses': self.misses, 'coalesced': self.coalesced, 'errors': self.errors,
+                    'cities': len(self._cache), 'in_flight': len(self._inflight)}
+
+
+weather = WeatherClient(os.environ.get('WEATHER_BASE_URL', 'https://api.openweathermap.org/data/2.5/weather'),
+                        os.environ.get('API_KEY'))
+
 
 def predict_aqi(data: dict, filename: str) -> float:
-    df = pd.DataFrame([data])
-    model = pickle.load(open(filename, 'rb'))
-    return model.predict(df)[0]
+    model = get_model(filename)
+    return model.predict(feature_frame(model, [data]))[0]
+
+
+def predict_many(df: pd.DataFrame, filename: str) -> list:
+    # One vectorized predict call for every row
+    model = get_model(filename)
+    return model.predict(feature_frame(model, df)).tolist()
+
+
+def read_rows(content_type: str, stream) -> pd.DataFrame:
+    # JSON array of objects, CSV with a header row, or NDJSON (one object per
+    # line), parsed straight from the request stream
+    if content_type == 'text/csv':
+        return pd.read_csv(stream)
+    if content_type in ('application/x-ndjson', 'application/jsonl'):
+        return pd.read_json(stream, lines=True, dtype=False, convert_dates=False)
+    rows = json.load(stream)
+    if not isinstance(rows, list):
+        raise ValueError('expected a JSON array of feature objects')
+    return pd.DataFrame(rows)
 
 
 @app.route('/')
@@ -30,10 +255,21 @@ def index() -> str:
 @app.route('/city')
 @cross_origin()
 def get_city_data() -> dict:
-    city = request.args['city']
-    api_key = os.environ.get('API_KEY')
-    url = f'https://api.openweathermap.org/data/2.5/weather?q={city}&APPID={api_key}&units=metric'
-    return jsonify(requests.get(url).json())
+    city = request.args.get('city', '').strip()
+    if not city:
+        return jsonify({'error': 'city is a required parameter.'}), 400
+    try:
+        status, body = weather.get(city)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), 502
+    # Upstream errors such as an unknown city are passed on as they come
+    return jsonify(body), status
+
+
+@app.route('/city/stats')
+@cross_origin()
+def get_city_stats() -> dict:
+    return jsonify(weather.stats())
 
 
 @app.route('/aqi-frontend')
@@ -47,14 +283,34 @@ def render_frontend():
 def predict() -> dict:
     try:
         formData = request.json
-        print(formData)
-        result = str(predict_aqi(formData, 'xgb.pkl'))
+        result = str(predict_aqi(formData, MODEL_FILE))
     except:
         print(sys.exc_info())
         result = 'Server error'
     return jsonify(result)
 
 
+@app.route('/predict/batch', methods=['POST'])
+@cross_origin()
+def predict_batch() -> dict:
+    try:
+        df = read_rows(request.mimetype, request.stream)
+    except ValueError as e:
+        return jsonify({'error': f'Could not parse rows: {e}'}), 400
+    if len(df) > MAX_BATCH_ROWS:
+        return jsonify({'error': f'At most {MAX_BATCH_ROWS} rows per request.'}), 413
+    if not len(df):
+        return jsonify({'predictions': []})
+    try:
+        predictions = predict_many(df, MODEL_FILE)
+    except ModelUnavailable as e:
+        print(e)
+        return jsonify({'error': 'The AQI model is not available.'}), 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'predictions': predictions})
+
+
 if __name__ == '__main__':
     is_prod = bool(os.environ.get('IS_HEROKU', False))
     app.run(debug=~is_prod)
\ No newline at end of file
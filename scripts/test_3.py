@@ -1,25 +1,11 @@
-import ee
+import os
+import requests
 import plotly.graph_objs as go
-import calendar
 import plotly.io as pio
-from google.oauth2 import service_account
 
-# # Authorize ee
-# ee.Authenticate()
-
-# # Initialize the Earth Engine API
-# ee.Initialize(project='ee-anisharubeena2023four')
-
-
-SERVICE_ACCOUNT_FILE = 'config/creds2.json'
-
-
-# Authenticate to GEE using the service account
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE,
-    scopes=['https://www.googleapis.com/auth/cloud-platform']
-)
-ee.Initialize(credentials)
+# The app keeps the daily series and aggregates them, so this script only
+# asks for the monthly means
+API_URL = os.environ.get('PREDICT_AEROSOLS_URL', 'http://127.0.0.1:5000')
 
 # Define the coordinates for Bangalore, India
 hyderabad_lat = 29.7604 #12.971599
@@ -27,65 +13,26 @@ hyderabad_lon = -95.3698 #77.594566
 
 # Define a buffer around the point to cover an area around Hyderabad (25 kilometers)
 buffer_radius = 50000  # 25 kilometers in meters
-buffered_hyderabad_geometry = ee.Geometry.Point(hyderabad_lon, hyderabad_lat).buffer(buffer_radius)
-
-# Constants
-g = 9.82  # m/s^2
-m_H2O = 0.01801528  # kg/mol
-m_dry_air = 0.0289644  # kg/mol
-
-# Function to calculate mean CO concentration for a given month
-def extract_month_data(month):
-    start_date = ee.Date.fromYMD(2023, month, 1)
-    end_date = ee.Date.fromYMD(2023, month, calendar.monthrange(2023, month)[1])
-
-    # Filter the collections for the given month
-    filtered_collection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CO') \
-        .filterBounds(buffered_hyderabad_geometry) \
-        .filterDate(start_date, end_date) \
-        .select(['CO_column_number_density', 'H2O_column_number_density'])
-
-    surface_pressure_collection = ee.ImageCollection("ECMWF/ERA5_LAND/DAILY_AGGR") \
-        .filterBounds(buffered_hyderabad_geometry) \
-        .filterDate(start_date, end_date) \
-        .select('surface_pressure')
-
-    # Check if the collections are empty
-    if filtered_collection.size().getInfo() == 0 or surface_pressure_collection.size().getInfo() == 0:
-        return None
-
-    # Calculate the mean over the collection for CO, H2O, and surface pressure
-    CO_mean_month = filtered_collection.select('CO_column_number_density').mean().clip(buffered_hyderabad_geometry)
-    H2O_mean_month = filtered_collection.select('H2O_column_number_density').mean().clip(buffered_hyderabad_geometry)
-    surface_pressure_mean_month = surface_pressure_collection.mean().clip(buffered_hyderabad_geometry)
-
-    # Calculate TC_dry_air for the month
-    TC_dry_air_month = surface_pressure_mean_month.divide(g * m_dry_air).subtract(H2O_mean_month.multiply(m_H2O / m_dry_air))
-
-    # Calculate XCO for the month
-    XCO_month = CO_mean_month.divide(TC_dry_air_month).rename('XCO')
-
-    # Convert XCO to ppb
-    XCO_ppb_month = XCO_month.multiply(1e9).rename('XCO_ppb')
 
-    # Calculate the mean CO concentration for the month
-    mean_value = XCO_ppb_month.reduceRegion(
-        reducer=ee.Reducer.mean(),
-        geometry=buffered_hyderabad_geometry,
-        scale=1000
-    ).get('XCO_ppb')
-    return mean_value
+response = requests.get(f'{API_URL}/api/timeseries', params={
+    'pollutant': 'CO',
+    'lat': hyderabad_lat,
+    'lon': hyderabad_lon,
+    'buffer': buffer_radius,
+    'start_date': '2023-01-01',
+    'end_date': '2024-01-01',
+    'freq': 'monthly',
+}, timeout=300)
+response.raise_for_status()
+monthly = {row['period']: row['value'] for row in response.json()['series']}
 
 # Extract CO concentration values for each month
 co_values = []
 for month in range(1, 13):
-    value = extract_month_data(month)
+    value = monthly.get(f'2023-{month:02d}')
     if value is not None:
-        value = round(value.getInfo(), 3)  # Round to 3 decimals
-        print(f"Month: {month}, Value: {value}")  # Debug statement
-    else:
-        value = None
-        print(f"Month: {month}, Value: None")  # Debug statement
+        value = round(value, 3)  # Round to 3 decimals
+    print(f"Month: {month}, Value: {value}")  # Debug statement
     co_values.append(value)
 
 print(co_values)
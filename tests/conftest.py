@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskapp.backends import set_backend, use_local
+from lstm.artifact import load_artifact, save_artifact
+
+
+class RandomModel:
+    # Keras-like stand-in (config and weights of an LSTM + Dense network) for
+    # writing artifacts without TensorFlow
+
+    def __init__(self, seq_length, units=8, seed=0):
+        rng = np.random.default_rng(seed)
+        self.config = {'class_name': 'Sequential', 'config': {'name': 'sequential', 'layers': [
+            {'class_name': 'InputLayer', 'config': {'batch_shape': [None, seq_length, 1]}},
+            {'class_name': 'LSTM', 'config': {'units': units, 'activation': 'tanh',
+                                              'recurrent_activation': 'sigmoid', 'use_bias': True,
+                                              'return_sequences': False}},
+            {'class_name': 'Dense', 'config': {'units': 1, 'activation': 'linear', 'use_bias': True}},
+        ]}}
+        self.weights = [rng.normal(0, 0.3, (1, 4 * units)), rng.normal(0, 0.3, (units, 4 * units)),
+                        rng.normal(0, 0.1, 4 * units), rng.normal(0, 0.3, (units, 1)), np.zeros(1)]
+
+    def to_json(self):
+        return json.dumps(self.config)
+
+    def get_weights(self):
+        return self.weights
+
+
+@pytest.fixture
+def make_artifact(tmp_path):
+    # Writes model/<pollutant>_<city> under tmp_path, the layout model_path expects
+    def make(seq_length=30, pollutant='CO', city='Testville', model=None, days=400):
+        data = pd.DataFrame({'value': np.linspace(50, 150, days)},
+                            index=pd.date_range('2023-01-01', periods=days, freq='D'))
+        scaler = MinMaxScaler().fit(data[['value']])
+        path = os.path.join(tmp_path, 'model', f"{pollutant.lower()}_{city.lower().replace(' ', '_')}")
+        save_artifact(path, model or RandomModel(seq_length), scaler, seq_length, data, pollutant=pollutant,
+                      city=city)
+        return load_artifact(path)
+    return make
+
+
+@pytest.fixture
+def local_ee():
+    # The synthetic Earth Engine backend without added latency; the real
+    # client is restored afterwards
+    backend = use_local(latency=0, jitter=0)
+    backend.reset_stats()
+    yield backend
+    set_backend(None)
+
+
+@pytest.fixture
+def app(local_ee, tmp_path):
+    from flaskapp.app import create_app
+
+    return create_app({
+        'TESTING': True,
+        'EE_BACKEND': 'local',
+        'LOCAL_EE_LATENCY': 0,
+        'CO_DENSITY_CACHE_DB': None,
+        'TILE_CACHE_DB': str(tmp_path / 'tiles.mbtiles'),
+        'TIMESERIES_DB': str(tmp_path / 'timeseries.db'),
+        'STATS_INDEX_DB': None,
+        'RASTER_STORE_DIR': None,
+        'REGIONS_FILE': None,
+        'FORECAST_PRELOAD': None,
+    })
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
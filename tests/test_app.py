@@ -0,0 +1,82 @@
+import threading
+
+from flaskapp.app import _offloader, _result_cache
+
+DENSITY = '/api/get-co-density?lat=29.7604&lon=-95.3698&buffer=25000&start_date=2024-01-01&end_date=2024-01-15'
+
+
+def test_repeat_request_is_a_cache_hit(client, local_ee):
+    first = client.get(DENSITY)
+    assert first.status_code == 200
+    rpcs = local_ee.rpc_count()
+
+    # A click a few meters away resolves to the same region and cache entry
+    second = client.get(DENSITY.replace('29.7604', '29.7606'))
+    assert second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert local_ee.rpc_count() == rpcs
+    with client.application.app_context():
+        assert _result_cache().stats()['hits'] == 1
+
+
+def test_invalid_parameters(client):
+    assert client.get('/api/get-co-density?lat=100&lon=0').status_code == 400
+    assert client.get('/api/get-co-density?lat=0&lon=0&buffer=10').status_code == 400
+    assert client.get('/api/get-co-density?region=Atlantis').status_code == 404
+
+
+def test_full_queue_returns_503(app, client):
+    app.config.update(EE_WORKERS=1, EE_QUEUE_SIZE=0)
+    release = threading.Event()
+    with app.app_context():
+        busy = _offloader().submit('busy', release.wait, 5)
+    try:
+        response = client.get(DENSITY)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+    finally:
+        release.set()
+        busy.result(5)
+    assert client.get(DENSITY).status_code == 200
+
+
+def test_rate_limit_returns_429(app, client):
+    app.config.update(RATE_LIMIT=1.0, RATE_BURST=1)
+    client.get(DENSITY)
+    response = client.get(DENSITY)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_timeseries_fills_gaps(client, local_ee):
+    url = '/api/timeseries?region=Houston&start_date=2023-01-01&end_date=2023-04-01&freq=monthly'
+    first = client.get(url)
+    assert first.status_code == 200
+    assert [p['period'] for p in first.get_json()['series']] == ['2023-01', '2023-02', '2023-03']
+
+    rpcs = local_ee.rpc_count()
+    assert client.get(url.replace('2023-04-01', '2023-02-01')).status_code == 200
+    assert local_ee.rpc_count() == rpcs
+
+    wider = client.get(url.replace('2023-04-01', '2023-06-01'))
+    assert [p['period'] for p in wider.get_json()['series']][-1] == '2023-05'
+    assert local_ee.rpc_count() > rpcs
+
+
+def test_timeseries_limits(app, client):
+    app.config.update(MAX_SERIES_FETCH_DAYS=100, MAX_ADHOC_SERIES=1)
+    url = '/api/timeseries?lat=10&lon=10&start_date=2023-01-01&end_date=2023-03-01'
+    assert client.get(url.replace('2023-03-01', '2024-01-01')).status_code == 400
+    assert client.get(url).status_code == 200
+    # The ad-hoc series exists now, so it can be extended; a second place cannot be added
+    assert client.get(url.replace('2023-03-01', '2023-04-01')).status_code == 200
+    assert client.get(url.replace('lat=10', 'lat=20')).status_code == 400
+    # Catalogue regions are not limited
+    assert client.get('/api/timeseries?region=Delhi&start_date=2023-01-01&end_date=2023-03-01').status_code == 200
+
+
+def test_nearest_region(client):
+    response = client.get('/api/regions?lat=29.7&lon=-95.3')
+    assert response.get_json()['region'] == 'Houston'
+    assert client.get('/api/regions?lat=-80&lon=150&max_distance=10000000').status_code == 400
+    assert client.get('/api/regions?lat=-80&lon=150').status_code == 404
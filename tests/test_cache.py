@@ -0,0 +1,62 @@
+from flaskapp.cache import ResultCache, make_key, snap
+
+
+def test_snap_shares_key_for_nearby_clicks():
+    assert snap(29.76041) == snap(29.75962) == 29.76
+    assert make_key('co', 29.76041, -95.3698, 25000, '2024-01-01', '2024-02-01') == \
+        make_key('CO', 29.7596, -95.3702, 25000, '2024-01-01', '2024-02-01')
+
+
+def test_hit_and_miss():
+    cache = ResultCache()
+    assert cache.get('a') is None
+    cache.put('a', {'min': 1, 'max': 2})
+    assert cache.get('a') == {'min': 1, 'max': 2}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_expired_entries_miss():
+    cache = ResultCache(ttl=0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_sqlite_persistence(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(db_path=path)
+    cache.put('a', {'tile_url': '/tiles/x/{z}/{x}/{y}.png'})
+
+    restarted = ResultCache(db_path=path)
+    assert restarted.get('a') == {'tile_url': '/tiles/x/{z}/{x}/{y}.png'}
+    assert restarted.stats()['persistent']
+
+
+def test_oversized_entries_are_not_persisted(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(max_bytes=100, db_path=path)
+    cache.put('big', 'x' * 1000)
+    assert cache.get('big') is None
+    assert ResultCache(db_path=path).get('big') is None
+
+
+def test_evicted_entries_leave_sqlite(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = ResultCache(max_entries=1, db_path=path)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    restarted = ResultCache(db_path=path)
+    assert restarted.get('a') is None
+    assert restarted.get('b') == 2
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from lstm.forecast import RingBuffer, forecast
+from lstm.runtime import load_numpy_model
+
+
+class MeanModel:
+    # Predicts the mean of each window
+    def predict_batch(self, x):
+        return x.mean(axis=1)
+
+
+def naive_forecast(history, horizon, seq_length):
+    values = list(history[-seq_length:])
+    for _ in range(horizon):
+        values.append(np.float32(np.mean(np.asarray(values[-seq_length:], dtype=np.float32))))
+    return values[seq_length:]
+
+
+def test_ring_buffer_keeps_last_window():
+    buffer = RingBuffer(np.arange(10.0), 4)
+    np.testing.assert_array_equal(buffer.window()[0, :, 0], [6, 7, 8, 9])
+    for value in (10, 11, 12, 13, 14):
+        buffer.push(np.array([value]))
+    np.testing.assert_array_equal(buffer.window()[0, :, 0], [11, 12, 13, 14])
+
+
+def test_ring_buffer_needs_seq_length_values():
+    with pytest.raises(ValueError):
+        RingBuffer(np.arange(3.0), 4)
+    # seq_length 1 still works
+    buffer = RingBuffer(np.arange(3.0), 1)
+    buffer.push(np.array([7.0]))
+    assert buffer.window()[0, 0, 0] == 7
+
+
+@pytest.mark.parametrize('seq_length', [1, 3, 30])
+def test_forecast_matches_step_by_step(seq_length):
+    rng = np.random.default_rng(0)
+    histories = rng.random((3, 40), dtype=np.float32)
+    predictions = forecast(MeanModel(), histories, 10, seq_length)
+    for history, row in zip(histories, predictions):
+        np.testing.assert_allclose(row, naive_forecast(history, 10, seq_length), rtol=1e-5)
+
+
+def reference_lstm(weights, x):
+    # Keras' LSTM equations, one sample and one step at a time
+    kernel, recurrent, bias, dense_kernel, dense_bias = (np.asarray(w, dtype=np.float64) for w in weights)
+    units = recurrent.shape[0]
+    sigmoid = lambda z: 1 / (1 + np.exp(-z))
+    outputs = []
+    for sample in x:
+        h, c = np.zeros(units), np.zeros(units)
+        for step in sample:
+            z = step @ kernel + h @ recurrent + bias
+            i, f, g, o = (z[k * units:(k + 1) * units] for k in range(4))
+            c = sigmoid(f) * c + sigmoid(i) * np.tanh(g)
+            h = sigmoid(o) * np.tanh(c)
+        outputs.append(h @ dense_kernel + dense_bias)
+    return np.array(outputs)
+
+
+def test_numpy_runtime_matches_lstm_equations(make_artifact):
+    artifact = make_artifact(seq_length=14)
+    x = np.random.default_rng(1).random((5, 14, 1), dtype=np.float32)
+    np.testing.assert_allclose(load_numpy_model(artifact).predict_batch(x), reference_lstm(artifact.weights, x),
+                               atol=1e-5)
+
+
+def test_numpy_runtime_matches_keras(make_artifact):
+    pytest.importorskip('tensorflow')
+    from lstm.runtime import compare
+    from lstm.train import build_model
+
+    artifact = make_artifact(seq_length=14, model=build_model(14))
+    assert compare(artifact) <= 1e-5
+
+
+def test_forecasts_use_the_artifact_seq_length(make_artifact, tmp_path, monkeypatch):
+    from flaskapp.forecasting import ForecastBatcher, ModelPool, load_entry
+
+    make_artifact(seq_length=14)
+    monkeypatch.chdir(tmp_path)
+    entry = load_entry('CO', 'Testville')
+    assert entry.seq_length == 14 and len(entry.history) == 14
+
+    batcher = ForecastBatcher(ModelPool())
+    short, long = batcher.submit('CO', 'Testville', 3), batcher.submit('co', 'testville', 7)
+    short, long = short.result(5), long.result(5)
+    assert len(short) == 3 and len(long) == 7
+    # Requests for one model share a forecast
+    assert short == long[:3]
+    assert long[0]['date'] == '2024-02-05'
+
+    with pytest.raises(KeyError):
+        batcher.submit('CO', 'Nowhere', 3).result(5)
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from flaskapp.offload import Offloader, QueueFull
+
+
+def test_identical_keys_share_one_computation():
+    offloader = Offloader(max_workers=2, max_queue=2)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    first = offloader.submit('key', compute)
+    second = offloader.submit('key', compute)
+    assert first is second
+    release.set()
+    assert first.result(5) == 42
+    assert len(calls) == 1
+    assert offloader.stats()['coalesced'] == 1
+
+
+def test_full_queue_is_rejected():
+    offloader = Offloader(max_workers=1, max_queue=1)
+    release = threading.Event()
+    futures = [offloader.submit(key, release.wait, 5) for key in ('a', 'b')]
+    with pytest.raises(QueueFull):
+        offloader.submit('c', release.wait, 5)
+    assert offloader.stats()['rejected'] == 1
+
+    release.set()
+    for future in futures:
+        future.result(5)
+    # Slots are given back once computations finish
+    assert offloader.submit('c', lambda: 'done').result(5) == 'done'
+
+
+def test_timeout_leaves_computation_running():
+    offloader = Offloader(max_workers=1, max_queue=0)
+    release = threading.Event()
+    with pytest.raises(TimeoutError):
+        offloader.run('slow', release.wait, 5, timeout=0.05)
+    assert offloader.stats()['timeouts'] == 1
+    assert offloader.stats()['in_flight'] == 1
+    release.set()
+    assert offloader.submit('slow', release.wait, 5).result(5)
@@ -0,0 +1,31 @@
+import random
+
+from flaskapp.regions import CATALOGUE, Place, RegionIndex, distance
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(0)
+    places = [Place(f'p{i}', rng.uniform(-80, 80), rng.uniform(-180, 180), 1000, None) for i in range(500)]
+    index = RegionIndex(places)
+    for _ in range(200):
+        lat, lon = rng.uniform(-85, 85), rng.uniform(-180, 180)
+        max_distance = rng.choice([2000, 100000, 500000])
+        place, d = min(((p, distance(lat, lon, p.lat, p.lon)) for p in places), key=lambda found: found[1])
+        found = index.nearest(lat, lon, max_distance)
+        if d > max_distance:
+            assert found is None
+        else:
+            assert found[0] == place
+
+
+def test_nearest_wraps_at_antimeridian():
+    index = RegionIndex([Place('Taveuni', -16.8, 179.95, 10000, None)] + CATALOGUE)
+    place, d = index.nearest(-16.8, -179.95, 50000)
+    assert place.name == 'Taveuni' and d < 11000
+
+
+def test_resolve_snaps_other_clicks():
+    index = RegionIndex()
+    assert index.resolve(29.7605, -95.3697, 5000).name == 'Houston'
+    assert index.resolve(29.7605, -95.3697, 5000).buffer == 5000
+    assert index.resolve(10.00423, 10.00377, 5000) == Place(None, 10.0, 10.0, 5000, None)
@@ -0,0 +1,64 @@
+import pytest
+
+from flaskapp.pollutants import get_pollutant
+from flaskapp.shaping import (ClientLimiter, RateLimited, estimate_cost, parse_buffer, parse_dates, parse_point,
+                              shape)
+
+
+def test_parse_point_accepts_zero():
+    assert parse_point({'lat': '0', 'lon': '0'}) == (0.0, 0.0)
+    with pytest.raises(ValueError):
+        parse_point({'lat': '91', 'lon': '0'})
+    with pytest.raises(ValueError):
+        parse_point({'lat': '10'})
+
+
+def test_parse_buffer_and_dates():
+    assert parse_buffer({}) == 25000
+    with pytest.raises(ValueError):
+        parse_buffer({'buffer': '10'})
+    start, end = parse_dates({'start_date': '2017-01-01', 'end_date': '2019-01-01'}, '', '', max_days=None,
+                             earliest='2018-06-28')
+    assert start.isoformat() == '2018-06-28'
+    with pytest.raises(ValueError):
+        parse_dates({'start_date': '2020-01-01', 'end_date': '2024-01-01'}, '', '', max_days=366)
+
+
+def test_shape_downscales_before_sampling():
+    co = get_pollutant('CO')
+    assert shape(co, 25000, 30) == (1000, None, estimate_cost(co, 25000, 30))
+
+    scale, sample_days, cost = shape(co, 250000, 366)
+    assert scale > 1000 and sample_days is None and cost <= 20.0
+
+    scale, sample_days, cost = shape(co, 250000, 3 * 366, max_cost=1.0, max_scale=4000)
+    assert scale == 4000 and sample_days is not None
+
+
+def test_request_rate():
+    limiter = ClientLimiter(requests_per_second=1.0, burst=2)
+    limiter.check_rate('a')
+    limiter.check_rate('a')
+    with pytest.raises(RateLimited) as e:
+        limiter.check_rate('a')
+    assert 0 < e.value.retry_after <= 1.0
+    # Other clients have their own buckets
+    limiter.check_rate('b')
+    assert limiter.stats()['limited'] == 1
+
+
+def test_cost_budget():
+    limiter = ClientLimiter(cost_per_minute=60.0, cost_burst=10.0)
+    limiter.charge('a', 8.0)
+    with pytest.raises(RateLimited) as e:
+        limiter.charge('a', 8.0)
+    assert e.value.retry_after > 0
+    # Costs above the burst are charged as a full bucket, not refused forever
+    limiter.charge('b', 1000.0)
+
+
+def test_forgets_least_recent_clients():
+    limiter = ClientLimiter(max_clients=2)
+    for client in ('a', 'b', 'c'):
+        limiter.check_rate(client)
+    assert limiter.stats()['clients'] == 2
@@ -0,0 +1,71 @@
+import datetime
+
+import pytest
+
+from flaskapp import pollutants
+from flaskapp.regions import Place
+from flaskapp.timeseries import TimeseriesStore, ensure, gaps, update_all
+
+PLACE = Place(None, 29.76, -95.37, 25000, None)
+GRID = 0.01
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TimeseriesStore(str(tmp_path / 'timeseries.db'))
+
+
+@pytest.fixture
+def fetches(local_ee, monkeypatch):
+    # (start, end) of every range fetched from (local) Earth Engine
+    calls = []
+    fetch_series = pollutants.fetch_series
+
+    def record(pollutant, region, start, end, *args):
+        calls.append((start, end))
+        return fetch_series(pollutant, region, start, end, *args)
+
+    monkeypatch.setattr(pollutants, 'fetch_series', record)
+    return calls
+
+
+def day(value):
+    return datetime.date.fromisoformat(value)
+
+
+def test_only_missing_days_are_fetched(store, fetches):
+    key = ensure(store, 'CO', PLACE, '2023-03-01', '2023-05-01', GRID)
+    assert fetches == [(day('2023-03-01'), day('2023-05-01'))]
+
+    # Covered ranges are answered from the store
+    ensure(store, 'CO', PLACE, '2023-03-10', '2023-04-10', GRID)
+    assert len(fetches) == 1
+
+    # A wider range fetches the days before and after the stored ones
+    ensure(store, 'CO', PLACE, '2023-01-01', '2023-07-01', GRID)
+    assert fetches[1:] == [(day('2023-01-01'), day('2023-03-01')), (day('2023-05-01'), day('2023-07-01'))]
+    assert store.series(key)[key][2:] == (day('2023-01-01'), day('2023-07-01'))
+
+    monthly = store.query(key, '2023-01-01', '2023-07-01', 'monthly')
+    assert [period for period, _, _ in monthly] == ['2023-01', '2023-02', '2023-03', '2023-04', '2023-05', '2023-06']
+    assert len(store.query(key, '2023-01-01', '2023-07-01', 'daily')) == 181
+
+
+def test_recent_days_are_not_final(store):
+    today = datetime.date.today()
+    key, missing, _ = gaps(store, 'CO', PLACE, today - datetime.timedelta(days=30), today, GRID)
+    assert missing == [(today - datetime.timedelta(days=30), today - datetime.timedelta(days=5))]
+
+
+def test_days_before_the_mission_are_stored_as_missing(store, fetches):
+    key = ensure(store, 'CO', PLACE, '2018-06-01', '2018-08-01', GRID)
+    rows = store.query(key, '2018-06-01', '2018-08-01', 'daily')
+    assert rows[0] == ('2018-06-01', None, 0)
+
+
+def test_update_all_extends_tracked_series(store, fetches):
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=60)
+    ensure(store, 'CO', PLACE, start, today - datetime.timedelta(days=30), GRID)
+    update_all(store, GRID)
+    assert fetches[-1] == (today - datetime.timedelta(days=30), today - datetime.timedelta(days=5))
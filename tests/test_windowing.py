@@ -0,0 +1,44 @@
+import numpy as np
+
+from lstm.windowing import WindowedSeries, last_window, make_windows
+
+
+def test_make_windows():
+    data = np.arange(10, dtype=np.float32)
+    X, y = make_windows(data, 3)
+    assert X.shape == (7, 3, 1) and y.shape == (7, 1)
+    np.testing.assert_array_equal(X[0, :, 0], [0, 1, 2])
+    np.testing.assert_array_equal(X[-1, :, 0], [6, 7, 8])
+    np.testing.assert_array_equal(y[:, 0], np.arange(3, 10))
+
+
+def test_make_windows_short_series():
+    # Exactly seq_length values leave no target, one more gives one window
+    X, y = make_windows(np.arange(3.0), 3)
+    assert X.shape == (0, 3, 1) and y.shape == (0, 1)
+    X, y = make_windows(np.arange(4.0), 3)
+    assert X.shape == (1, 3, 1) and y[0, 0] == 3
+
+
+def test_last_window():
+    window = last_window(np.arange(10.0), 4)
+    assert window.shape == (1, 4, 1)
+    np.testing.assert_array_equal(window[0, :, 0], [6, 7, 8, 9])
+
+
+def test_windows_do_not_cross_series():
+    series = WindowedSeries([np.arange(5.0), 100 + np.arange(2.0), 200 + np.arange(4.0)], 2)
+    # 3 windows in the first series, none in the second, 2 in the third
+    assert len(series) == 5
+    X, y = series.batch(series.starts)
+    assert all(x[0, 0] // 100 == target[0] // 100 for x, target in zip(X, y))
+
+
+def test_split_and_batches():
+    series = WindowedSeries(np.arange(20.0), 5)
+    train, test = series.split(0.8)
+    assert len(train) + len(test) == len(series) == 15
+    batches = list(train.batches(4))
+    assert [len(X) for X, _ in batches] == [4, 4, 4]
+    shuffled = np.concatenate([y for _, y in train.batches(4, shuffle=True, seed=1)])
+    np.testing.assert_array_equal(np.sort(shuffled[:, 0]), np.arange(5.0, 17.0))
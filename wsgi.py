@@ -2,6 +2,8 @@ import sys
 import logging
 sys.path.insert(0, '/home/ubuntu/SSTA/flaskapp')
 
-from flaskapp.app import app as application
+from flaskapp.app import create_app
+
+application = create_app()
 
 logging.basicConfig(stream=sys.stderr)